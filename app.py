@@ -1,17 +1,36 @@
+import os
+import uuid
 import streamlit as st
 import pandas as pd
-from app_logic import AnalysisManager
+from app_logic import AnalysisManager, diff_history
+from config import SCRIPT_URL, SHEET_GIDS, SHEET_URL
+from exports import MIME_TYPES, export_history, filter_history
+from labels import BultoPlan, LabelSheet
+from label_files import FORMATS, submit_label_job
+from metrics import METRICS, start_metrics_server
+from outbox import CONFIRMED, FAILED, get_outbox
 from streamlit_searchbox import st_searchbox
 from datetime import datetime
 
 # --- CONFIGURACION MUY IMPORTANTE ---
-# 1. PEGA AQUÍ TU URL DE APPS SCRIPT (la que termina en /exec)
-SCRIPT_URL = "https://script.google.com/macros/s/AKfycbylFGmrFKbVTYcYWF998q0yzlQrWPkuWoWvGcx0Pwl87KTVpEfhy9Xm_ZqivpnE2aaXDw/exec"
-
-SHEET_URL = "https://docs.google.com/spreadsheets/d/1IhDCR-BkAl5mk9C20eCCzZ50dgYK5tw40Wt1owIIylQ"
+# 1. y 2. URL del Apps Script, URL del libro y gid de las pestañas: en config.py (también los usa import_cli.py)
 
 st.set_page_config(page_title="Gestión Biosintex", layout="wide")
 
+# 3. (OPCIONAL) Carpeta de cola de impresión: los PDF/ZPL de rótulos también se escriben ahí
+LABEL_SPOOL_DIR = os.environ.get("LABEL_SPOOL_DIR")
+
+# Cola local de envíos (SQLite junto a la app) y cuánto se espera la confirmación antes de seguir
+OUTBOX_PATH = os.environ.get("OUTBOX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "outbox.sqlite3"))
+OUTBOX_WAIT = 5
+
+# Foto local del catálogo e historial: las sesiones nuevas arrancan desde acá mientras se sincroniza
+WARM_START_PATH = os.environ.get("WARM_START_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "warm_start.sqlite3"))
+
+# Puerto opcional para que Prometheus lea /metrics (y /metrics.json)
+METRICS_PORT = os.environ.get("METRICS_PORT")
+if METRICS_PORT: start_metrics_server(int(METRICS_PORT))
+
 # --- CONSTANTES ---
 PRES_LIST = [
     "Cajas", "Bolsa blanca", "Bobina", "Tambor verde", "Bolsa", 
@@ -29,7 +48,7 @@ STAFF_BY_PLANT = {
 
 # Mensaje recordatorio
 if "AKfycb" not in SCRIPT_URL:
-    st.error("🛑 FALTA CONFIGURAR LA URL DE ESCRITURA. Ve al archivo app.py y pega tu URL de Apps Script en la línea 8.")
+    st.error("🛑 FALTA CONFIGURAR LA URL DE ESCRITURA. Ve al archivo config.py y pega tu URL de Apps Script.")
 
 # --- LOGIN ---
 if "password_correct" not in st.session_state:
@@ -48,47 +67,101 @@ if "password_correct" not in st.session_state:
 
 # --- INIT ---
 if 'manager' not in st.session_state:
-    st.session_state.manager = AnalysisManager(SHEET_URL, SCRIPT_URL)
+    st.session_state.manager = AnalysisManager(SHEET_URL, SCRIPT_URL, sheet_gids=SHEET_GIDS or None, warm_start_path=WARM_START_PATH)
 if 'env' not in st.session_state:
     st.session_state.env = "Producción"
 if 'form_id' not in st.session_state:
     st.session_state.form_id = 0
+if 'my_entries' not in st.session_state:
+    st.session_state.my_entries = [] # ids de la cola local enviados desde esta sesión
+
+# Cola durable compartida por el proceso; su hilo reintenta los envíos aunque se cierre la sesión
+outbox = get_outbox(OUTBOX_PATH, st.session_state.manager.save_entry_remote)
 
-def refresh_data():
+def load_outbox_label(rec):
+    """Muestra el rótulo de una entrada ya confirmada por el servidor"""
+    entry = rec['entry']
+    entry['Número de Análisis'] = rec['result'].get('analysis')
+    entry['recepcion_num'] = rec['result'].get('reception')
+    st.session_state.current_label = entry
+    st.session_state.show_label = True
+
+def refresh_data(force=False):
     with st.spinner("Sincronizando..."):
-        data = st.session_state.manager.get_excel_data()
+        # La caché del libro es compartida por todas las sesiones: sólo se descarga si venció o se fuerza
+        data = st.session_state.manager.get_excel_data(force=force)
         st.session_state.skus = data.get('skus', [])
         st.session_state.providers = data.get('providers', [])
+        st.session_state.sku_index = data.get('sku_index')
+        st.session_state.prov_index = data.get('prov_index')
         # También refrescar historial
         st.session_state.history = st.session_state.manager.get_history(env=st.session_state.env)
+        st.session_state.history_base = st.session_state.history
+        st.session_state.data_synced_at = st.session_state.manager.last_sync
+        st.session_state.data_source = "live"
+        st.session_state.data_gen = st.session_state.manager.data_generation(st.session_state.env)
+        if st.session_state.manager.last_error: st.error(f"Error de conexión: {st.session_state.manager.last_error}")
         if data.get('error'): st.warning(data['error'])
+        else: st.session_state.manager.revalidate_async(st.session_state.env) # sólo actualiza la foto en disco
+
+def warm_start():
+    """Carga la última foto guardada en disco y sincroniza en segundo plano. False si no hay foto"""
+    data = st.session_state.manager.warm_start_data(env=st.session_state.env)
+    if not data or not data['skus']: return False
+    for k in ('skus', 'providers', 'sku_index', 'prov_index', 'history'):
+        st.session_state[k] = data[k]
+    st.session_state.history_base = st.session_state.history
+    st.session_state.data_synced_at = data['synced_at']
+    st.session_state.data_source = "warm"
+    st.session_state.manager.revalidate_async(st.session_state.env)
+    return True
+
+def pick_up_data():
+    """Toma lo que dejó en memoria el hilo de refresco, sin descargar nada: el catálogo siempre,
+    el historial sólo si no hay ediciones sin guardar (ni en el editor ni ya volcadas a `history`)"""
+    manager = st.session_state.manager
+    data = manager.get_excel_data()
+    if data.get('error'): return
+    for k in ('skus', 'providers', 'sku_index', 'prov_index'):
+        st.session_state[k] = data[k]
+    # Al volcar ediciones, `history` pasa a ser otro DataFrame que `history_base`
+    pending = st.session_state.get('history') is not st.session_state.get('history_base') \
+        or st.session_state.get("hist_editor", {}).get("edited_rows")
+    if not pending:
+        st.session_state.history = manager.get_history(env=st.session_state.env)
+        st.session_state.history_base = st.session_state.history
+        st.session_state.data_gen = manager.data_generation(st.session_state.env)
+    st.session_state.data_synced_at = manager.last_sync
+    st.session_state.data_source = "live"
+
+def data_age(ts):
+    secs = int((datetime.now() - ts).total_seconds())
+    if secs < 60: return "hace instantes"
+    if secs < 3600: return f"hace {secs // 60} min"
+    if secs < 86400: return f"hace {secs // 3600} h"
+    return f"hace {secs // 86400} días"
+
+# Hilo del proceso que mantiene libro e historial al día antes de que venza la caché
+st.session_state.manager.start_refresher(st.session_state.env)
 
 if 'skus' not in st.session_state or not st.session_state.skus:
-    refresh_data()
+    if not warm_start():
+        refresh_data()
+elif st.session_state.manager.cache.is_fresh() and not st.session_state.manager.revalidating(st.session_state.env) \
+        and (st.session_state.get('data_source') == "warm" or st.session_state.get('data_gen') != st.session_state.manager.data_generation(st.session_state.env)):
+    # Hay datos nuevos ya sincronizados en segundo plano: se toman sin esperar ninguna descarga
+    pick_up_data()
 
 # --- BUSQUEDA ---
 def search_sku(q):
-    if not q or not st.session_state.skus: return []
-    q = q.lower()
-    res = []
-    for s in st.session_state.skus:
-        art = str(s.get('Articulo', s.get('ID', '')))
-        nom = str(s.get('Nombre', ''))
-        if q in art.lower() or q in nom.lower():
-            res.append((f"{art} - {nom}", art))
-    return res[:30]
+    # Índice armado en la sincronización: exacto, luego prefijo, luego contiene (máx. 30)
+    if not q or not st.session_state.get('sku_index'): return []
+    return st.session_state.sku_index.search(q)
 
 def search_prov(q):
-    if not q or not st.session_state.get('providers'): return []
-    q_low = q.lower()
-    res = []
-    for p in st.session_state.providers:
-        fila_texto = " ".join([str(v) for v in p.values()]).lower()
-        if q_low in fila_texto:
-            nombre = p.get('Proveedor', p.get('PROVEEDOR', p.get('Nombre', next(iter(p.values()), 'Sin nombre'))))
-            if nombre and str(nombre) != 'nan':
-                res.append(str(nombre))
-    return sorted(list(set(res)))[:30]
+    # Nombres únicos y ordenados, precompilados en la sincronización
+    if not q or not st.session_state.get('prov_index'): return []
+    return st.session_state.prov_index.search(q)
 
 # --- UI ---
 st.title(f"📦 Recepción Biosintex ({st.session_state.env})")
@@ -96,16 +169,43 @@ st.title(f"📦 Recepción Biosintex ({st.session_state.env})")
 with st.sidebar:
     # El entorno se fuerza a Producción por solicitud del usuario
     st.session_state.env = "Producción"
-    st.button("🔄 Sincronizar", on_click=refresh_data)
+    st.button("🔄 Sincronizar", on_click=refresh_data, kwargs={"force": True})
     
     if 'skus' in st.session_state:
         st.caption(f"✅ {len(st.session_state.skus)} SKUs cargados")
     if 'providers' in st.session_state:
         st.caption(f"✅ {len(st.session_state.providers)} Proveedores cargados")
+    pendientes = outbox.count()
+    if pendientes:
+        st.caption(f"📤 {pendientes} registro(s) pendientes de envío")
+    if st.session_state.get('data_synced_at'):
+        synced = st.session_state.data_synced_at
+        # Con datos vivos vale la última revalidación del libro, aunque no haya traído cambios
+        if st.session_state.get('data_source') == "live" and st.session_state.manager.last_sync:
+            synced = st.session_state.manager.last_sync
+        origen = " · foto local, actualizando..." if st.session_state.get('data_source') == "warm" else ""
+        st.caption(f"🕒 Sinc: {synced.strftime('%H:%M:%S')} ({data_age(synced)}){origen}")
     if hasattr(st.session_state.manager, 'last_sync') and st.session_state.manager.last_sync:
-        st.caption(f"🕒 Sinc: {st.session_state.manager.last_sync.strftime('%H:%M:%S')}")
-
-tab1, tab2 = st.tabs(["📝 Nuevo Registro", "📊 Historial"])
+        cache = st.session_state.manager.cache
+        st.caption(f"♻️ Sinc. sin cambios (omitidas): {cache.skipped} de {cache.stats['checks']}")
+    net = st.session_state.manager.http.stats()
+    if net['requests']:
+        st.caption(f"🔌 Conexiones reutilizadas: {net['reused_connections']} de {net['requests']} pedidos")
+
+    with st.expander("📈 Métricas (admin)"):
+        filas = [{
+            "Métrica": m["name"] + "".join(f" [{v}]" for v in m["labels"].values()),
+            "N": m.get("count", m.get("value")),
+            "p50 ms": round(m["p50"] * 1000, 1) if m["type"] == "timer" else None,
+            "p95 ms": round(m["p95"] * 1000, 1) if m["type"] == "timer" else None,
+            "máx ms": round(m["max"] * 1000, 1) if m["type"] == "timer" else None,
+        } for m in METRICS.snapshot()]
+        if filas: st.dataframe(pd.DataFrame(filas), hide_index=True, use_container_width=True)
+        else: st.caption("Sin datos todavía.")
+        st.download_button("JSON", METRICS.to_json(), file_name="metricas.json", mime="application/json")
+        st.download_button("Prometheus", METRICS.to_prometheus(), file_name="metricas.prom", mime="text/plain")
+
+tab1, tab_multi, tab2 = st.tabs(["📝 Nuevo Registro", "🧾 Remito con varias líneas", "📊 Historial"])
 
 with tab1:
     f_id = st.session_state.form_id
@@ -114,11 +214,9 @@ with tab1:
         st.subheader("Insumo")
         sku = st_searchbox(search_sku, label="Buscar SKU *", key=f"sku_in_{f_id}")
         sku_desc = ""
-        if sku:
-            for s in st.session_state.skus:
-                if str(s.get('Articulo', s.get('ID',''))) == str(sku):
-                    sku_desc = s.get('Nombre','')
-                    st.info(f"✅ PRODUCTO: {sku_desc}"); break
+        if sku and str(sku) in st.session_state.sku_index.by_code:
+            sku_desc = st.session_state.sku_index.describe(sku)
+            st.info(f"✅ PRODUCTO: {sku_desc}")
         
         lote = st.text_input("Número de Lote *", key=f"lote_in_{f_id}")
         vto = st.date_input("Vencimiento *", key=f"vto_in_{f_id}")
@@ -141,8 +239,8 @@ with tab1:
         with c_oc:
             oc = st.text_input("Nº Orden de Compra (OC)", key=f"oc_in_{f_id}")
         with c_rc:
-            current_state = st.session_state.manager.get_state(env=st.session_state.env)
-            next_rec = str(current_state.get("last_reception", 0) + 1)
+            # Desde la foto en disco no se espera la sincronización en curso
+            next_rec = st.session_state.manager.suggested_reception(env=st.session_state.env, cached_only=st.session_state.get('data_source') == "warm")
             st.text_input("Nº Recepción (Sugerido)", value=next_rec, disabled=True, key=f"rec_sug_{f_id}")
         
         c_pl, c_st1, c_st2 = st.columns([1, 1.5, 1.5])
@@ -171,20 +269,146 @@ with tab1:
                     'realizado_por': real, 'controlado_por': cont, 'Entorno': st.session_state.env,
                     'Planta': planta, 'OC': oc
                 }
-                ok, result = st.session_state.manager.save_entry_remote(entry, env=st.session_state.env)
-                if ok:
-                    entry['Número de Análisis'] = result.get('analysis')
-                    entry['recepcion_num'] = result.get('reception')
-                    st.session_state.current_label = entry
-                    st.session_state.show_label = True
-                    
-                    # --- REINICIO TOTAL DEL FORMULARIO ---
-                    # Incrementamos el form_id para que todos los widgets tengan llaves nuevas
-                    st.session_state.form_id += 1
-                    
+                # Números tomados del bloque reservado (si el script lo soporta); si no, los asigna el servidor
+                st.session_state.manager.assign_numbers([entry], env=st.session_state.env)
+                # Queda guardada localmente al instante; el envío (con reintentos) lo hace un hilo aparte
+                entry_id = outbox.enqueue(entry, st.session_state.env)
+                st.session_state.my_entries.append(entry_id)
+                rec = outbox.wait(entry_id, timeout=OUTBOX_WAIT)
+                if rec and rec['status'] == CONFIRMED:
+                    load_outbox_label(rec)
                     st.session_state.just_saved = True
+                else:
+                    st.session_state.just_queued = True
+                
+                # --- REINICIO TOTAL DEL FORMULARIO ---
+                # Incrementamos el form_id para que todos los widgets tengan llaves nuevas
+                st.session_state.form_id += 1
+                st.rerun()
+
+    if st.session_state.get('just_queued'):
+        st.warning("📤 Guardado localmente. Se enviará al servidor en segundo plano; el Nº de Análisis aparecerá abajo al confirmarse.")
+        st.session_state.just_queued = False
+
+    # --- ESTADO DE LOS ENVÍOS DE ESTA SESIÓN ---
+    if st.session_state.my_entries:
+        st.subheader("📤 Envíos")
+        st.button("🔄 Actualizar estado")
+        for entry_id in reversed(st.session_state.my_entries[-10:]):
+            rec = outbox.get(entry_id)
+            if rec is None: continue
+            e = rec['entry']
+            c_e1, c_e2, c_e3 = st.columns([3, 2, 1])
+            with c_e1:
+                st.write(f"{e.get('SKU')} · Lote {e.get('Lote')} · Remito {e.get('Número de Remito')}")
+            with c_e2:
+                if rec['status'] == CONFIRMED:
+                    st.write(f"✅ Análisis {rec['result'].get('analysis')} · Recepción {rec['result'].get('reception')}")
+                elif rec['status'] == FAILED:
+                    st.write(f"❌ Falló: {rec['error']}")
+                elif e.get('preassigned'):
+                    st.write(f"⏳ Análisis {e.get('Número de Análisis')} · Recepción {e.get('recepcion_num')} (pendiente, intentos: {rec['attempts']})")
+                else:
+                    st.write(f"⏳ Pendiente (intentos: {rec['attempts']})")
+            with c_e3:
+                if rec['status'] == CONFIRMED and st.button("🏷️ Rótulo", key=f"lbl_{entry_id}"):
+                    load_outbox_label(rec)
+                    st.rerun()
+                if rec['status'] == FAILED and st.button("🔁 Reintentar", key=f"retry_{entry_id}"):
+                    outbox.retry(entry_id)
                     st.rerun()
-                else: st.error(f"Error al guardar: {result}")
+
+with tab_multi:
+    # Varias líneas (SKU/lote) de un mismo remito: una sola llamada al servidor para todas
+    m_id = st.session_state.form_id
+    st.subheader("Datos del remito")
+    c_m1, c_m2, c_m3 = st.columns(3)
+    with c_m1:
+        m_prov = st_searchbox(search_prov, label="Proveedor *", key=f"m_prov_{m_id}")
+        m_rem = st.text_input("Nº Remito *", key=f"m_rem_{m_id}")
+    with c_m2:
+        m_oc = st.text_input("Nº Orden de Compra (OC)", key=f"m_oc_{m_id}")
+        m_planta = st.selectbox("Planta *", ["Barracas", "Pibera"], key=f"m_planta_{m_id}")
+    with c_m3:
+        m_staff = STAFF_BY_PLANT.get(m_planta, [])
+        m_real = st.selectbox("Realizado por *", ["Seleccione..."] + m_staff, key=f"m_real_{m_id}")
+        m_cont = st.selectbox("Controlado por *", ["Seleccione..."] + [s for s in m_staff if s != m_real], key=f"m_cont_{m_id}")
+
+    st.subheader("Líneas")
+    m_lines = st.data_editor(
+        pd.DataFrame({
+            "SKU": pd.Series(dtype=str), "Lote": pd.Series(dtype=str), "Vto": pd.Series(dtype="datetime64[ns]"),
+            "Origen": pd.Series(dtype=str), "Presentacion": pd.Series(dtype=str), "UDM": pd.Series(dtype=str),
+            "Cantidad": pd.Series(dtype=float), "Bultos": pd.Series(dtype=int),
+        }),
+        num_rows="dynamic",
+        use_container_width=True,
+        key=f"m_lines_{m_id}",
+        column_config={
+            "SKU": st.column_config.TextColumn("SKU *", required=True),
+            "Lote": st.column_config.TextColumn("Lote *", required=True),
+            "Vto": st.column_config.DateColumn("Vencimiento *", format="DD/MM/YYYY", required=True),
+            "Origen": st.column_config.SelectboxColumn("Origen", options=["Nacional", "Importado"], default="Nacional"),
+            "Presentacion": st.column_config.SelectboxColumn("Presentación", options=PRES_LIST, default=PRES_LIST[0]),
+            "UDM": st.column_config.SelectboxColumn("UDM", options=["KG", "UN", "L", "M"], default="KG"),
+            "Cantidad": st.column_config.NumberColumn("Cantidad Total", min_value=0.0, default=0.0),
+            "Bultos": st.column_config.NumberColumn("Bultos", min_value=1, step=1, default=1),
+        }
+    )
+
+    if st.button("🚀 GENERAR ANÁLISIS DEL REMITO", type="primary", use_container_width=True):
+        m_lines = m_lines.dropna(how='all')
+        errores = []
+        if not m_prov or not m_rem or m_real == "Seleccione...": errores.append("Faltan datos del remito.")
+        if m_lines.empty: errores.append("Agregue al menos una línea.")
+        for i, r in enumerate(m_lines.to_dict('records'), start=1):
+            if str(r.get("SKU") or "") not in st.session_state.sku_index.by_code: errores.append(f"Línea {i}: SKU '{r.get('SKU')}' no existe.")
+            if not r.get("Lote") or pd.isna(r.get("Lote")): errores.append(f"Línea {i}: falta el lote.")
+            if pd.isna(r.get("Vto")): errores.append(f"Línea {i}: falta el vencimiento.")
+            # Una celda borrada vuelve como NaN (que no es falsy): se valida explícitamente
+            if pd.isna(r.get("Cantidad")) or not r.get("Cantidad") > 0: errores.append(f"Línea {i}: la cantidad debe ser mayor a cero.")
+            if pd.isna(r.get("Bultos")) or not r.get("Bultos") >= 1: errores.append(f"Línea {i}: faltan los bultos.")
+        if errores:
+            st.error("⚠️ " + " ".join(errores))
+        else:
+            entries = []
+            for r in m_lines.to_dict('records'):
+                entries.append({
+                    'Fecha': datetime.now().strftime("%d/%m/%Y"), 'SKU': str(r["SKU"]),
+                    'Descripción de Producto': st.session_state.sku_index.describe(r["SKU"]),
+                    'Número de Análisis': "PENDIENTE", 'Lote': r["Lote"], 'Origen': r.get("Origen") or "Nacional",
+                    'Cantidad': float(r["Cantidad"]), 'UDM': r.get("UDM") or "KG", 'Cantidad Bultos': int(r["Bultos"]),
+                    'Vto': pd.Timestamp(r["Vto"]).strftime("%d/%m/%Y"), 'Proveedor': m_prov,
+                    'Número de Remito': m_rem, 'Presentacion': r.get("Presentacion") or PRES_LIST[0], 'recepcion_num': 0,
+                    'realizado_por': m_real, 'controlado_por': m_cont, 'Entorno': st.session_state.env,
+                    'Planta': m_planta, 'OC': m_oc, 'entry_id': uuid.uuid4().hex
+                })
+            with st.spinner(f"Generando {len(entries)} análisis en el servidor..."):
+                st.session_state.manager.assign_numbers(entries, env=st.session_state.env)
+                ok, results = st.session_state.manager.save_entries_remote(entries, env=st.session_state.env)
+            if not ok: results = [{"error": results}] * len(entries)
+            confirmados = []
+            for e, r in zip(entries, results):
+                if "error" in r:
+                    # Lo que no se pudo enviar queda en la cola local y se reintenta en segundo plano
+                    st.session_state.my_entries.append(outbox.enqueue(e, st.session_state.env))
+                else:
+                    e['Número de Análisis'] = r.get('analysis')
+                    e['recepcion_num'] = r.get('reception')
+                    confirmados.append(e)
+            st.session_state.batch_results = confirmados
+            if len(confirmados) < len(entries): st.session_state.just_queued = True
+            st.session_state.form_id += 1
+            st.rerun()
+
+    if st.session_state.get('batch_results'):
+        st.success(f"✅ {len(st.session_state.batch_results)} análisis generados.")
+        st.dataframe(pd.DataFrame(st.session_state.batch_results)[["SKU", "Lote", "Número de Análisis", "recepcion_num", "Cantidad", "Cantidad Bultos"]], hide_index=True)
+        b_sel = st.selectbox("Rótulo a imprimir:", [e['Número de Análisis'] for e in st.session_state.batch_results], key="batch_label_sel")
+        if st.button("🏷️ Cargar rótulo"):
+            st.session_state.current_label = next(e for e in st.session_state.batch_results if e['Número de Análisis'] == b_sel)
+            st.session_state.show_label = True
+            st.rerun()
 
 with tab2:
     # Mostrar mensaje de éxito si acaba de guardar
@@ -194,53 +418,36 @@ with tab2:
     st.subheader(f"📊 Historial de Cargas ({st.session_state.env})")
     
     if st.button("🔄 Refrescar Historial"):
-        st.session_state.history = st.session_state.manager.get_history(env=st.session_state.env)
+        # Sólo trae las filas nuevas (recarga completa si se editaron filas viejas)
+        st.session_state.history = st.session_state.manager.get_history(env=st.session_state.env, refresh=True)
+        st.session_state.history_base = st.session_state.history
         st.rerun()
 
     if 'history' in st.session_state and not st.session_state.history.empty:
+        # El historial ya llega normalizado (columnas, filas de instrucciones y tipos) desde la sincronización
         df_hist = st.session_state.history.copy()
-        
-        # --- NORMALIZACIÓN DE NOMBRES DE COLUMNAS (Sin crear duplicados) ---
-        target_names = ["realizado_por", "controlado_por", "recepcion_num", "Planta", "OC"]
-        rename_map = {}
-        cols = list(df_hist.columns)
-        
-        # Primero detectamos qué nombres "buenos" YA existen
-        existing_good = [c for c in cols if c in target_names]
-        
-        for i, col in enumerate(cols):
-            c_low = str(col).lower()
-            new_name = None
-            
-            # Solo intentamos renombrar si es un "Unnamed" o no es uno de nuestros nombres buenos
-            if "unnamed" in c_low:
-                if i == 13: new_name = "Planta"
-                elif i == 14: new_name = "OC"
-                elif i == 15: new_name = "realizado_por"
-                elif i == 16: new_name = "controlado_por"
-                elif i == 17: new_name = "recepcion_num"
-            
-            # Si encontramos un nombre descriptivo pero que no es exactamente nuestra clave
-            elif "realizado" in c_low and "realizado_por" not in existing_good: new_name = "realizado_por"
-            elif "controlado" in c_low and "controlado_por" not in existing_good: new_name = "controlado_por"
-            elif "recep" in c_low and "recepcion_num" not in existing_good: new_name = "recepcion_num"
-            
-            if new_name and new_name not in rename_map.values() and new_name not in existing_good:
-                rename_map[col] = new_name
-        
-        df_hist = df_hist.rename(columns=rename_map)
-
-        # Forzar tipos string para evitar errores en data_editor con NaNs o tipos mezclados
-        for c in ["SKU", "Descripción de Producto", "Proveedor", "Presentacion", "Planta", "Origen", "UDM", "Número de Remito", "OC", "realizado_por", "controlado_por", "recepcion_num"]:
-            if c in df_hist.columns:
-                df_hist[c] = df_hist[c].astype(str).replace('nan', '')
-
-        # Exportar a Excel
-        import io
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df_hist.to_excel(writer, index=False)
-        st.download_button(label="📥 Descargar Excel", data=output.getvalue(), file_name=f"historial_{st.session_state.env}.xlsx", mime="application/vnd.ms-excel")
+
+        # Exportar: el archivo se genera sólo al pedirlo y queda en caché por contenido
+        with st.expander("📥 Descargar historial"):
+            c_ex1, c_ex2, c_ex3 = st.columns(3)
+            with c_ex1:
+                ex_fmt = st.radio("Formato", ["xlsx", "csv"], horizontal=True, key="export_fmt")
+            with c_ex2:
+                fechas = df_hist["Fecha"].dropna() if "Fecha" in df_hist.columns else pd.Series(dtype="datetime64[ns]")
+                rango = st.date_input("Rango de fechas", value=(fechas.min(), fechas.max()) if not fechas.empty else None, key="export_range")
+            with c_ex3:
+                ex_plantas = st.multiselect("Plantas", ["Barracas", "Pibera"], key="export_plants")
+            if st.button("Preparar archivo"):
+                if isinstance(rango, (tuple, list)): desde, hasta = (rango[0], rango[-1]) if rango else (None, None)
+                else: desde = hasta = rango
+                df_ex = filter_history(df_hist, desde, hasta, ex_plantas)
+                st.session_state.export_file = (export_history(df_ex, ex_fmt), ex_fmt, len(df_ex), st.session_state.history)
+            if st.session_state.get('export_file') and st.session_state.export_file[3] is not st.session_state.history:
+                # El historial cambió (refresco, parche o filas nuevas): el archivo preparado ya no corresponde
+                st.session_state.export_file = None
+            if st.session_state.get('export_file'):
+                data_ex, fmt_ex, n_ex, _ = st.session_state.export_file
+                st.download_button(label=f"📥 Descargar {fmt_ex.upper()} ({n_ex} filas)", data=data_ex, file_name=f"historial_{st.session_state.env}.{fmt_ex}", mime=MIME_TYPES[fmt_ex])
         
         st.info("💡 Haz doble clic en una celda para editar (excepto campos clave).")
         
@@ -248,12 +455,7 @@ with tab2:
         sku_list = sorted(list(set([str(s.get('Articulo', '')) for s in st.session_state.get('skus', []) if s.get('Articulo')])))
         desc_list = sorted(list(set([str(s.get('Nombre', '')) for s in st.session_state.get('skus', []) if s.get('Nombre')])))
         
-        prov_list = []
-        if 'providers' in st.session_state:
-            for p in st.session_state.providers:
-                name = p.get('Proveedor', p.get('PROVEEDOR', p.get('Nombre', '')))
-                if name and str(name) != 'nan': prov_list.append(str(name).strip())
-        prov_list = sorted(list(set(prov_list)))
+        prov_list = st.session_state.prov_index.names if st.session_state.get('prov_index') else []
 
         # Asegurar que los valores actuales estén en las opciones o vacíos
         # para evitar errores de SelectboxColumn en Streamlit
@@ -331,8 +533,16 @@ with tab2:
         
         if st.button("💾 GUARDAR CAMBIOS EN LA NUBE", type="primary", disabled=not confirm_save):
             with st.spinner("Guardando cambios..."):
-                ok, msg = st.session_state.manager.update_history_remote(edited_df, env=st.session_state.env)
+                # Sólo se envían las celdas modificadas respecto de lo último descargado
+                base = st.session_state.get('history_base', st.session_state.history)
+                changes = diff_history(base, edited_df)
+                if changes is None:
+                    ok, msg = st.session_state.manager.update_history_remote(edited_df, env=st.session_state.env)
+                else:
+                    ok, msg = st.session_state.manager.patch_history_remote(changes, env=st.session_state.env, full_df=edited_df)
                 if ok: 
+                    st.session_state.history = edited_df
+                    st.session_state.history_base = edited_df
                     st.success("✅ Historial actualizado correctamente en Google Sheets")
                     st.rerun()
                 else: st.error(f"❌ Error al guardar: {msg}")
@@ -377,44 +587,6 @@ if st.session_state.get('show_label'):
     st.divider()
     if st.button("❌ Cerrar"): st.session_state.show_label = False; st.rerun()
 
-    # --- FORMATEO DE DATOS PARA EL RÓTULO ---
-    def clean_val(val):
-        if val is None or str(val) == 'nan' or str(val).lower() == 'seleccione...': return ""
-        # Quitar decimales si es un número (ej: 25688.0 -> 25688)
-        s = str(val)
-        if "." in s and s.split(".")[-1] == "0": return s.split(".")[0]
-        return s
-
-    def format_dt(val):
-        if not val or str(val) == 'nan': return ""
-        try:
-            if isinstance(val, (datetime, pd.Timestamp)):
-                return val.strftime("%d/%m/%Y")
-            s = str(val)
-            if " " in s: s = s.split(" ")[0] # Quitar ' 00:00:00'
-            if "-" in s: # YYYY-MM-DD
-                p = s.split("-")
-                if len(p) == 3 and len(p[0]) == 4: return f"{p[2]}/{p[1]}/{p[0]}"
-            return s
-        except: return str(val)
-
-    fecha_f = format_dt(d.get('Fecha'))
-    vto_f = format_dt(d.get('Vto'))
-    
-    # Fallback para número de recepción: si está vacío, intentar extraerlo del Nº de Análisis
-    recepcion_f = clean_val(d.get('recepcion_num'))
-    if not recepcion_f:
-        an = str(d.get('Número de Análisis', ''))
-        if "/" in an:
-            try:
-                recepcion_f = str(int(an.split("/")[0]))
-            except: pass
-    
-    realizado_f = clean_val(d.get('realizado_por'))
-    controlado_f = clean_val(d.get('controlado_por'))
-
-    
-    # --- CONTROLES DE IMPRESIÓN (Solo visibles en pantalla) ---
     # --- CONTROLES DE IMPRESIÓN (Solo visibles en pantalla) ---
     c_p1, c_p2 = st.columns([1,1])
     with c_p1:
@@ -424,18 +596,16 @@ if st.session_state.get('show_label'):
     cant_bultos_total = int(d['Cantidad Bultos'])
     cant_sugerida = total_recepcion / cant_bultos_total if cant_bultos_total else 0
     
-    bulto_n_list = []
-    cant_list = []
+    runs = [] # Tramos (desde, hasta, peso) a imprimir
     allow_print = True
 
     if print_mode == "Bulto individual":
         c_i1, c_i2 = st.columns(2)
         with c_i1:
             b_n = st.number_input("Imprimir Bulto Nº", min_value=1, max_value=cant_bultos_total, value=1)
-            bulto_n_list = [b_n]
         with c_i2:
             cant_bulto = st.number_input("Cantidad para este bulto", value=float(cant_sugerida), step=0.01)
-            cant_list = [cant_bulto]
+        runs = [(b_n, b_n, cant_bulto)]
     else:
         st.info(f"Configuración de bultos (Total: {total_recepcion} {d['UDM']} en {cant_bultos_total} bultos)")
         
@@ -457,23 +627,10 @@ if st.session_state.get('show_label'):
         )
         st.session_state.bulto_ranges = edited_ranges
 
-        # Validar y Expandir los bultos
-        temp_bultos = {} # Bulto ID -> Peso
-        total_acumulado = 0.0
-        
-        for r in edited_ranges:
-            if not r.get("desde") or not r.get("hasta") or r.get("peso") is None: continue
-            for i in range(int(r["desde"]), int(r["hasta"]) + 1):
-                if i > cant_bultos_total: continue
-                # Si un bulto se repite, el último rango definido gana
-                temp_bultos[i] = float(r["peso"])
-
-        # Generar listas finales
-        for i in range(1, cant_bultos_total + 1):
-            peso = temp_bultos.get(i, 0.0)
-            bulto_n_list.append(i)
-            cant_list.append(peso)
-            total_acumulado += peso
+        # Validar sobre intervalos (sin expandir bulto por bulto); si un bulto se repite, el último rango gana
+        plan = BultoPlan(cant_bultos_total, edited_ranges)
+        total_acumulado = plan.total_weight
+        runs = plan.runs()
 
         # Mostrar resumen y validación
         diff = total_recepcion - total_acumulado
@@ -484,139 +641,37 @@ if st.session_state.get('show_label'):
             if abs(diff) > 0.01:
                 st.error(f"⚠️ La suma de bultos ({total_acumulado:.2f}) no coincide con el total de la recepción ({total_recepcion:.2f}).")
                 allow_print = False
-            elif len(temp_bultos) < cant_bultos_total:
-                st.warning(f"⚠️ Faltan configurar {cant_bultos_total - len(temp_bultos)} bultos.")
+            elif plan.missing > 0:
+                faltan = ", ".join(f"{a}" if a == b else f"{a}-{b}" for a, b in plan.gaps())
+                st.warning(f"⚠️ Faltan configurar {plan.missing} bultos ({faltan}).")
                 allow_print = False
             else:
                 st.success("✅ Distribución correcta.")
 
-    # Diseño de Rótulo 10x10 cm aproximado para impresión
-    labels_html = ""
-    if allow_print:
-        for idx, b_n in enumerate(bulto_n_list):
-            c_bulto = cant_list[idx]
-            labels_html += f"""
-            <div class="label-container">
-                <table>
-                    <tr>
-                        <td class="field-name">Nº de Análisis</td>
-                        <td class="header-val" colspan="2">{d['Número de Análisis']}</td>
-                        <td class="logo-box"><b style="color:#0056b3; font-size:16px;">Biosintex</b></td>
-                    </tr>
-                    <tr>
-                        <td class="field-name">Insumo / Producto</td>
-                        <td colspan="3" class="label-text">{d.get('Descripción de Producto', '')}</td>
-                    </tr>
-                    <tr>
-                        <td class="field-name">Presentación</td>
-                        <td colspan="3" class="label-text">{d.get('Presentacion', '')}</td>
-                    </tr>
-                    <tr>
-                        <td class="field-name">Fecha</td>
-                        <td colspan="3">{fecha_f}</td>
-                    </tr>
-                    <tr>
-                        <td class="field-name">Nº de lote</td>
-                        <td>{d['Lote']}</td>
-                        <td class="field-name">Vto.:</td>
-                        <td>{vto_f}</td>
-                    </tr>
-                    <tr>
-                        <td class="field-name">Código interno</td>
-                        <td colspan="3" class="label-text">{d['SKU']}</td>
-                    </tr>
-                    <tr>
-                        <td class="field-name">Origen</td>
-                        <td colspan="3" class="label-text">{d.get('Origen', '')}</td>
-                    </tr>
-                    <tr>
-                        <td class="field-name">Proveedor</td>
-                        <td colspan="3" class="label-text">{d['Proveedor']}</td>
-                    </tr>
-                    <tr>
-                        <td class="field-name">Bulto Nº</td>
-                        <td style="background:#ddd; font-weight:bold;">{b_n}</td>
-                        <td class="field-name">de</td>
-                        <td style="background:#ddd; font-weight:bold;">{cant_bultos_total}</td>
-                    </tr>
-                    <tr>
-                        <td class="field-name">Cantidad por bulto</td>
-                        <td style="font-weight:bold;">{c_bulto:.2f} {d['UDM']}</td>
-                        <td class="field-name">Total</td>
-                        <td>{total_recepcion:.2f} {d['UDM']}</td>
-                    </tr>
-                    <tr>
-                        <td class="field-name">Nº de Remito</td>
-                        <td class="small-text">{d['Número de Remito']}</td>
-                        <td class="field-name">Nº de recepción</td>
-                        <td>{recepcion_f}</td>
-                    </tr>
-                    <tr>
-                        <td class="field-name">Realizado por</td>
-                        <td class="label-text" style="font-size:9px;">{realizado_f}</td>
-                        <td class="field-name">Controlado por</td>
-                        <td class="label-text" style="font-size:9px;">{controlado_f}</td>
-                    </tr>
-                    <tr>
-                        <td class="small-text">DP-003-SOP Vigente</td>
-                        <td colspan="3" class="cuarentena">CUARENTENA</td>
-                    </tr>
-                </table>
-            </div>
-            """
-
-    full_html = f"""
-    <style>
-        @media print {{
-            .no-print {{ display: none !important; }}
-            @page {{ size: 100mm 100mm; margin: 0; }}
-            body {{ margin: 0; }}
-            .label-container {{ page-break-after: always; }}
-        }}
-        .label-container {{
-            width: 370px;
-            height: 370px;
-            border: 2px solid black;
-            font-family: Arial, sans-serif;
-            font-size: 11px;
-            margin: 10px auto;
-            background: white;
-            color: black;
-            display: flex;
-            flex-direction: column;
-            page-break-after: always;
-        }}
-        table {{
-            width: 100%;
-            border-collapse: collapse;
-            height: 100%;
-        }}
-        td {{
-            border: 1px solid black;
-            padding: 3px;
-            text-align: center;
-            vertical-align: middle;
-        }}
-        .label-text {{ font-weight: bold; text-transform: uppercase; }}
-        .header-val {{ font-size: 24px; font-weight: bold; }}
-        .cuarentena {{
-            background: white;
-            font-size: 28px;
-            font-weight: bold;
-            letter-spacing: 2px;
-        }}
-        .field-name {{ width: 30%; text-align: left; background: #f0f0f0; font-weight: bold; font-size: 10px; }}
-        .logo-box {{ width: 30%; }}
-        .small-text {{ font-size: 9px; }}
-    </style>
-    <div id="printable-area">
-        {labels_html if allow_print else '<h3 style="color:red; text-align:center;">⚠️ La configuración de bultos es inválida. Revisa el peso total.</h3>'}
-    </div>
-    <div class="no-print" style="text-align:center; margin-top:20px;">
-        <button {"" if allow_print else "disabled"} onclick="window.print()" style="padding:15px 30px; background:{'green' if allow_print else 'gray'}; color:white; font-weight:bold; border:none; border-radius:5px; cursor:pointer; font-size:16px;">🖨️ IMPRIMIR ETIQUETAS</button>
-        <p style="color:gray; font-size:12px; margin-top:5px;">Se imprimirán {len(bulto_n_list)} rótulo(s).</p>
-    </div>
-    """
+    # Rótulos: plantilla compilada una vez por recepción; la vista previa es acotada
+    # y el navegador arma el juego completo (por tramos de igual peso) al imprimir
+    sheet = LabelSheet(d, runs, cant_bultos_total, total_recepcion)
+    full_html = sheet.render_page(allow_print=allow_print)
     st.components.v1.html(full_html, height=600 if print_mode == "Bulto individual" else 900, scrolling=True)
 
-
+    # --- ARCHIVOS DE RÓTULOS (PDF 100x100 mm / ZPL) generados en segundo plano ---
+    if allow_print:
+        c_f1, c_f2, c_f3 = st.columns([1, 1, 2])
+        with c_f1:
+            if st.button("📄 Generar PDF"):
+                st.session_state.label_job = (submit_label_job(sheet, "pdf", LABEL_SPOOL_DIR), "pdf")
+        with c_f2:
+            if st.button("🦓 Generar ZPL (Zebra)"):
+                st.session_state.label_job = (submit_label_job(sheet, "zpl", LABEL_SPOOL_DIR), "zpl")
+        with c_f3:
+            if st.session_state.get('label_job'):
+                job, job_fmt = st.session_state.label_job
+                if not job.done():
+                    st.info(f"⏳ Generando {len(sheet)} rótulo(s)...")
+                    st.button("🔄 Ver estado")
+                elif job.exception():
+                    st.error(f"❌ No se pudo generar el archivo: {job.exception()}")
+                else:
+                    name, data, path = job.result()
+                    st.download_button(f"📥 Descargar {name}", data=data, file_name=name, mime=FORMATS[job_fmt][1])
+                    if path: st.caption(f"🖨️ Enviado a la cola de impresión: {path}")
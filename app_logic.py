@@ -1,76 +1,476 @@
-import streamlit as st
 import pandas as pd
 from datetime import datetime
-import requests
 import io
 import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from workbook_cache import CsvWorkbook, get_workbook_cache
+from search_index import ProviderIndex, SkuIndex
+from payloads import cell_text, rows_payload
+from http_client import get_http_client
+from number_lease import get_number_lease
+from warm_start import get_warm_start
+from metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+class _HistoryState:
+    """Historial de una hoja en memoria, compartido por el proceso y actualizado por deltas"""
+    def __init__(self):
+        self.df = None
+        self.columns = []
+        self.raw_rows = 0       # filas de datos de la hoja (sin limpiar) ya incorporadas
+        self.last_key = None    # Nº de Análisis de la última fila conocida (control de solapamiento)
+        self.edit_rev = None    # revisión de ediciones informada por el servidor
+        self.generation = None  # generación del libro con la que se sincronizó por última vez
+        self.checked_at = 0.0   # última vez que se confirmó contra el servidor (carga, delta o consulta)
+        self.dirty = False
+        self.delta_supported = True
+        self.lock = threading.Lock()
+
+_HISTORY = {}
+_HISTORY_LOCK = threading.Lock()
+
+# Contadores (State) leídos del endpoint 'get_state': (script, hoja) -> (estado, momento de lectura)
+STATE_TTL = 10
+_STATE = {}
+_STATE_SUPPORT = {}  # script -> True/False una vez probado
+_STATE_LOCK = threading.Lock()
+
+# Revalidaciones en segundo plano en curso: (libro, entorno)
+_REVALIDATING = set()
+_REVALIDATING_LOCK = threading.Lock()
+
+# Hilos de refresco anticipado (uno por libro y entorno) y generación de datos que ven las sesiones
+_REFRESHERS = {}
+_ACTIVE = {}  # (libro, entorno) -> última vez que una página pidió el refresco
+_DATA_GEN = {}
+_REFRESH_LOCK = threading.Lock()
+
+# Respuestas del Apps Script cuando no conoce la acción (script viejo). Cualquier otro error
+# (cuota, lock, timeout) es pasajero y no apaga la función para el resto del proceso
+_UNKNOWN_ACTION = ("desconocida", "no reconocida", "no válida", "no soportada", "unknown action", "invalid action")
+
+def _unknown_action(result):
+    status = str(result.get("status", "")).lower()
+    return any(m in status for m in _UNKNOWN_ACTION)
+
+def _script_result(resp):
+    """JSON de una respuesta 200 del script. Un cuerpo que no es JSON o no trae 'status' (p. ej. la página
+    HTML de un script viejo) cuenta como acción desconocida, para no volver a pagar el viaje"""
+    try:
+        result = resp.json()
+    except ValueError:
+        result = None
+    if not isinstance(result, dict) or "status" not in result:
+        return {"status": "unknown action"}
+    return result
+
+
+# Columnas del historial con tipo fijo después de la ingesta
+HISTORY_DATE_COLUMNS = ["Fecha", "Vto"]
+HISTORY_TEXT_COLUMNS = ["SKU", "Descripción de Producto", "Número de Análisis", "Lote", "Proveedor", "Presentacion", "Número de Remito", "OC", "realizado_por", "controlado_por", "recepcion_num"]
+# Numéricas aunque lleguen como texto (pestañas CSV, filas del delta)
+HISTORY_NUMBER_COLUMNS = ["Cantidad", "Cantidad Bultos"]
+# Pocas opciones posibles: se guardan como categorías (incluyen las opciones de los selectores del editor)
+HISTORY_CATEGORIES = {
+    "Planta": ["Barracas", "Pibera", ""],
+    "Origen": ["Nacional", "Importado", ""],
+    "UDM": ["KG", "UN", "L", "M", ""],
+}
+
+
+def _history_rename_map(cols):
+    """Nombres de columna de la hoja -> nombres que usa la app (sin crear duplicados)"""
+    target_names = ["realizado_por", "controlado_por", "recepcion_num", "Planta", "OC"]
+    rename_map = {}
+    
+    # Primero detectamos qué nombres "buenos" YA existen
+    existing_good = [c for c in cols if c in target_names]
+    
+    for i, col in enumerate(cols):
+        c_low = str(col).lower()
+        new_name = None
+        
+        # Solo intentamos renombrar si es un "Unnamed" o no es uno de nuestros nombres buenos
+        if "unnamed" in c_low:
+            if i == 13: new_name = "Planta"
+            elif i == 14: new_name = "OC"
+            elif i == 15: new_name = "realizado_por"
+            elif i == 16: new_name = "controlado_por"
+            elif i == 17: new_name = "recepcion_num"
+        
+        # Si encontramos un nombre descriptivo pero que no es exactamente nuestra clave
+        elif "realizado" in c_low and "realizado_por" not in existing_good: new_name = "realizado_por"
+        elif "controlado" in c_low and "controlado_por" not in existing_good: new_name = "controlado_por"
+        elif "recep" in c_low and "recepcion_num" not in existing_good: new_name = "recepcion_num"
+        
+        if new_name and new_name not in rename_map.values() and new_name not in existing_good:
+            rename_map[col] = new_name
+    return rename_map
+
+
+def _coerce_categories(df):
+    for c, options in HISTORY_CATEGORIES.items():
+        if c in df.columns:
+            col = df[c].astype(str).where(df[c].notna(), "").replace('nan', '')
+            cats = list(dict.fromkeys(options + sorted(set(col) - set(options))))
+            df[c] = pd.Categorical(col, categories=cats)
+    return df
+
+
+def diff_history(base, edited, key="Número de Análisis"):
+    """Celdas que cambiaron entre el historial original y el editado, identificadas por Nº de Análisis.
+
+    Devuelve None si las filas no se pueden alinear (claves repetidas o filas distintas).
+    """
+    if key not in base.columns or not base.columns.is_unique or list(base.columns) != list(edited.columns): return None
+    a = base.set_index(key, drop=False)
+    b = edited.set_index(key, drop=False)
+    if not a.index.is_unique or not b.index.is_unique or set(a.index) != set(b.index): return None
+    b = b.loc[a.index]
+    a_txt = pd.DataFrame({c: cell_text(a[c]) for c in a.columns}, index=a.index)
+    b_txt = pd.DataFrame({c: cell_text(b[c]) for c in b.columns}, index=a.index)
+    changed = (a_txt != b_txt).stack()
+    changes = []
+    for (an, col), _ in changed[changed].items():
+        changes.append({"key": str(an), "col": int(base.columns.get_loc(col)), "column": str(col), "value": b_txt.at[an, col]})
+    return changes
+
 
 class AnalysisManager:
-    def __init__(self, spreadsheet_url, script_url=None):
-        self.doc_id = "1IhDCR-BkAl5mk9C20eCCzZ50dgYK5tw40Wt1owIIylQ"
+    def __init__(self, spreadsheet_url, script_url=None, cache_ttl=300, sheet_gids=None, compress_payloads=False, lease_block=20, warm_start_path=None):
+        # Base del libro (".../spreadsheets/d/<id>"): de acá salen el id y las URLs de exportación
+        self.sheet_base = spreadsheet_url.split("/edit")[0].split("#")[0].rstrip("/")
+        self.doc_id = self.sheet_base.rsplit("/", 1)[-1]
         self.script_url = script_url
-        self.cached_xl = None
-        self.last_sync = None
-        
-    def _fetch_all(self):
-        """Descarga el archivo completo en formato XLSX con cache-buster"""
-        url = f"https://docs.google.com/spreadsheets/d/{self.doc_id}/export?format=xlsx&t={int(time.time())}"
-        try:
-            response = requests.get(url, timeout=20)
-            if response.status_code == 200:
-                self.cached_xl = pd.ExcelFile(io.BytesIO(response.content))
-                self.last_sync = datetime.now()
-                return True
-        except Exception as e:
-            st.error(f"Error de conexión: {str(e)}")
-        return False
+        # Pestaña -> gid. Si se define, se descargan sólo esas pestañas en CSV (en paralelo) en vez del XLSX
+        self.sheet_gids = sheet_gids
+        # Envíos masivos comprimidos (gzip+base64, por columnas): requiere soporte en el Apps Script
+        self.compress_payloads = compress_payloads
+        # Caché compartida entre todas las sesiones del proceso
+        self.cache = get_workbook_cache(self.doc_id, ttl=cache_ttl)
+        self.http = get_http_client()
+        self.last_error = None  # último error de sincronización
+        # Tamaño de los bloques de números reservados por adelantado (0 = numera el servidor en cada guardado)
+        self.lease_block = lease_block
+        # Foto en disco para arrancar sesiones nuevas sin esperar la descarga
+        self.warm = get_warm_start(warm_start_path) if warm_start_path else None
+
+    @property
+    def cached_xl(self):
+        """Foto vigente del libro (compartida); None si nunca se sincronizó"""
+        return self.cache.snapshot
+
+    @property
+    def last_sync(self):
+        snap = self.cache.snapshot
+        return snap.synced_at if snap else None
+
+    def _download(self, validators):
+        """Descarga del libro: pestañas CSV en paralelo si hay gids configurados, si no el XLSX completo"""
+        with METRICS.timer("sync_download"):
+            if self.sheet_gids:
+                payload, validators = self._download_tabs(), {}
+            else:
+                payload, validators = self._download_xlsx(validators)
+        if payload is not None:
+            METRICS.inc("sync_bytes", sum(map(len, payload.values())) if isinstance(payload, dict) else len(payload))
+        return payload, validators
+
+    def _download_tab(self, gid):
+        url = f"{self.sheet_base}/export?format=csv&gid={gid}"
+        response = self.http.get("export", url, headers={"Cache-Control": "no-cache"})
+        if response.status_code != 200:
+            raise ConnectionError(f"HTTP {response.status_code} (gid {gid})")
+        return response.content
 
-    def get_excel_data(self):
-        res = {"skus": [], "providers": [], "error": None}
+    def _download_tabs(self):
+        """Descarga en paralelo sólo las pestañas que usa la app, en CSV"""
+        names = list(self.sheet_gids)
+        with ThreadPoolExecutor(max_workers=min(4, len(names))) as pool:
+            contents = list(pool.map(self._download_tab, [self.sheet_gids[n] for n in names]))
+        return dict(zip(names, contents))
+
+    def _download_xlsx(self, validators):
+        """Descarga el XLSX completo; con validadores HTTP el servidor puede responder 304 sin contenido"""
+        url = f"{self.sheet_base}/export?format=xlsx"
+        # En lugar del cache-buster pedimos revalidación explícita
+        headers = {"Cache-Control": "no-cache"}
+        if validators.get("etag"): headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"): headers["If-Modified-Since"] = validators["last_modified"]
+        response = self.http.get("export", url, headers=headers)
+        if response.status_code == 304:
+            return None, validators
+        if response.status_code != 200:
+            raise ConnectionError(f"HTTP {response.status_code}")
+        return response.content, {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+
+    def _load(self, content):
+        with METRICS.timer("sync_open"):
+            if isinstance(content, dict):
+                return CsvWorkbook(content)
+            return pd.ExcelFile(io.BytesIO(content))
+
+    def _fetch_all(self, force=False):
+        """Obtiene la foto compartida; sólo revalida si venció el TTL o se fuerza, y sólo re-abre el libro si cambió"""
+        with METRICS.timer("sync"):
+            snap, error = self.cache.get(self._download, self._load, force=force)
+        if error:
+            METRICS.inc("sync_errors")
+            # Sin interfaz acá: la página (o la CLI) muestra last_error
+            self.last_error = str(error)
+            log.warning("Error de conexión: %s", error)
+            return False
+        self.last_error = None
+        return snap is not None
+
+    def get_excel_data(self, force=False):
+        res = {"skus": [], "providers": [], "sku_index": SkuIndex([]), "prov_index": ProviderIndex([]), "error": None}
         
-        if not self._fetch_all():
+        if not self._fetch_all(force=force):
             res['error'] = "⚠️ No se pudo sincronizar con Google Sheets. Revisa tu conexión."
             return res
+        xl = self.cached_xl
         
         # 1. SKU (Búsqueda flexible por nombre)
-        sku_tab = next((s for s in self.cached_xl.sheet_names if "SKU" in s.upper()), None)
+        sku_tab = next((s for s in xl.sheet_names if "SKU" in s.upper()), None)
         if sku_tab:
-            df_s = self.cached_xl.parse(sku_tab)
-            res['skus'] = df_s.dropna(how='all', subset=df_s.columns[:2]).to_dict('records')
+            df_s = xl.parse(sku_tab)
+            res['skus'] = xl.memo("skus", lambda: df_s.dropna(how='all', subset=df_s.columns[:2]).to_dict('records'))
+            # Índice de búsqueda: se arma una vez por sincronización y lo comparten todas las sesiones
+            res['sku_index'] = xl.memo("sku_index", lambda: SkuIndex(res['skus']))
         
         # 2. PROVEEDORES (Búsqueda flexible: cualquier pestaña que contenga 'PROV')
-        prov_tab = next((s for s in self.cached_xl.sheet_names if "PROV" in s.upper()), None)
+        prov_tab = next((s for s in xl.sheet_names if "PROV" in s.upper()), None)
         
         if prov_tab:
-            df_p = self.cached_xl.parse(prov_tab)
-            # Limpiar nombres de columnas (quitar espacios fantasmas)
-            df_p.columns = [str(c).strip() for c in df_p.columns]
+            # Limpiar nombres de columnas (quitar espacios fantasmas); rename copia, el parse cacheado no se toca
+            df_p = xl.parse(prov_tab)
+            df_p = df_p.rename(columns=lambda c: str(c).strip())
             
             # Validación: que no sea la de SKU por accidente
             if "Articulo" not in df_p.columns:
                 # Quitamos filas vacías y convertimos a dict
-                res['providers'] = df_p.dropna(how='all', subset=[df_p.columns[0]]).to_dict('records')
+                res['providers'] = xl.memo("providers", lambda: df_p.dropna(how='all', subset=[df_p.columns[0]]).to_dict('records'))
+                res['prov_index'] = xl.memo("prov_index", lambda: ProviderIndex(res['providers']))
             else:
                 # Si entramos aquí, es que 'PROV' detectó la de SKU o algo raro
                 res['error'] = f"⚠️ Error: La pestaña '{prov_tab}' parece contener productos, no proveedores."
         
         if not res['providers'] and not res['error']:
-            tabs = ", ".join(self.cached_xl.sheet_names)
+            tabs = ", ".join(xl.sheet_names)
             res['error'] = f"⚠️ No se encontró la pestaña 'Proveedores'. Pestañas encontradas: {tabs}"
             
         return res
 
-    def get_state(self, env="Producción"):
-        # Usar caché si existe, sino intentar descargar
-        if not self.cached_xl:
-            self._fetch_all()
+    def warm_start_data(self, env="Producción"):
+        """Datos de la última foto guardada en disco, con índices armados una vez por foto. None si no hay"""
+        if not self.warm: return None
+        data = self.warm.load(HISTORY_DATE_COLUMNS)
+        if data is None: return None
+        ws = "Datos a completar" if env == "Producción" else "Datos a completar_Test"
+        if "sku_index" not in data:
+            data["sku_index"] = SkuIndex(data["skus"])
+            data["prov_index"] = ProviderIndex(data["providers"])
+        if ("history", ws) not in data:
+            hist = data["history"].get(ws)
+            data[("history", ws)] = _coerce_categories(hist) if hist is not None else pd.DataFrame()
+        return {
+            "skus": data["skus"], "providers": data["providers"],
+            "sku_index": data["sku_index"], "prov_index": data["prov_index"],
+            "history": data[("history", ws)], "synced_at": data["synced_at"],
+        }
+
+    def save_warm_start(self, env="Producción"):
+        """Guarda en disco la sincronización actual (sólo si cambió desde la última vez)"""
+        xl = self.cached_xl
+        if not self.warm or xl is None: return False
+        ws = "Datos a completar" if env == "Producción" else "Datos a completar_Test"
+        h = self._history_state(ws)
+        data = self.get_excel_data()
+        if data['error'] or h.df is None: return False
+        key = (xl.generation, h.raw_rows, h.edit_rev, id(h.df))
+        return self.warm.save(data['skus'], data['providers'], {ws: h.df}, xl.synced_at, key=key)
+
+    def revalidating(self, env="Producción"):
+        with _REVALIDATING_LOCK:
+            return (self.doc_id, env) in _REVALIDATING
+
+    def revalidate_async(self, env="Producción"):
+        """Sincroniza en un hilo aparte (uno por libro y entorno a la vez) y actualiza la foto en disco"""
+        key = (self.doc_id, env)
+        with _REVALIDATING_LOCK:
+            if key in _REVALIDATING: return False
+            _REVALIDATING.add(key)
+
+        def run():
+            try:
+                self._background_sync(env)
+            finally:
+                with _REVALIDATING_LOCK:
+                    _REVALIDATING.discard(key)
+        threading.Thread(target=run, name="revalidar", daemon=True).start()
+        return True
+
+    def _background_sync(self, env, force=False):
+        """Libro, historial y foto en disco, fuera de la página (sin mensajes en pantalla). True si salió bien"""
+        try:
+            if self.get_excel_data(force=force)['error']: return False
+            self.get_history(env)
+            self.save_warm_start(env)
+            return True
+        except Exception:
+            log.exception("Error en la sincronización en segundo plano")
+            return False
+
+    def start_refresher(self, env="Producción", lead=30, poll=5, retry=15, idle=600, history_every=60):
+        """Hilo del proceso que revalida el libro `lead` segundos antes de que venza el TTL, o enseguida si
+        la caché se venció o hay filas nuevas propias. Uno por libro y entorno; cada página lo llama en
+        cada ejecución, y sin páginas activas durante `idle` segundos no descarga nada.
+        Entre revalidaciones consulta el historial (get_rows_since) cada `history_every` segundos: si cambió
+        lo actualiza con un delta, si no sólo renueva la vigencia del historial (nunca el TTL del libro)."""
+        key = (self.doc_id, env)
+        with _REFRESH_LOCK:
+            _ACTIVE[key] = time.time()
+            t = _REFRESHERS.get(key)
+            if t is None or not t.is_alive():
+                t = _REFRESHERS[key] = threading.Thread(target=self._refresh_loop, args=(env, lead, poll, retry, idle, history_every),
+                                                        name=f"refresco-{env}", daemon=True)
+                t.start()
+            return t
+
+    def _refresh_loop(self, env, lead, poll, retry, idle, history_every):
+        ws = "Datos a completar" if env == "Producción" else "Datos a completar_Test"
+        h = self._history_state(ws)
+        key = (self.doc_id, env)
+        while True:
+            snap = self.cache.snapshot
+            left = snap.fetched_at + self.cache.ttl - lead - time.time() if snap else 0
+            due = left <= 0 or not self.cache.is_fresh() or h.dirty
+            if not due and time.time() - h.checked_at < history_every:
+                time.sleep(min(left, poll))
+                continue
+            with _REFRESH_LOCK:
+                seen = _ACTIVE.get(key, 0)
+            if time.time() - seen > idle:
+                # Nadie está usando la app: la próxima página que entre sincroniza sola
+                time.sleep(poll)
+                continue
+            if not due:
+                changed = self._history_changed(ws, h)
+                if changed is False:
+                    METRICS.inc("refresh_probed")
+                if changed is not True:
+                    time.sleep(poll)
+                    continue
+                h.dirty = True
+            # Antes del vencimiento se fuerza la revalidación (condicional y por hash) para que ninguna página
+            # la pague; con sólo el historial sucio el libro vigente no se vuelve a pedir
+            ok = self._background_sync(env, force=snap is not None and self.cache.is_fresh() and left <= 0)
+            time.sleep(poll if ok else retry)
+
+    def _history_changed(self, ws, h):
+        """Consulta liviana del historial contra lo que hay en memoria: True si hay filas nuevas o ediciones,
+        False si no cambió (renueva su vigencia), None si no se pudo saber"""
+        if h.df is None or not h.delta_supported or not self.script_url or "/exec" not in self.script_url: return None
+        try:
+            resp = self.http.post("get_rows_since", self.script_url, idempotent=True, json={"action": "get_rows_since", "sheet": ws, "from_row": h.raw_rows})
+            result = _script_result(resp) if resp.status_code == 200 else {}
+        except Exception:
+            result = {}
+        if result.get("status") != "OK":
+            if _unknown_action(result): h.delta_supported = False
+            # No se reintenta antes del próximo intervalo
+            h.checked_at = time.time()
+            return None
+        rev = result.get("edit_rev")
+        with h.lock:
+            if int(result.get("total_rows", -1)) != h.raw_rows: return True
+            if h.edit_rev is None:
+                # Revisión desconocida tras una carga completa: la resuelve el próximo delta (recarga una vez)
+                if rev: return True
+                h.edit_rev = rev
+            if h.edit_rev != rev: return True
+            h.checked_at = time.time()
+            return False
+
+    def data_generation(self, env="Producción"):
+        """Contador que sube cada vez que cambian en memoria el libro o el historial; las sesiones lo comparan
+        con el que vieron para tomar los datos nuevos en su próxima ejecución"""
+        xl = self.cached_xl
+        ws = "Datos a completar" if env == "Producción" else "Datos a completar_Test"
+        state = (xl.generation if xl else None, id(self._history_state(ws).df))
+        with _REFRESH_LOCK:
+            last = _DATA_GEN.get((self.doc_id, env))
+            if last is None or last[0] != state:
+                last = _DATA_GEN[(self.doc_id, env)] = (state, last[1] + 1 if last else 1)
+            return last[1]
+
+    def get_state(self, env="Producción", fresh=False):
+        """Contadores actuales. Primero el endpoint liviano (con caché de STATE_TTL s), si no la hoja State del libro"""
+        ws = "State" if env == "Producción" else "State_Test"
+        key = (self.script_url, ws)
+        if not fresh:
+            with _STATE_LOCK:
+                cached = _STATE.get(key)
+            if cached and time.time() - cached[1] < STATE_TTL:
+                return dict(cached[0])
+        state = self._get_state_remote(ws)
+        if state is None:
+            state = self._get_state_from_workbook(ws)
+        with _STATE_LOCK:
+            _STATE[key] = (state, time.time())
+        return dict(state)
+
+    def _get_state_remote(self, ws):
+        """Sólo los tres contadores, sin descargar el libro. None si el script no tiene 'get_state' o falla"""
+        if not self.script_url or "/exec" not in self.script_url: return None
+        if _STATE_SUPPORT.get(self.script_url) is False: return None
+        try:
+            resp = self.http.post("get_state", self.script_url, idempotent=True, json={"action": "get_state", "sheet": ws})
+            if resp.status_code != 200: return None
+            result = _script_result(resp)
+        except Exception:
+            return None
+        if result.get("status") != "OK":
+            # Script viejo: no se vuelve a intentar en este proceso (un error pasajero sólo usa el libro esta vez)
+            if _unknown_action(result): _STATE_SUPPORT[self.script_url] = False
+            return None
+        _STATE_SUPPORT[self.script_url] = True
+        return {
+            "last_number": int(result.get("last_number") or 0),
+            "last_reception": int(result.get("last_reception") or 0),
+            "year": int(result.get("year") or 26),
+        }
+
+    def _forget_state(self, env):
+        with _STATE_LOCK:
+            _STATE.pop((self.script_url, "State" if env == "Producción" else "State_Test"), None)
+
+    def _after_save(self, ws, env):
+        """Tras agregar filas: el historial se completa con un delta y los contadores se releen del endpoint.
+        El libro entero sólo se vence si alguno de los dos no está disponible."""
+        h = self._history_state(ws)
+        h.dirty = True
+        self._forget_state(env)
+        if not (h.delta_supported and _STATE_SUPPORT.get(self.script_url)):
+            self.cache.invalidate()
+
+    def _get_state_from_workbook(self, ws):
+        # Usar la caché compartida (se resincroniza sola si venció)
+        self._fetch_all()
             
-        if not self.cached_xl:
+        xl = self.cached_xl
+        if not xl:
             return {"last_number": 0, "last_reception": 0, "year": 26}
 
-        ws = "State" if env == "Producción" else "State_Test"
-        if ws in self.cached_xl.sheet_names:
-            df = self.cached_xl.parse(ws)
+        if ws in xl.sheet_names:
+            df = xl.parse(ws)
             if not df.empty:
                 d = df.iloc[0].to_dict()
                 return {
@@ -91,8 +491,13 @@ class AnalysisManager:
                 "last_reception": int(state['last_reception']), 
                 "year": int(state.get('year', 26))
             }
-            requests.post(self.script_url, json=payload, timeout=10)
-        except: pass
+            resp = self.http.post("save_state", self.script_url, json=payload)
+            if resp.status_code != 200: return False
+            with _STATE_LOCK:
+                _STATE[(self.script_url, ws)] = ({k: payload[k] for k in ("last_number", "last_reception", "year")}, time.time())
+            return True
+        except Exception:
+            return False
 
     def save_entry(self, data, env="Producción"):
         if not self.script_url or "/exec" not in self.script_url:
@@ -118,14 +523,38 @@ class AnalysisManager:
                 str(data.get('Presentacion', ''))
             ]
             payload = {"action": "append", "sheet": ws, "row": row_data}
-            resp = requests.post(self.script_url, json=payload, timeout=15)
+            resp = self.http.post("save_entry", self.script_url, json=payload)
             if resp.status_code == 200: 
-                # Forzamos resincronización en la siguiente carga para ver cambios
-                self.cached_xl = None 
+                self._after_save(ws, env)
                 return True, "OK"
             return False, f"Server Error {resp.status_code} (Revisa la URL de Apps Script)"
         except Exception as e: return False, f"Error: {str(e)}"
 
+    def _entry_row(self, data):
+        """Fila completa (18 columnas) para una recepción nueva; el servidor completa el Nº de Análisis"""
+        # Dejamos espacio para el número de análisis en el índice 3 (salvo que venga de un bloque reservado)
+        analisis = str(data.get('Número de Análisis', '')) if data.get('preassigned') else "GENERANDO..."
+        return [
+            str(data.get('Fecha', '')), 
+            str(data.get('SKU', '')), 
+            str(data.get('Descripción de Producto', '')),
+            analisis, 
+            str(data.get('Lote', '')), 
+            str(data.get('Origen', '')),
+            str(data.get('Cantidad', '')), 
+            str(data.get('UDM', '')), 
+            str(data.get('Cantidad Bultos', '')),
+            str(data.get('Vto', '')),
+            str(data.get('Proveedor', '')), 
+            str(data.get('Número de Remito', '')), 
+            str(data.get('Presentacion', '')),
+            str(data.get('Planta', '')), # 14va Columna: Planta
+            str(data.get('OC', '')), # 15va Columna: OC
+            str(data.get('realizado_por', '')), # 16va Columna: Realizado
+            str(data.get('controlado_por', '')), # 17va Columna: Controlado
+            str(data.get('recepcion_num', '')) # 18va Columna: Recepción
+        ]
+
     def save_entry_remote(self, data, env="Producción"):
         if not self.script_url or "/exec" not in self.script_url:
             return False, "⚠️ Configuración incompleta: Pega la URL de Apps Script en app.py"
@@ -133,48 +562,150 @@ class AnalysisManager:
         ws = "Datos a completar" if env == "Producción" else "Datos a completar_Test"
         try:
             # Mandamos la fila al servidor. El servidor generará el número de análisis.
-            # Dejamos espacio para el número de análisis en el índice 3
-            row_data = [
-                str(data.get('Fecha', '')), 
-                str(data.get('SKU', '')), 
-                str(data.get('Descripción de Producto', '')),
-                "GENERANDO...", 
-                str(data.get('Lote', '')), 
-                str(data.get('Origen', '')),
-                str(data.get('Cantidad', '')), 
-                str(data.get('UDM', '')), 
-                str(data.get('Cantidad Bultos', '')),
-                str(data.get('Vto', '')),
-                str(data.get('Proveedor', '')), 
-                str(data.get('Número de Remito', '')), 
-                str(data.get('Presentacion', '')),
-                str(data.get('Planta', '')), # 14va Columna: Planta
-                str(data.get('OC', '')), # 15va Columna: OC
-                str(data.get('realizado_por', '')), # 16va Columna: Realizado
-                str(data.get('controlado_por', '')), # 17va Columna: Controlado
-                str(data.get('recepcion_num', '')) # 18va Columna: Recepción
-            ]
-            
             payload = {
                 "action": "save_entry", 
                 "sheet": ws, 
-                "row": row_data,
+                "row": self._entry_row(data),
                 "env": env
             }
+            # Id de la cola local: permite al script descartar reintentos de una entrada ya guardada
+            if data.get('entry_id'): payload["entry_id"] = data['entry_id']
+            # Números tomados de un bloque reservado: el script los respeta en lugar de generarlos
+            if data.get('preassigned'): payload["preassigned"] = True
             
-            resp = requests.post(self.script_url, json=payload, timeout=20)
+            resp = self.http.post("save_entry_remote", self.script_url, json=payload)
             if resp.status_code == 200:
                 result = resp.json()
                 if result.get("status") == "OK":
-                    self.cached_xl = None # Limpiar caché para forzar descarga de nuevos datos
+                    self._after_save(ws, env)
                     return True, result
                 return False, f"Server Error: {result.get('status')}"
             return False, f"Error de conexión {resp.status_code}"
         except Exception as e:
             return False, str(e)
 
+    def save_entries_remote(self, entries, env="Producción"):
+        """Guarda varias filas (mismo remito) en una sola llamada.
+
+        Devuelve (True, [{"analysis": ..., "reception": ...}, ...]) en el mismo orden que `entries`.
+        Si el Apps Script no conoce 'save_entries', se envían de a una; las filas que fallen llevan {"error": ...}.
+        Cualquier otro error devuelve (False, estado) para reintentar el lote completo.
+        """
+        if not self.script_url or "/exec" not in self.script_url:
+            return False, "⚠️ Configuración incompleta: Pega la URL de Apps Script en app.py"
+        if not entries: return True, []
+
+        ws = "Datos a completar" if env == "Producción" else "Datos a completar_Test"
+        try:
+            payload = {
+                "action": "save_entries",
+                "sheet": ws,
+                "rows": [self._entry_row(e) for e in entries],
+                "entry_ids": [e.get('entry_id', '') for e in entries],
+                "preassigned": [bool(e.get('preassigned')) for e in entries],
+                "env": env
+            }
+            resp = self.http.post("save_entries", self.script_url, json=payload)
+            if resp.status_code != 200:
+                return False, f"Error de conexión {resp.status_code}"
+            result = resp.json()
+            if result.get("status") == "OK":
+                results = result.get("results", [])
+                # Una sola invalidación para todo el lote
+                self._after_save(ws, env)
+                if len(results) != len(entries):
+                    return False, f"El servidor devolvió {len(results)} resultados para {len(entries)} filas"
+                return True, results
+            # Cualquier otro error (lock, cuota) puede llegar con el lote ya escrito: se reintenta el lote
+            # entero con los mismos entry_ids, nunca fila por fila (duplicaría filas y Nº de Recepción)
+            if not _unknown_action(result):
+                return False, result.get("status")
+        except Exception as e:
+            return False, str(e)
+
+        # Sin soporte de lote en el script: una llamada por fila (las que fallen llevan "error")
+        results = []
+        for e in entries:
+            ok, res = self.save_entry_remote(e, env)
+            results.append(res if ok else {"error": res})
+        return True, results
+
+    def _number_lease(self, env):
+        ws = "State" if env == "Producción" else "State_Test"
+        if not self.lease_block or not self.script_url or "/exec" not in self.script_url: return None
+        return get_number_lease(
+            (self.script_url, ws),
+            lambda kind, count: self._lease_numbers(ws, kind, count),
+            lambda kind, desde, hasta: self._release_numbers(ws, kind, desde, hasta),
+            self.lease_block,
+        )
+
+    def _lease_numbers(self, ws, kind, count):
+        """Reserva atómica en el servidor de `count` números seguidos. (desde, hasta, año), None si el script
+        no conoce la acción; ante cualquier otro error lanza excepción (NumberLease reintenta más tarde)"""
+        resp = self.http.post("lease_numbers", self.script_url, json={"action": "lease_numbers", "sheet": ws, "kind": kind, "count": int(count)})
+        if resp.status_code != 200: raise RuntimeError(f"Error de conexión {resp.status_code}")
+        result = _script_result(resp)
+        if result.get("status") != "OK":
+            if _unknown_action(result): return None
+            raise RuntimeError(f"Servidor: {result.get('status')}")
+        # El contador del servidor ya avanzó: la caché de estado quedó vieja
+        with _STATE_LOCK:
+            _STATE.pop((self.script_url, ws), None)
+        return int(result["from"]), int(result["to"]), int(result.get("year") or datetime.now().year % 100)
+
+    def _release_numbers(self, ws, kind, desde, hasta):
+        """Devuelve números sin usar; el servidor sólo los recupera si siguen siendo los últimos (si no, los registra)"""
+        resp = self.http.post("release_numbers", self.script_url, idempotent=True, json={"action": "release_numbers", "sheet": ws, "kind": kind, "from": desde, "to": hasta})
+        return resp.status_code == 200 and resp.json().get("status") == "OK" and bool(resp.json().get("reclaimed"))
+
+    def assign_numbers(self, entries, env="Producción", reception=None):
+        """Numera localmente las entradas de un mismo remito desde los bloques reservados:
+        un Nº de Análisis por línea y un Nº de Recepción para todo el remito.
+        Con `reception` (remito ya empezado) sólo se reservan Nº de Análisis y se usa ese Nº de Recepción.
+        Si el script no soporta reservas, las entradas quedan como están y numera el servidor al guardar."""
+        pool = self._number_lease(env)
+        if pool is None or not entries: return False
+        analyses = pool.take("analysis", len(entries))
+        if analyses is None: return False
+        if reception is None:
+            taken = pool.take("reception")
+            if taken is None:
+                # Sin Nº de Recepción numera el servidor: los Nº de Análisis tomados vuelven al bloque
+                pool.put_back("analysis", analyses)
+                return False
+            reception = taken[0][0]
+        for e, (n, y) in zip(entries, analyses):
+            e['Número de Análisis'] = f"{n:04d}/{y}"
+            e['recepcion_num'] = reception
+            e['preassigned'] = True
+        return True
+
+    def suggested_reception(self, env="Producción", cached_only=False):
+        """Nº de Recepción que recibirá el próximo guardado.
+        cached_only (página armada desde la foto en disco): no espera ninguna descarga; usa los contadores
+        en memoria o, si no hay, el mayor Nº de Recepción del historial de la foto"""
+        pool = self._number_lease(env)
+        nxt = pool.peek("reception") if pool else None
+        if nxt is not None: return str(nxt)
+        if cached_only:
+            with _STATE_LOCK:
+                cached = _STATE.get((self.script_url, "State" if env == "Producción" else "State_Test"))
+            if cached: return str(cached[0].get("last_reception", 0) + 1)
+            data = self.warm_start_data(env)
+            hist = data["history"] if data else None
+            if hist is None or "recepcion_num" not in hist.columns: return ""
+            last = pd.to_numeric(hist["recepcion_num"].astype(str), errors="coerce").max()
+            return str(int(last) + 1) if pd.notna(last) else ""
+        return str(self.get_state(env).get("last_reception", 0) + 1)
+
     def generate_next_number(self, env="Producción"):
-        s = self.get_state(env)
+        # Desde el bloque reservado: sin lectura-modificación-escritura del estado
+        pool = self._number_lease(env)
+        got = pool.take("analysis") if pool else None
+        if got:
+            return f"{got[0][0]:04d}/{got[0][1]}"
+        s = self.get_state(env, fresh=True)
         y = datetime.now().year % 100
         val = int(s.get("last_number", 0)) + 1
         s["last_number"] = val
@@ -183,28 +714,188 @@ class AnalysisManager:
         return f"{val:04d}/{y}"
 
     def generate_next_reception(self, env="Producción"):
-        s = self.get_state(env)
+        pool = self._number_lease(env)
+        got = pool.take("reception") if pool else None
+        if got:
+            return str(got[0][0])
+        s = self.get_state(env, fresh=True)
         val = int(s.get("last_reception", 0)) + 1
         s["last_reception"] = val
         self.save_state(s, env)
         return str(val)
 
-    def get_history(self, env="Producción"):
-        if not self.cached_xl:
-            self._fetch_all()
+    def _history_state(self, ws):
+        with _HISTORY_LOCK:
+            return _HISTORY.setdefault((self.doc_id, ws), _HistoryState())
+
+    def get_history(self, env="Producción", refresh=False):
+        """Historial limpio compartido. Tras la carga completa sólo se piden las filas nuevas al servidor"""
+        self._fetch_all()
         ws = "Datos a completar" if env == "Producción" else "Datos a completar_Test"
-        if self.cached_xl and ws in self.cached_xl.sheet_names:
-            df = self.cached_xl.parse(ws)
-            if not df.empty:
-                # Filtrar solo la fila de ejemplo/instrucciones si existe (usualmente contiene estas palabras clave)
-                # Eliminamos 'carga' y 'manual' del patrón ya que son palabras comunes en datos reales
-                patron_instrucciones = "toma|asignado|ejemplo|ingresa|automatico|pestaña"
-                mask = df.astype(str).apply(lambda x: x.str.contains(patron_instrucciones, case=False, na=False)).any(axis=1)
-                # Solo aplicar la máscara si la fila está entre las primeras 3 (típico de filas de cabecera/ejemplo)
-                df = df[~(mask & (df.index < 3))]
-                df = df.dropna(how='all')
-            return df
-        return pd.DataFrame()
+        h = self._history_state(ws)
+        with h.lock:
+            xl = self.cached_xl
+            stale = h.dirty or refresh or (xl is not None and h.generation != xl.generation)
+            if h.df is not None and stale and h.delta_supported and self.script_url and "/exec" in self.script_url:
+                # Se limpia antes de pedir: un guardado que termine durante el pedido lo vuelve a marcar
+                h.dirty = False
+                if self._apply_history_delta(ws, h):
+                    if xl is not None: h.generation = xl.generation
+                    h.checked_at = time.time()
+                    return h.df
+                # Se detectó una edición de filas viejas: recarga completa desde un libro actualizado
+                self.cache.invalidate()
+                self._fetch_all()
+                xl = self.cached_xl
+            if h.df is None or stale:
+                self._load_history_full(ws, h, xl)
+            return h.df if h.df is not None else pd.DataFrame()
+
+    def _load_history_full(self, ws, h, xl):
+        if not xl or ws not in xl.sheet_names:
+            h.df = None
+            return
+        raw = xl.parse(ws)
+        h.df = xl.memo(("history", ws), lambda: self._ingest_history(raw))
+        h.columns = list(raw.columns)
+        h.raw_rows = len(raw)
+        h.last_key = str(raw.iloc[-1, 3]).strip() if len(raw) and len(raw.columns) > 3 else None
+        h.generation = xl.generation
+        h.checked_at = time.time()
+        h.dirty = False
+
+    def _apply_history_delta(self, ws, h):
+        """Agrega al historial las filas posteriores a la última conocida. False si hace falta recarga completa"""
+        # Pedimos desde la última fila conocida (inclusive) para verificar que no se movió nada
+        payload = {"action": "get_rows_since", "sheet": ws, "from_row": max(h.raw_rows - 1, 0)}
+        try:
+            resp = self.http.post("get_rows_since", self.script_url, idempotent=True, json=payload)
+            result = _script_result(resp) if resp.status_code == 200 else {}
+        except Exception:
+            return False
+        if result.get("status") != "OK":
+            # El Apps Script no conoce la acción: seguimos con recargas completas (otro error: sólo esta vez)
+            if _unknown_action(result): h.delta_supported = False
+            return False
+
+        rows = result.get("rows", [])
+        total = int(result.get("total_rows", h.raw_rows))
+        edit_rev = result.get("edit_rev")
+        # Recién cargado no se sabe qué revisión trajo el libro: sólo se confía si nunca se editó nada
+        edited = edit_rev is not None and edit_rev != (h.edit_rev if h.edit_rev is not None else 0)
+        h.edit_rev = edit_rev
+        if edited or total < h.raw_rows:
+            return False
+        if h.raw_rows:
+            if not rows or len(rows[0]) < 4 or str(rows[0][3]).strip() != h.last_key:
+                return False
+            rows = rows[1:]
+        if not rows:
+            return True
+
+        n = len(h.columns)
+        rows = [(list(r) + [None] * n)[:n] for r in rows]
+        new = pd.DataFrame(rows, columns=h.columns, index=range(h.raw_rows, h.raw_rows + len(rows)))
+        new = new.where(new != "")
+        # Misma ingesta que la carga completa (fechas y números llegan como texto)
+        new = self._ingest_history(new)
+        for c in new.columns:
+            if c in h.df.columns and pd.api.types.is_numeric_dtype(h.df[c]):
+                new[c] = pd.to_numeric(new[c], errors='coerce')
+        h.raw_rows += len(rows)
+        h.last_key = str(rows[-1][3]).strip() if n > 3 else None
+        if not new.empty:
+            # Las categorías se recalculan sobre el total (concat de categorías distintas da texto)
+            h.df = _coerce_categories(pd.concat([h.df, new]))
+        return True
+
+    def _ingest_history(self, df):
+        """Deja el historial listo para mostrar: nombres de columna, sin filas de instrucciones y con tipos fijos"""
+        if df.empty: return df
+        # Filtrar solo la fila de ejemplo/instrucciones si existe (usualmente contiene estas palabras clave)
+        # Eliminamos 'carga' y 'manual' del patrón ya que son palabras comunes en datos reales
+        # Sólo se revisan las primeras 3 filas (típico de filas de cabecera/ejemplo)
+        patron_instrucciones = "toma|asignado|ejemplo|ingresa|automatico|pestaña"
+        head = df[df.index < 3]
+        if not head.empty:
+            mask = head.astype(str).apply(lambda x: x.str.contains(patron_instrucciones, case=False, na=False)).any(axis=1)
+            df = df.drop(head.index[mask])
+        df = df.dropna(how='all')
+        df = df.rename(columns=_history_rename_map(list(df.columns)))
+
+        # Fechas reales (las filas que llegan como texto vienen en dd/mm/aaaa)
+        for c in HISTORY_DATE_COLUMNS:
+            if c in df.columns and not pd.api.types.is_datetime64_any_dtype(df[c]):
+                df[c] = pd.to_datetime(df[c], dayfirst=True, errors='coerce')
+
+        # Texto sin 'nan' para evitar errores en data_editor con NaNs o tipos mezclados
+        for c in HISTORY_TEXT_COLUMNS:
+            if c in df.columns:
+                col = df[c]
+                if pd.api.types.is_float_dtype(col) and (col.dropna() % 1 == 0).all():
+                    col = col.astype("Int64") # 12.0 -> 12
+                elif col.dtype == object:
+                    # Columna mezclada (la fila de instrucciones la deja como object): sólo los números
+                    # enteros pierden el ".0"; el texto ("0012", "R-15") queda tal cual
+                    whole = col.map(lambda v: isinstance(v, float) and v.is_integer())
+                    if whole.any(): col = col.mask(whole, col[whole].map(lambda v: str(int(v))))
+                df[c] = col.astype(str).where(col.notna(), "").replace('nan', '')
+
+        # Números sólo si todas las celdas con dato lo son (un texto suelto deja la columna como vino)
+        for c in HISTORY_NUMBER_COLUMNS:
+            if c in df.columns and not pd.api.types.is_numeric_dtype(df[c]):
+                num = pd.to_numeric(df[c].astype(str).str.replace(",", ".", regex=False).where(df[c].notna()), errors='coerce')
+                if num.notna().sum() == df[c].notna().sum(): df[c] = num
+
+        return _coerce_categories(df)
+
+    def patch_history_remote(self, changes, env="Producción", full_df=None):
+        """Envía sólo las celdas modificadas (clave: Nº de Análisis). Sólo si el script no conoce la acción
+        se reescribe full_df; cualquier otro error (lock, clave inexistente) se informa sin reescribir nada"""
+        if not self.script_url or "/exec" not in self.script_url:
+            return False, "⚠️ Configuración incompleta: Pega la URL de Apps Script en app.py"
+        if changes is None: return False, "No se pudieron alinear las filas con lo descargado (claves repetidas o filas distintas)"
+        if not changes: return True, "Sin cambios"
+
+        ws = "Datos a completar" if env == "Producción" else "Datos a completar_Test"
+        try:
+            # La columna va por posición (0 = A): los nombres mostrados pueden diferir del encabezado de la hoja
+            payload = {"action": "patch_history", "sheet": ws, "key_col": 3, "changes": changes}
+            resp = self.http.post("patch_history", self.script_url, json=payload)
+            if resp.status_code != 200: return False, f"Error {resp.status_code}"
+            result = resp.json()
+            if result.get("status") != "OK":
+                if full_df is not None and _unknown_action(result): return self.update_history_remote(full_df, env)
+                return False, f"Servidor: {result.get('status')}"
+            self._apply_history_patch(ws, changes, result)
+            return True, "OK"
+        except Exception as e:
+            return False, str(e)
+
+    def _apply_history_patch(self, ws, changes, result):
+        """Aplica al historial en memoria los cambios ya confirmados, sin recargar la hoja"""
+        h = self._history_state(ws)
+        with h.lock:
+            # Las respuestas pueden llegar desordenadas: la revisión sólo avanza
+            rev = result.get("edit_rev")
+            if rev is not None and (h.edit_rev is None or rev > h.edit_rev): h.edit_rev = rev
+            # La foto del libro (y su historial memorizado) es anterior al cambio: sin deltas, la próxima carga
+            # completa saldría de ella y desharía la edición en pantalla. Con deltas toda recarga completa
+            # ya vence el libro antes
+            if not h.delta_supported: self.cache.invalidate()
+            if h.df is None or len(h.df.columns) <= 3: return
+            df = h.df.copy()
+            keys = df.iloc[:, 3].astype(str).str.strip()
+            for ch in changes:
+                if ch["col"] >= len(df.columns): continue
+                c = df.columns[ch["col"]]
+                val = ch["value"]
+                if pd.api.types.is_datetime64_any_dtype(df[c]): val = pd.to_datetime(val, dayfirst=True, errors='coerce')
+                elif pd.api.types.is_numeric_dtype(df[c]): val = pd.to_numeric(val, errors='coerce')
+                elif isinstance(df[c].dtype, pd.CategoricalDtype) and val not in df[c].cat.categories:
+                    df[c] = df[c].cat.add_categories([val])
+                df.loc[keys == ch["key"], c] = val
+            h.df = df
 
     def update_history_remote(self, df, env="Producción"):
         """Envía el historial completo editado al servidor para actualizar la hoja"""
@@ -213,31 +904,18 @@ class AnalysisManager:
         
         ws = "Datos a completar" if env == "Producción" else "Datos a completar_Test"
         try:
-            # Convertimos el DataFrame a una lista de listas (matriz) para el Apps Script
-            # Incluimos los encabezados para que el script pueda mapear o sobrescribir
-            data_to_send = [df.columns.tolist()] + df.values.tolist()
-            
-            # Limpieza de datos: convertir todo a string o tipos básicos para JSON
-            clean_data = []
-            for row in data_to_send:
-                clean_row = []
-                for val in row:
-                    if pd.isna(val): clean_row.append("")
-                    elif isinstance(val, (datetime, pd.Timestamp)): clean_row.append(val.strftime("%d/%m/%Y"))
-                    else: clean_row.append(str(val))
-                clean_data.append(clean_row)
-
-            payload = {
-                "action": "update_history", 
-                "sheet": ws, 
-                "rows": clean_data
-            }
+            # Matriz de texto (encabezado + filas) armada por columnas; opcionalmente comprimida
+            payload = {"action": "update_history", "sheet": ws}
+            payload.update(rows_payload(df, compress=self.compress_payloads))
             
-            resp = requests.post(self.script_url, json=payload, timeout=30)
+            resp = self.http.post("update_history", self.script_url, json=payload)
             if resp.status_code == 200:
                 result = resp.json()
                 if result.get("status") == "OK":
-                    self.cached_xl = None # Forzar recarga
+                    self.cache.invalidate() # Forzar recarga
+                    # Se reescribieron filas viejas: el historial se recarga completo
+                    with self._history_state(ws).lock:
+                        self._history_state(ws).df = None
                     return True, "OK"
                 return False, f"Servidor: {result.get('status')}"
             return False, f"Error {resp.status_code}"
@@ -0,0 +1,6 @@
+"""Benchmarks y pruebas de carga sin Google: libro sintético + servidor local que imita export y Apps Script.
+
+Se corren desde la raíz del repo:
+    python -m bench.run --size realistic
+    python -m bench.load --sessions 20
+"""
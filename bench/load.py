@@ -0,0 +1,218 @@
+"""Prueba de carga: N operadores simultáneos contra el servidor local.
+
+Cada sesión hace lo mismo que la página: ingreso (catálogo + historial), búsquedas,
+"GENERAR ANÁLISIS" (por la cola local, como la app), edición de una celda del historial
+y reimpresión de rótulos. Informa p50/p95/p99 por paso, rendimiento, memoria por sesión
+y Nº de análisis / recepción repetidos.
+
+    python -m bench.load --sessions 20 --iterations 5 --latency 0.2
+    python -m bench.load --sessions 20 --numbering legacy   # contadores con get_state + save_state
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from app_logic import AnalysisManager, diff_history
+from bench.stub import StubServer
+from bench.synth import SIZES, tables_for
+from label_files import render_pdf
+from labels import BultoPlan, LabelSheet
+from outbox import CONFIRMED, Outbox
+
+STEPS = ["login", "search", "generar", "history_edit", "reprint"]
+
+
+def _pct(values, q):
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0.0
+
+
+class Session:
+    """Una pestaña del navegador: su manager y su 'session_state'"""
+    def __init__(self, n, srv, outbox, numbering, rnd):
+        self.n = n
+        self.env = "Producción"
+        self.outbox = outbox
+        self.numbering = numbering
+        self.rnd = rnd
+        self.manager = AnalysisManager(srv.sheet_url(), srv.script_url, lease_block=20 if numbering == "lease" else 0)
+        self.state = {}
+        self.saved = []
+
+    def login(self):
+        data = self.manager.get_excel_data()
+        self.state.update(skus=data["skus"], sku_index=data["sku_index"], prov_index=data["prov_index"],
+                          providers=data["providers"])
+        self.state["history"] = self.manager.get_history(env=self.env)
+        self.state["next_rec"] = self.manager.suggested_reception(env=self.env)
+
+    def search(self):
+        sku = self.rnd.choice(self.state["skus"])
+        words = str(sku["Nombre"]).split()
+        for q in (str(sku["Articulo"])[:3], words[0][:4], words[-1][:3]):
+            self.state["sku_index"].search(q)
+        self.state["prov_index"].search(self.rnd.choice(self.state["prov_index"].names).split()[0][:4])
+        return sku
+
+    def generar(self, sku):
+        entry = {
+            "Fecha": time.strftime("%d/%m/%Y"), "SKU": str(sku["Articulo"]), "Descripción de Producto": sku["Nombre"],
+            "Número de Análisis": "PENDIENTE", "Lote": f"LT{self.n}-{self.rnd.randint(1, 10**6)}", "Origen": "Nacional",
+            "Cantidad": 50.0, "UDM": "KG", "Cantidad Bultos": 4, "Vto": "01/01/2030",
+            "Proveedor": self.rnd.choice(self.state["prov_index"].names), "Número de Remito": f"R-{self.n}",
+            "Presentacion": "Cajas", "recepcion_num": 0, "realizado_por": "A", "controlado_por": "B",
+            "Planta": self.rnd.choice(["Barracas", "Pibera"]), "OC": "",
+        }
+        if self.numbering == "legacy":
+            # Como antes: leer contadores, sumar uno y escribirlos (carrera entre sesiones)
+            entry["Número de Análisis"] = self.manager.generate_next_number(self.env)
+            entry["recepcion_num"] = self.manager.generate_next_reception(self.env)
+            entry["preassigned"] = True
+        elif self.numbering == "lease":
+            self.manager.assign_numbers([entry], env=self.env)
+        entry_id = self.outbox.enqueue(entry, self.env)
+        rec = self.outbox.wait(entry_id, timeout=120)
+        if not rec or rec["status"] != CONFIRMED:
+            raise RuntimeError(f"no confirmado: {rec and rec['error']}")
+        entry["Número de Análisis"] = rec["result"].get("analysis")
+        entry["recepcion_num"] = rec["result"].get("reception")
+        self.saved.append(entry)
+        return entry
+
+    def history_edit(self):
+        base = self.manager.get_history(env=self.env)
+        if not self.saved: return
+        edited = base.copy()
+        key = self.saved[-1]["Número de Análisis"]
+        rows = edited.index[edited["Número de Análisis"] == key] if not edited.empty else []
+        # Cada falla cuenta como error del paso: si no, el informe no muestra las ediciones que no se hicieron
+        if len(rows) == 0: raise RuntimeError("el análisis guardado no está en el historial")
+        edited.loc[rows[0], "OC"] = f"OC-{self.rnd.randint(1000, 9999)}"
+        changes = diff_history(base, edited)
+        if changes is None: raise RuntimeError("no se pudo armar el parche (Nº de Análisis repetidos)")
+        if not changes: raise RuntimeError("la edición no produjo cambios")
+        ok, msg = self.manager.patch_history_remote(changes, env=self.env, full_df=edited)
+        if not ok: raise RuntimeError(msg)
+        self.state["history"] = self.manager.get_history(env=self.env)
+
+    def reprint(self):
+        entry = self.saved[-1] if self.saved else {}
+        plan = BultoPlan(entry.get("Cantidad Bultos", 4), [{"desde": 1, "hasta": entry.get("Cantidad Bultos", 4), "peso": 12.5}])
+        sheet = LabelSheet(entry, plan.runs(), plan.total, plan.total_weight)
+        sheet.render_page()
+        render_pdf(sheet)
+
+
+def run(args):
+    tables = tables_for(args.size, args.seed)
+    srv = StubServer(tables, latency=args.latency).start()
+    spool = tempfile.mkdtemp(prefix="bench_outbox_")
+    timings = {s: [] for s in STEPS}
+    errors = Counter()
+    lock = threading.Lock()
+
+    def timed(step, fn, *a):
+        t0 = time.perf_counter()
+        try:
+            return fn(*a)
+        except Exception as e:
+            with lock: errors[f"{step}: {e}"] += 1
+        finally:
+            with lock: timings[step].append(time.perf_counter() - t0)
+
+    if args.tracemalloc: tracemalloc.start()
+    # Cola compartida por el proceso, como en la app (su hilo usa el manager de la primera sesión)
+    first = AnalysisManager(srv.sheet_url(), srv.script_url, lease_block=0)
+    outbox = Outbox(os.path.join(spool, "outbox.sqlite3"), first.save_entry_remote, base_delay=0.2).start()
+    first.get_excel_data()
+    first.get_history()
+    base_mem = tracemalloc.get_traced_memory()[0] if args.tracemalloc else 0
+
+    sessions = [Session(i, srv, outbox, args.numbering, random.Random(args.seed + i)) for i in range(args.sessions)]
+    logged_in = threading.Barrier(args.sessions + 1)
+    mem = {}
+
+    def worker(s):
+        timed("login", s.login)
+        logged_in.wait()
+        for _ in range(args.iterations):
+            sku = timed("search", s.search)
+            if sku is None: continue
+            timed("generar", s.generar, sku)
+            if args.think: time.sleep(s.rnd.uniform(0, args.think))
+            timed("history_edit", s.history_edit)
+            timed("reprint", s.reprint)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(s,), name=f"sesion-{s.n}") for s in sessions]
+    for t in threads: t.start()
+    logged_in.wait()
+    if args.tracemalloc:
+        # Sólo se traza el ingreso: con tracemalloc activo las demás mediciones de tiempo no servirían
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        mem["per_session_bytes"] = (current - base_mem) / max(args.sessions, 1)
+        mem["peak_bytes"] = peak
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - t0
+
+    analyses = [e["Número de Análisis"] for s in sessions for e in s.saved]
+    receptions = [str(e["recepcion_num"]) for s in sessions for e in s.saved]
+    sheet_keys = [str(r[3]) for r in srv.backend.tables["Datos a completar"][1][len(tables["Datos a completar"][1]):]]
+    srv.stop()
+
+    ops = sum(len(v) for v in timings.values())
+    return {
+        "sessions": args.sessions, "iterations": args.iterations, "numbering": args.numbering,
+        "latency": args.latency, "size": args.size, "elapsed_s": elapsed,
+        "throughput_ops_s": ops / elapsed if elapsed else 0.0,
+        "saves_per_s": len(analyses) / elapsed if elapsed else 0.0,
+        "steps": {k: {"n": len(v), "p50": _pct(v, .5), "p95": _pct(v, .95), "p99": _pct(v, .99)} for k, v in timings.items()},
+        "memory": mem,
+        "duplicates": {
+            "analysis": {k: c for k, c in Counter(analyses).items() if c > 1},
+            "reception": {k: c for k, c in Counter(receptions).items() if c > 1},
+            "sheet_analysis": {k: c for k, c in Counter(sheet_keys).items() if c > 1},
+        },
+        "errors": dict(errors),
+        "stub_calls": dict(srv.backend.calls),
+        "skipped_numbers": srv.backend.skipped,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sessions", type=int, default=10)
+    ap.add_argument("--iterations", type=int, default=3)
+    ap.add_argument("--size", choices=list(SIZES), default="small")
+    ap.add_argument("--latency", type=float, default=0.05, help="demora del servidor por pedido (s)")
+    ap.add_argument("--think", type=float, default=0.0, help="pausa máxima del operador entre pasos (s)")
+    ap.add_argument("--numbering", choices=["server", "lease", "legacy"], default="server")
+    ap.add_argument("--seed", type=int, default=11)
+    ap.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false")
+    ap.add_argument("--json", help="guardar el resultado en este archivo")
+    args = ap.parse_args()
+
+    res = run(args)
+    print(f"{res['sessions']} sesiones x {res['iterations']} vueltas ({res['numbering']}) en {res['elapsed_s']:.1f} s")
+    print(f"rendimiento: {res['throughput_ops_s']:.1f} pasos/s, {res['saves_per_s']:.2f} guardados/s")
+    for k, v in res["steps"].items():
+        print(f"  {k:14s} n={v['n']:4d}  p50 {v['p50'] * 1000:8.1f} ms  p95 {v['p95'] * 1000:8.1f} ms  p99 {v['p99'] * 1000:8.1f} ms")
+    if res["memory"]:
+        print(f"memoria: {res['memory']['per_session_bytes'] / 1024:.0f} KiB por sesión, pico al ingresar {res['memory']['peak_bytes'] / 2**20:.1f} MiB")
+    dups = res["duplicates"]
+    print(f"repetidos: análisis {len(dups['analysis'])}, recepción {len(dups['reception'])}, en la hoja {len(dups['sheet_analysis'])}")
+    if res["errors"]: print("errores:", json.dumps(res["errors"], ensure_ascii=False))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=1, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
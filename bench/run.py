@@ -0,0 +1,170 @@
+"""Benchmarks repetibles contra el servidor local (sin red).
+
+    python -m bench.run --size realistic --repeat 5
+    python -m bench.run --size stress --compare bench/results/<anterior>.json
+
+Cada corrida queda en bench/results/<fecha>_<tamaño>.json para comparar entre versiones.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from app_logic import AnalysisManager
+from bench.stub import StubServer
+from bench.synth import SIZES, tables_for
+from label_files import render_pdf, render_zpl
+from labels import BultoPlan, LabelSheet
+from metrics import METRICS
+from payloads import rows_payload
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def measure(fn, repeat, setup=None):
+    """Tiempos (s) de `repeat` ejecuciones; setup() corre antes de cada una sin contar"""
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        fn(arg) if setup else fn()
+        times.append(time.perf_counter() - t0)
+    return _stats(times)
+
+
+def _stats(times):
+    times = sorted(times)
+    return {
+        "n": len(times), "min": times[0], "median": statistics.median(times),
+        "p95": times[min(int(0.95 * len(times)), len(times) - 1)], "max": times[-1],
+    }
+
+
+def _git_rev():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(size, repeat, seed=7):
+    tables = tables_for(size, seed)
+    srv = StubServer(tables).start()
+    res = {}
+    fresh = iter(range(10**6))
+
+    def new_manager():
+        # Un id de libro nuevo por corrida: cachés del proceso vacías (arranque en frío)
+        return AnalysisManager(srv.sheet_url(f"bench{next(fresh)}"), srv.script_url, lease_block=0)
+
+    try:
+        res["get_excel_data_cold"] = measure(lambda m: m.get_excel_data(), repeat, setup=new_manager)
+        m = new_manager()
+        m.get_excel_data()
+        res["get_excel_data_warm"] = measure(lambda: m.get_excel_data(), repeat * 20)
+        res["revalidate_unchanged"] = measure(lambda: m.get_excel_data(force=True), repeat)
+
+        def loaded_manager():
+            mm = new_manager()
+            mm.get_excel_data()
+            return mm
+        res["get_history_full"] = measure(lambda mm: mm.get_history(), repeat, setup=loaded_manager)
+
+        entry = {"Fecha": "01/02/2026", "SKU": tables["SKU"][1][0][0], "Descripción de Producto": tables["SKU"][1][0][1],
+                 "Lote": "LB1", "Origen": "Nacional", "Cantidad": 10, "UDM": "KG", "Cantidad Bultos": 2, "Vto": "01/02/2028",
+                 "Proveedor": tables["Proveedores"][1][0][0], "Número de Remito": "R-BENCH", "Presentacion": "Cajas",
+                 "Planta": "Barracas", "realizado_por": "A", "controlado_por": "B"}
+        m.get_history()
+        m.get_state()  # con el endpoint de estado disponible, guardar no vence el libro entero
+        res["save_entry_remote"] = measure(lambda: m.save_entry_remote(dict(entry)), repeat)
+        res["get_history_delta"] = measure(lambda _: m.get_history(), repeat, setup=lambda: m.save_entry_remote(dict(entry)))
+
+        df = m.get_history()
+        res["history_rows"] = len(df)
+        res["serialize_rows"] = measure(lambda: rows_payload(df), repeat)
+        res["serialize_rows_gzip"] = measure(lambda: rows_payload(df, compress=True), repeat)
+        res["payload_bytes"] = len(json.dumps(rows_payload(df), ensure_ascii=False).encode("utf-8"))
+        res["payload_bytes_gzip"] = len(json.dumps(rows_payload(df, compress=True)).encode("utf-8"))
+
+        data = m.get_excel_data()
+        rnd = random.Random(seed)
+        names = [s["Nombre"] for s in data["skus"]]
+        queries = ([str(s["Articulo"]) for s in rnd.sample(data["skus"], 50)]          # código exacto
+                   + [n.split()[0][:4] for n in rnd.sample(names, 50)]                   # prefijo
+                   + [n.split()[1][1:5] for n in rnd.sample(names, 50)]                  # contiene
+                   + ["zzzz", "a", "ac"])
+        res["search_sku"] = _stats([_time(data["sku_index"].search, q) for q in queries * repeat])
+        prov_q = [p.split()[1][:4].lower() for p in data["prov_index"].names[:50]] + ["s.a", "qu"]
+        res["search_provider"] = _stats([_time(data["prov_index"].search, q) for q in prov_q * repeat])
+
+        row = df.iloc[-1].to_dict()
+        plan = BultoPlan(200, [{"desde": 1, "hasta": 150, "peso": 25}, {"desde": 151, "hasta": 200, "peso": 12.5}])
+        res["label_html_200"] = measure(lambda: LabelSheet(row, plan.runs(), 200, plan.total_weight).render_page(), repeat)
+        sheet = LabelSheet(row, plan.runs(), 200, plan.total_weight)
+        res["label_pdf_200"] = measure(lambda: render_pdf(sheet), repeat)
+        res["label_zpl_200"] = measure(lambda: render_zpl(sheet), repeat)
+        res["stub_calls"] = dict(srv.backend.calls)
+    finally:
+        srv.stop()
+    return res
+
+
+def _time(fn, *args):
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+
+def compare(new, old):
+    """Mediana actual vs anterior, por benchmark"""
+    lines = []
+    for k, v in new["results"].items():
+        o = old["results"].get(k)
+        if isinstance(v, dict) and isinstance(o, dict) and "median" in v and o.get("median"):
+            ratio = v["median"] / o["median"]
+            lines.append(f"{k:28s} {o['median'] * 1000:10.2f} ms -> {v['median'] * 1000:10.2f} ms  x{ratio:.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--size", choices=list(SIZES), default="small")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--compare", help="resultado anterior (JSON) para comparar")
+    ap.add_argument("--no-save", action="store_true")
+    args = ap.parse_args()
+
+    METRICS.reset()
+    results = run(args.size, args.repeat, args.seed)
+    out = {
+        "size": args.size, "params": SIZES[args.size], "repeat": args.repeat, "seed": args.seed,
+        "git": _git_rev(), "when": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "pandas": pd.__version__, "machine": platform.machine(),
+        "results": results, "metrics": METRICS.snapshot(),
+    }
+    for k, v in results.items():
+        if isinstance(v, dict) and "median" in v:
+            print(f"{k:28s} median {v['median'] * 1000:10.2f} ms   p95 {v['p95'] * 1000:10.2f} ms   (n={v['n']})")
+        else:
+            print(f"{k:28s} {v}")
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{args.size}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(out, f, indent=1, ensure_ascii=False)
+        print("guardado en", path)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(out, json.load(f)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Servidor local que reemplaza a Google: export del libro (xlsx/csv) y las acciones del Apps Script.
+
+    python -m bench.stub --size small --port 8765
+    -> libro:  http://127.0.0.1:8765/spreadsheets/d/bench
+    -> script: http://127.0.0.1:8765/macros/s/bench/exec
+"""
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bench.synth import csv_bytes, tables_for, workbook_bytes
+
+
+def _state_sheet(sheet, env=None):
+    if env is not None: return "State" if env == "Producción" else "State_Test"
+    return "State_Test" if sheet.endswith("_Test") else "State"
+
+
+class Backend:
+    """Estado en memoria del libro + la lógica de cada acción, con un lock global (como LockService)"""
+    def __init__(self, tables, latency=0.0):
+        self.tables = {name: (list(h), [list(r) for r in rows]) for name, (h, rows) in tables.items()}
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.version = 0
+        self.edit_rev = {}
+        self.entries = {}     # entry_id -> resultado (reintentos idempotentes)
+        self.skipped = []     # números reservados que no se pudieron recuperar
+        self.calls = {}
+        self._export = None   # (versión, bytes, etag)
+
+    # --- export ---
+
+    def export_xlsx(self):
+        with self.lock:
+            self.calls["export"] = self.calls.get("export", 0) + 1
+            if self._export and self._export[0] == self.version:
+                return self._export[1], self._export[2]
+            version, tables = self.version, {n: (h, list(r)) for n, (h, r) in self.tables.items()}
+        data = workbook_bytes(tables)
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        with self.lock:
+            self._export = (version, data, etag)
+        return data, etag
+
+    def export_csv(self, gid):
+        name = list(self.tables)[gid]
+        with self.lock:
+            header, rows = self.tables[name]
+            return csv_bytes(header, list(rows))
+
+    # --- acciones del script ---
+
+    def dispatch(self, payload):
+        action = payload.get("action")
+        handler = getattr(self, "do_" + str(action), None)
+        if self.latency: time.sleep(self.latency)
+        with self.lock:
+            self.calls[action] = self.calls.get(action, 0) + 1
+            if handler is None:
+                return {"status": f"Acción desconocida: {action}"}
+            return handler(payload)
+
+    def _state(self, sheet):
+        return self.tables[sheet][1][0]  # [last_number, last_reception, year]
+
+    def _rows(self, sheet):
+        return self.tables[sheet][1]
+
+    def _changed(self, sheet=None, edited=False):
+        self.version += 1
+        if edited: self.edit_rev[sheet] = self.edit_rev.get(sheet, 0) + 1
+
+    def do_get_state(self, p):
+        n, r, y = self._state(p["sheet"])
+        return {"status": "OK", "last_number": n, "last_reception": r, "year": y}
+
+    def do_update_state(self, p):
+        self.tables[p["sheet"]][1][0] = [int(p["last_number"]), int(p["last_reception"]), int(p.get("year", 26))]
+        self._changed()
+        return {"status": "OK"}
+
+    def do_append(self, p):
+        self._rows(p["sheet"]).append(list(p["row"]))
+        self._changed()
+        return {"status": "OK"}
+
+    def _save(self, sheet, env, row, entry_id, preassigned, reception=None):
+        if entry_id and entry_id in self.entries:
+            return self.entries[entry_id]
+        st = self._state(_state_sheet(sheet, env))
+        year = datetime.now().year % 100
+        row = list(row)
+        if not preassigned:
+            st[0] += 1
+            st[2] = year
+            row[3] = f"{st[0]:04d}/{year}"
+            if reception is None:
+                st[1] += 1
+                reception = st[1]
+            row[17] = str(reception)
+        self._rows(sheet).append(row)
+        result = {"analysis": row[3], "reception": row[17]}
+        if entry_id: self.entries[entry_id] = result
+        return result
+
+    def do_save_entry(self, p):
+        res = self._save(p["sheet"], p.get("env"), p["row"], p.get("entry_id"), p.get("preassigned"))
+        self._changed()
+        return dict(res, status="OK")
+
+    def do_save_entries(self, p):
+        ids = p.get("entry_ids") or [""] * len(p["rows"])
+        pre = p.get("preassigned") or [False] * len(p["rows"])
+        reception = None
+        if not all(pre):
+            # Un Nº de Recepción para todo el remito
+            st = self._state(_state_sheet(p["sheet"], p.get("env")))
+            st[1] += 1
+            reception = st[1]
+        results = [self._save(p["sheet"], p.get("env"), row, i, a, reception) for row, i, a in zip(p["rows"], ids, pre)]
+        self._changed()
+        return {"status": "OK", "results": results}
+
+    def do_get_rows_since(self, p):
+        rows = self._rows(p["sheet"])
+        start = int(p.get("from_row", 0))
+        return {"status": "OK", "rows": rows[start:], "total_rows": len(rows), "edit_rev": self.edit_rev.get(p["sheet"], 0)}
+
+    def do_patch_history(self, p):
+        rows = self._rows(p["sheet"])
+        key_col = int(p.get("key_col", 3))
+        by_key = {str(r[key_col]).strip(): r for r in rows if len(r) > key_col}
+        for ch in p["changes"]:
+            r = by_key.get(str(ch["key"]))
+            if r is not None and ch["col"] < len(r): r[ch["col"]] = ch["value"]
+        self._changed(p["sheet"], edited=True)
+        return {"status": "OK", "edit_rev": self.edit_rev[p["sheet"]]}
+
+    def do_update_history(self, p):
+        if p.get("encoding") == "gzip+base64":
+            body = json.loads(gzip.decompress(base64.b64decode(p["data"])).decode("utf-8"))
+            rows = [list(r) for r in zip(*body["columns"])] if body["columns"] else []
+        else:
+            rows = p["rows"][1:]
+        header, _ = self.tables[p["sheet"]]
+        self.tables[p["sheet"]] = (header, rows)
+        self._changed(p["sheet"], edited=True)
+        return {"status": "OK"}
+
+    def do_lease_numbers(self, p):
+        st = self._state(p["sheet"])
+        i = 0 if p["kind"] == "analysis" else 1
+        start = st[i] + 1
+        st[i] += int(p["count"])
+        st[2] = datetime.now().year % 100
+        self._changed()
+        return {"status": "OK", "from": start, "to": st[i], "year": st[2]}
+
+    def do_release_numbers(self, p):
+        st = self._state(p["sheet"])
+        i = 0 if p["kind"] == "analysis" else 1
+        if st[i] == int(p["to"]):
+            st[i] = int(p["from"]) - 1
+            self._changed()
+            return {"status": "OK", "reclaimed": True}
+        self.skipped.append((p["kind"], int(p["from"]), int(p["to"])))
+        return {"status": "OK", "reclaimed": False}
+
+
+def _handler(backend):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, como Google
+
+        def _send(self, code, body=b"", ctype="application/json", headers=()):
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(body)))
+            for k, v in headers: self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if not url.path.endswith("/export"):
+                return self._send(404)
+            q = parse_qs(url.query)
+            if backend.latency: time.sleep(backend.latency)
+            if q.get("format") == ["csv"]:
+                return self._send(200, backend.export_csv(int(q.get("gid", ["0"])[0])), "text/csv")
+            data, etag = backend.export_xlsx()
+            if self.headers.get("If-None-Match") == etag:
+                return self._send(304, headers=[("ETag", etag)])
+            self._send(200, data, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", [("ETag", etag)])
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            try:
+                result = backend.dispatch(json.loads(body))
+            except Exception as e:
+                result = {"status": f"Error: {e}"}
+            self._send(200, json.dumps(result, ensure_ascii=False).encode("utf-8"))
+
+        def log_message(self, *args):
+            pass
+    return Handler
+
+
+class StubServer:
+    """Levanta el servidor en un hilo. sheet_url y script_url van directo a AnalysisManager"""
+    def __init__(self, tables, port=0, latency=0.0, doc_id="bench"):
+        self.backend = Backend(tables, latency)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), _handler(self.backend))
+        self.httpd.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self.httpd.server_port}"
+        self.doc_id = doc_id
+        self.thread = None
+
+    def sheet_url(self, doc_id=None):
+        return f"{self.base}/spreadsheets/d/{doc_id or self.doc_id}"
+
+    @property
+    def script_url(self):
+        return f"{self.base}/macros/s/{self.doc_id}/exec"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="stub", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--size", default="small")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=float, default=0.0, help="demora por pedido en segundos (imitar Google)")
+    args = ap.parse_args()
+    srv = StubServer(tables_for(args.size), args.port, args.latency).start()
+    print("libro: ", srv.sheet_url())
+    print("script:", srv.script_url)
+    try:
+        srv.thread.join()
+    except KeyboardInterrupt:
+        srv.stop()
@@ -0,0 +1,89 @@
+"""Libro sintético con la misma forma que el real: SKU, Proveedores, State y Datos a completar"""
+import csv
+import io
+import random
+from datetime import date, timedelta
+from openpyxl import Workbook
+
+SIZES = {
+    "small": {"skus": 2000, "providers": 300, "history": 5000},
+    "realistic": {"skus": 8000, "providers": 900, "history": 30000},
+    "stress": {"skus": 50000, "providers": 5000, "history": 200000},
+}
+
+HISTORY_HEADER = [
+    "Fecha", "SKU", "Descripción de Producto", "Número de Análisis", "Lote", "Origen", "Cantidad", "UDM",
+    "Cantidad Bultos", "Vto", "Proveedor", "Número de Remito", "Presentacion",
+    "Planta", "OC", "Realizado por", "Controlado por", "Nº Recepción",
+]
+# Fila de instrucciones que tiene la hoja real debajo del encabezado
+INSTRUCTION_ROW = ["Ejemplo: 01/01/2026", "Ingresa el código", "", "Asignado automático"] + [""] * 14
+
+_WORDS = ["Ácido", "Cítrico", "Sódico", "Benzoato", "Almidón", "Lactosa", "Celulosa", "Microcristalina", "Estearato",
+          "Magnesio", "Talco", "Gelatina", "Cápsula", "Blister", "Estuche", "Etiqueta", "Prospecto", "Frasco", "Tapa",
+          "Ibuprofeno", "Paracetamol", "Amoxicilina", "Vitamina", "Colorante", "Sabor", "Naranja", "Frutilla", "PVC", "Aluminio"]
+_COMPANIES = ["Química", "Droguería", "Laboratorios", "Insumos", "Plásticos", "Gráfica", "Envases", "Distribuidora"]
+_PRES = ["Cajas", "Bolsa blanca", "Bobina", "Tambor verde", "Bolsa", "Bidón", "Cuñete", "Caja de cartón", "Otros"]
+_STAFF = {"Barracas": ["Ruben Guzman", "Gaston Fonteina", "Adrian Fernandez"], "Pibera": ["Hernan Miño", "Sebastian Colmano"]}
+
+
+def make_tables(skus=2000, providers=300, history=5000, seed=7):
+    """Tablas como {hoja: (encabezado, filas)}; las filas del historial van como texto (igual que las que agrega el script)"""
+    rnd = random.Random(seed)
+    sku_rows = []
+    for i in range(skus):
+        name = " ".join(rnd.sample(_WORDS, 3)) + f" {rnd.choice(['x', ''])}{rnd.randint(1, 500)}"
+        sku_rows.append([str(10000 + i), name.upper()])
+    prov_rows = []
+    for i in range(providers):
+        prov_rows.append([f"{rnd.choice(_COMPANIES)} {rnd.choice(_WORDS)} {i} S.A.", f"30-{rnd.randint(10**7, 10**8 - 1)}-{rnd.randint(0, 9)}"])
+
+    start = date(2020, 1, 1)
+    hist_rows = [list(INSTRUCTION_ROW)]
+    reception = 0
+    for i in range(history):
+        if i % 3 == 0: reception += 1  # ~3 líneas por remito
+        sku = sku_rows[rnd.randrange(skus)]
+        d = start + timedelta(days=i * 2000 // max(history, 1))
+        planta = rnd.choice(list(_STAFF))
+        real, cont = rnd.sample(_STAFF[planta], 2)
+        hist_rows.append([
+            d.strftime("%d/%m/%Y"), sku[0], sku[1], f"{i + 1:04d}/{d.year % 100}", f"L{rnd.randint(10000, 99999)}",
+            rnd.choice(["Nacional", "Importado"]), str(round(rnd.uniform(1, 2000), 2)), rnd.choice(["KG", "UN", "L"]),
+            str(rnd.randint(1, 40)), (d + timedelta(days=720)).strftime("%d/%m/%Y"), prov_rows[rnd.randrange(providers)][0],
+            f"R-{rnd.randint(1, 99999):05d}", rnd.choice(_PRES), planta, f"OC{rnd.randint(1000, 9999)}", real, cont, str(reception),
+        ])
+    state = [[history, reception, date.today().year % 100]]
+    return {
+        "SKU": (["Articulo", "Nombre"], sku_rows),
+        "Proveedores": (["Proveedor", "CUIT"], prov_rows),
+        "State": (["last_number", "last_reception", "year"], state),
+        "State_Test": (["last_number", "last_reception", "year"], [[0, 0, date.today().year % 100]]),
+        "Datos a completar": (list(HISTORY_HEADER), hist_rows),
+        "Datos a completar_Test": (list(HISTORY_HEADER), [list(INSTRUCTION_ROW)]),
+    }
+
+
+def workbook_bytes(tables):
+    """XLSX de las tablas (modo streaming de openpyxl: rápido incluso con 200k filas)"""
+    wb = Workbook(write_only=True)
+    for name, (header, rows) in tables.items():
+        ws = wb.create_sheet(name)
+        ws.append(header)
+        for r in rows:
+            ws.append(r)
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def csv_bytes(header, rows):
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(header)
+    w.writerows(rows)
+    return out.getvalue().encode("utf-8")
+
+
+def tables_for(size, seed=7):
+    return make_tables(seed=seed, **SIZES[size])
@@ -0,0 +1,17 @@
+"""Configuración compartida por la página (app.py) y la carga masiva (import_cli.py), sin streamlit"""
+
+# 1. PEGA AQUÍ TU URL DE APPS SCRIPT (la que termina en /exec)
+SCRIPT_URL = "https://script.google.com/macros/s/AKfycbylFGmrFKbVTYcYWF998q0yzlQrWPkuWoWvGcx0Pwl87KTVpEfhy9Xm_ZqivpnE2aaXDw/exec"
+
+SHEET_URL = "https://docs.google.com/spreadsheets/d/1IhDCR-BkAl5mk9C20eCCzZ50dgYK5tw40Wt1owIIylQ"
+
+# 2. (OPCIONAL) SINCRONIZACIÓN LIVIANA: gid de cada pestaña (el número después de '#gid=' en la URL).
+# Si se completa, se descargan sólo estas pestañas en CSV y en paralelo, en lugar del XLSX completo.
+# Los nombres deben ser exactamente los de las pestañas.
+SHEET_GIDS = {
+    # "SKU": 0,
+    # "Proveedores": 0,
+    # "State": 0,
+    # "State_Test": 0,
+    # "Datos a completar": 0,
+}
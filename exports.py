@@ -0,0 +1,72 @@
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+import pandas as pd
+from openpyxl import Workbook
+
+# Archivos ya generados, por (hash del contenido, formato). Compartido por todas las sesiones
+_EXPORTS = OrderedDict()
+_EXPORTS_LOCK = threading.Lock()
+_MAX_EXPORTS = 8
+
+MIME_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+}
+
+
+def frame_digest(df):
+    """Hash del contenido del DataFrame (columnas + valores)"""
+    h = hashlib.sha1("\x1f".join(str(c) for c in df.columns).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def filter_history(df, desde=None, hasta=None, plantas=None):
+    """Recorte del historial por rango de Fecha (inclusive) y plantas"""
+    mask = pd.Series(True, index=df.index)
+    if "Fecha" in df.columns and pd.api.types.is_datetime64_any_dtype(df["Fecha"]):
+        if desde is not None: mask &= df["Fecha"] >= pd.Timestamp(desde)
+        if hasta is not None: mask &= df["Fecha"] < pd.Timestamp(hasta) + pd.Timedelta(days=1)
+    if plantas and "Planta" in df.columns:
+        mask &= df["Planta"].isin(plantas)
+    return df[mask]
+
+
+def _xlsx_bytes(df):
+    # Escritura en modo streaming: filas completas, sin estilos por celda
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Historial")
+    ws.append([str(c) for c in df.columns])
+    columns = []
+    for i in range(len(df.columns)):
+        col = df.iloc[:, i]
+        # Fechas: astype(object) da Timestamps (subclase de datetime), sin el aviso de to_pydatetime
+        values = col.astype(object).tolist()
+        columns.append([None if pd.isna(v) else v for v in values] if col.hasnans else values)
+    for row in zip(*columns):
+        ws.append(row)
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def _csv_bytes(df):
+    # BOM para que Excel abra los acentos correctamente
+    return df.to_csv(index=False, date_format="%d/%m/%Y").encode("utf-8-sig")
+
+
+def export_history(df, fmt="xlsx"):
+    """Bytes del archivo de descarga; se genera una sola vez por contenido y formato"""
+    key = (frame_digest(df), fmt)
+    with _EXPORTS_LOCK:
+        if key in _EXPORTS:
+            _EXPORTS.move_to_end(key)
+            return _EXPORTS[key]
+    data = _xlsx_bytes(df) if fmt == "xlsx" else _csv_bytes(df)
+    with _EXPORTS_LOCK:
+        _EXPORTS[key] = data
+        while len(_EXPORTS) > _MAX_EXPORTS:
+            _EXPORTS.popitem(last=False)
+    return data
@@ -0,0 +1,149 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from metrics import METRICS
+
+# Tiempos máximos por operación: (conexión, lectura) en segundos. Su suma es además el tope
+# total de la llamada, reintentos incluidos (salvo que se pase deadline=)
+DEFAULT_TIMEOUTS = {
+    "export": (5, 20),
+    "get_rows_since": (5, 20),
+    "get_state": (3, 5),
+    "lease_numbers": (5, 10),
+    "release_numbers": (5, 10),
+    "save_state": (5, 10),
+    "save_entry": (5, 15),
+    "save_entry_remote": (5, 20),
+    "save_entries": (5, 60),
+    "patch_history": (5, 20),
+    "update_history": (5, 30),
+}
+
+
+class _Counters:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.errors = 0
+
+    def add(self, name, n=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + n)
+
+
+def _counting_pool(base, counters):
+    """Pool de urllib3 que cuenta pedidos y conexiones nuevas (el resto reutilizó una abierta)"""
+    class Pool(base):
+        def _new_conn(self):
+            counters.add("new_connections")
+            return super()._new_conn()
+
+        def urlopen(self, *args, **kwargs):
+            counters.add("requests")
+            return super().urlopen(*args, **kwargs)
+    return Pool
+
+
+class _CountingAdapter(HTTPAdapter):
+    def __init__(self, counters, **kwargs):
+        self.counters = counters
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _counting_pool(HTTPConnectionPool, self.counters),
+            "https": _counting_pool(HTTPSConnectionPool, self.counters),
+        }
+
+
+class GoogleHttp:
+    """Sesión HTTP compartida por el proceso para Google (export y Apps Script).
+
+    Mantiene conexiones abiertas (keep-alive), reintenta con backoff los GET y los POST de lectura
+    (idempotent=True) ante errores de red o 429/5xx, y el resto de los POST sólo si la conexión no
+    llegó a establecerse.
+    Cada llamada tiene un tope total: los reintentos sólo usan el tiempo que queda.
+    """
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    def __init__(self, retries=3, backoff=0.5, pool_size=10, timeouts=None):
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        self.retries = retries
+        self.backoff = backoff
+        self.counters = _Counters()
+        adapter = _CountingAdapter(self.counters, pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _retryable(self, idempotent, error):
+        if isinstance(error, requests.exceptions.ConnectTimeout): return True
+        if isinstance(error, requests.exceptions.ConnectionError):
+            # POST que escribe: sólo si la conexión no llegó a abrirse (el servidor no recibió nada)
+            if idempotent: return True
+            reason = error.args[0] if error.args else None
+            return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+        return idempotent and isinstance(error, requests.exceptions.Timeout)
+
+    def _request(self, method, op, url, deadline=None, idempotent=False, **kwargs):
+        idempotent = idempotent or method == "GET"
+        connect, read = kwargs.pop("timeout", None) or self.timeouts.get(op, (5, 20))
+        end = time.monotonic() + (deadline or connect + read)
+        attempt = 0
+        with METRICS.timer("http", op=op):
+            while True:
+                left = end - time.monotonic()
+                try:
+                    resp = self.session.request(method, url, timeout=(min(connect, left), min(read, left)), **kwargs)
+                    error = None
+                except Exception as e:
+                    resp, error = None, e
+                retry = attempt < self.retries and (
+                    self._retryable(idempotent, error) if error is not None
+                    else idempotent and resp.status_code in self.RETRY_STATUS)
+                pause = self.backoff * 2 ** attempt
+                if not retry or end - time.monotonic() <= pause + 0.5:
+                    break
+                if resp is not None: resp.close()
+                time.sleep(pause)
+                attempt += 1
+        if error is not None:
+            self.counters.add("errors")
+            METRICS.inc("http_errors", op=op)
+            raise error
+        if resp.status_code >= 400: METRICS.inc("http_errors", op=op)
+        return resp
+
+    def get(self, op, url, **kwargs):
+        return self._request("GET", op, url, **kwargs)
+
+    def post(self, op, url, idempotent=False, **kwargs):
+        """idempotent=True para acciones que sólo leen (o se pueden repetir sin efecto): se reintentan como un GET"""
+        return self._request("POST", op, url, idempotent=idempotent, **kwargs)
+
+    def stats(self):
+        c = self.counters
+        with c.lock:
+            return {
+                "requests": c.requests,
+                "new_connections": c.new_connections,
+                "reused_connections": max(c.requests - c.new_connections, 0),
+                "errors": c.errors,
+            }
+
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+def get_http_client():
+    """Cliente HTTP único del proceso"""
+    global _CLIENT
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = GoogleHttp()
+        return _CLIENT
@@ -0,0 +1,250 @@
+"""Carga masiva de recepciones sin la página (remitos en papel, archivos ASN de proveedores).
+
+    python import_cli.py recepciones.xlsx --env Test --workers 4
+    python import_cli.py asn.csv --labels-dir rotulos/ --label-format zpl
+    python import_cli.py asn.csv --dry-run          # sólo valida
+
+Valida SKU y proveedor contra una sola foto del catálogo y envía un lote por remito, con
+concurrencia acotada. Cada fila confirmada queda anotada en <archivo>.progress.jsonl: si se
+corta, volver a correr el mismo comando sigue desde donde quedó (los ids son deterministas,
+así que reenviar un lote que sí llegó no duplica filas).
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pandas as pd
+
+from app_logic import AnalysisManager
+from config import SCRIPT_URL, SHEET_GIDS, SHEET_URL
+from label_files import FORMATS, build_label_file
+from labels import BultoPlan, LabelSheet, clean_val, format_dt
+from search_index import normalize
+
+# Encabezados aceptados (normalizados) -> clave de la entrada, la misma que arma el formulario
+COLUMNS = {
+    "fecha": "Fecha",
+    "sku": "SKU", "articulo": "SKU", "codigo": "SKU",
+    "descripcion de producto": "Descripción de Producto", "descripcion": "Descripción de Producto", "producto": "Descripción de Producto",
+    "lote": "Lote",
+    "origen": "Origen",
+    "cantidad": "Cantidad",
+    "udm": "UDM", "unidad": "UDM",
+    "cantidad bultos": "Cantidad Bultos", "bultos": "Cantidad Bultos",
+    "vto": "Vto", "vencimiento": "Vto",
+    "proveedor": "Proveedor",
+    "numero de remito": "Número de Remito", "remito": "Número de Remito",
+    "presentacion": "Presentacion",
+    "planta": "Planta",
+    "oc": "OC",
+    "realizado por": "realizado_por", "realizado_por": "realizado_por",
+    "controlado por": "controlado_por", "controlado_por": "controlado_por",
+}
+REQUIRED = ["SKU", "Lote", "Proveedor", "Cantidad", "Cantidad Bultos", "realizado_por"]
+
+log = logging.getLogger("import_cli")
+
+
+def read_rows(path, sheet=None):
+    """Filas del archivo como entradas del formulario (todo texto, columnas desconocidas se ignoran)"""
+    if path.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(path, sheet_name=sheet or 0, dtype=str)
+    else:
+        df = pd.read_csv(path, dtype=str, sep=None, engine="python", encoding="utf-8-sig")
+    df = df.fillna("")
+    cols = {c: COLUMNS[normalize(c).strip()] for c in df.columns if normalize(c).strip() in COLUMNS}
+    return [{k: str(r[c]).strip() for c, k in cols.items()} for r in df.to_dict("records")]
+
+
+def validate(rows, sku_index, prov_index):
+    """Completa y valida contra el catálogo. Devuelve (válidas, [(nº de fila, error), ...])"""
+    providers = {normalize(n): n for n in prov_index.names}
+    today = datetime.now().strftime("%d/%m/%Y")
+    ok, bad, seen = [], [], {}
+    for n, row in enumerate(rows, start=2):  # nº de fila como en la planilla (1 = encabezado)
+        e = dict(row)
+        e["SKU"] = clean_val(e.get("SKU"))
+        missing = [k for k in REQUIRED if not e.get(k)]
+        if missing:
+            bad.append((n, "faltan " + ", ".join(missing)))
+            continue
+        if e["SKU"] not in sku_index.by_code:
+            bad.append((n, f"SKU desconocido: {e['SKU']}"))
+            continue
+        prov = providers.get(normalize(e["Proveedor"]).strip())
+        if prov is None:
+            bad.append((n, f"proveedor desconocido: {e['Proveedor']}"))
+            continue
+        try:
+            cantidad = float(e["Cantidad"].replace(",", "."))
+            bultos = int(float(e["Cantidad Bultos"]))
+        except ValueError:
+            bad.append((n, "cantidad o bultos no numéricos"))
+            continue
+        if bultos < 1 or cantidad <= 0:
+            bad.append((n, "cantidad y bultos deben ser mayores a cero"))
+            continue
+        e.update({
+            "Proveedor": prov, "Cantidad": cantidad, "Cantidad Bultos": bultos,
+            "Descripción de Producto": e.get("Descripción de Producto") or sku_index.describe(e["SKU"]),
+            "Fecha": format_dt(e.get("Fecha")) or today, "Vto": format_dt(e.get("Vto")),
+            "Número de Análisis": "PENDIENTE", "recepcion_num": 0, "row": n,
+            "entry_id": _entry_id(row, seen),
+        })
+        ok.append(e)
+    return ok, bad
+
+
+def _entry_id(row, seen):
+    """Id estable por contenido de la fila tal como vino (+ nº de aparición, por si hay filas idénticas)"""
+    h = hashlib.sha1(json.dumps(row, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:20]
+    seen[h] = seen.get(h, 0) + 1
+    return f"imp-{h}-{seen[h]}"
+
+
+def group_batches(entries):
+    """Un lote por remito (y proveedor), en el orden del archivo: un Nº de Recepción por remito"""
+    groups = {}
+    for e in entries:
+        groups.setdefault((e.get("Número de Remito", ""), e["Proveedor"]), []).append(e)
+    return list(groups.values())
+
+
+class Progress:
+    """Registro JSONL de filas confirmadas; se agrega (y se baja a disco) al terminar cada lote, así que sobrevive a un corte"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # última línea a medias si se cortó escribiendo
+                    self.done[rec["entry_id"]] = rec
+
+    def record(self, recs):
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for rec in recs:
+                    self.done[rec["entry_id"]] = rec
+                    f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def write_labels(entry, fmt, labels_dir):
+    """Juego completo de rótulos de la fila: todos los bultos con el mismo peso"""
+    bultos, cantidad = int(entry["Cantidad Bultos"]), float(entry["Cantidad"])
+    plan = BultoPlan(bultos, [{"desde": 1, "hasta": bultos, "peso": cantidad / bultos}])
+    sheet = LabelSheet(entry, plan.runs(), bultos, cantidad)
+    return build_label_file(sheet, fmt, labels_dir)[2]
+
+
+def submit_batch(manager, batch, env, progress, retries, labels=None):
+    """Numera y envía un remito. Devuelve [(fila, error)] de las que no se confirmaron"""
+    prev = [progress.done[e["entry_id"]] for e in batch if e["entry_id"] in progress.done]
+    todo = [e for e in batch if e["entry_id"] not in progress.done]
+    failed = []
+    if todo:
+        # Remito que quedó a medias: sigue con su Nº de Recepción y sólo se reservan Nº de Análisis
+        reception = prev[0]["reception"] if prev else None
+        if reception is not None:
+            for e in todo: e["recepcion_num"] = reception
+        if not manager.assign_numbers(todo, env=env, reception=reception) and reception is not None:
+            log.warning("Remito %s retomado sin números reservados: el servidor le asigna otro Nº de Recepción",
+                        todo[0].get("Número de Remito"))
+        for attempt in range(retries + 1):
+            ok, results = manager.save_entries_remote(todo, env=env)
+            if ok: break
+            log.warning("Remito %s: %s (intento %d)", todo[0].get("Número de Remito"), results, attempt + 1)
+            if attempt < retries: time.sleep(min(2 ** attempt, 30))
+        if not ok:
+            return [(e["row"], results) for e in todo]
+        recs = []
+        for e, res in zip(todo, results):
+            if res.get("error"):
+                failed.append((e["row"], res["error"]))
+                continue
+            e["Número de Análisis"], e["recepcion_num"] = res.get("analysis"), res.get("reception")
+            recs.append({"entry_id": e["entry_id"], "row": e["row"], "analysis": e["Número de Análisis"], "reception": e["recepcion_num"]})
+        progress.record(recs)
+    if labels:
+        fmt, labels_dir = labels
+        for e in batch:
+            rec = progress.done.get(e["entry_id"])
+            if not rec or rec.get("label"): continue
+            e["Número de Análisis"], e["recepcion_num"] = rec["analysis"], rec["reception"]
+            try:
+                path = write_labels(e, fmt, labels_dir)
+            except Exception as ex:
+                failed.append((e["row"], f"rótulos: {ex}"))
+                continue
+            progress.record([dict(rec, label=path)])
+    return failed
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("file", help="CSV o XLSX con una recepción por fila")
+    ap.add_argument("--sheet", help="pestaña del XLSX (por defecto la primera)")
+    ap.add_argument("--env", choices=["Producción", "Test"], default="Producción")
+    ap.add_argument("--sheet-url", default=SHEET_URL)
+    ap.add_argument("--script-url", default=SCRIPT_URL)
+    ap.add_argument("--workers", type=int, default=4, help="remitos enviados a la vez")
+    ap.add_argument("--retries", type=int, default=2, help="reintentos por remito")
+    ap.add_argument("--progress", help="registro de avance (por defecto <archivo>.progress.jsonl)")
+    ap.add_argument("--labels-dir", help="carpeta donde dejar los rótulos de cada fila")
+    ap.add_argument("--label-format", choices=list(FORMATS), default="pdf")
+    ap.add_argument("--strict", action="store_true", help="no enviar nada si hay filas inválidas")
+    ap.add_argument("--dry-run", action="store_true", help="sólo leer y validar")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    manager = AnalysisManager(args.sheet_url, args.script_url, sheet_gids=SHEET_GIDS if args.sheet_url == SHEET_URL and SHEET_GIDS else None)
+    data = manager.get_excel_data()
+    if data["error"]:
+        log.error("%s %s", data["error"], manager.last_error or "")
+        return 2
+    rows = read_rows(args.file, args.sheet)
+    entries, bad = validate(rows, data["sku_index"], data["prov_index"])
+    for n, err in bad:
+        log.warning("Fila %d: %s", n, err)
+    print(f"{len(rows)} filas leídas: {len(entries)} válidas, {len(bad)} con errores")
+    if args.dry_run or (bad and args.strict) or not entries:
+        return 1 if bad else 0
+
+    progress = Progress(args.progress or args.file + ".progress.jsonl")
+    skipped = sum(1 for e in entries if e["entry_id"] in progress.done)
+    if skipped: print(f"{skipped} filas ya confirmadas en una corrida anterior")
+    labels = (args.label_format, args.labels_dir) if args.labels_dir else None
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1), thread_name_prefix="import") as pool:
+        futures = [pool.submit(submit_batch, manager, b, args.env, progress, args.retries, labels) for b in group_batches(entries)]
+        for fut in as_completed(futures):
+            try:
+                failed += fut.result()
+            except Exception as ex:
+                log.error("Lote con error: %s", ex)
+                failed.append((0, str(ex)))
+
+    confirmed = sum(1 for e in entries if e["entry_id"] in progress.done)
+    print(f"Confirmadas {confirmed}/{len(entries)} (nuevas {confirmed - skipped}); fallidas {len(failed)}")
+    for n, err in sorted(failed):
+        print(f"  fila {n}: {err}")
+    if failed: print(f"Volver a correr el mismo comando reintenta sólo lo pendiente ({progress.path})")
+    return 1 if failed or bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+import os
+import re
+import textwrap
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from metrics import METRICS
+
+# Rótulo de 100 x 100 mm
+PAGE_PT = 283.46          # PDF: puntos (1/72")
+ZPL_DOTS = 800            # Zebra 203 dpi: 8 puntos por mm
+
+# Filas del rótulo (mismo diseño que el HTML). Columnas: 0..3, anchos relativos 30/20/20/30.
+# Cada celda: (columna, cuántas columnas ocupa, texto o campo, estilo)
+# estilo: 'name' = nombre de campo, 'val' = valor, 'bold' = valor destacado, 'big' = grande, 'small' = chico
+_COLS = [0.30, 0.20, 0.20, 0.30]
+_ROWS = [
+    [(0, 1, "Nº de Análisis", "name"), (1, 2, "{analisis}", "big"), (3, 1, "Biosintex", "bold")],
+    [(0, 1, "Insumo / Producto", "name"), (1, 3, "{producto}", "bold")],
+    [(0, 1, "Presentación", "name"), (1, 3, "{presentacion}", "bold")],
+    [(0, 1, "Fecha", "name"), (1, 3, "{fecha}", "val")],
+    [(0, 1, "Nº de lote", "name"), (1, 1, "{lote}", "val"), (2, 1, "Vto.:", "name"), (3, 1, "{vto}", "val")],
+    [(0, 1, "Código interno", "name"), (1, 3, "{sku}", "bold")],
+    [(0, 1, "Origen", "name"), (1, 3, "{origen}", "bold")],
+    [(0, 1, "Proveedor", "name"), (1, 3, "{proveedor}", "bold")],
+    [(0, 1, "Bulto Nº", "name"), (1, 1, None, "bulto"), (2, 1, "de", "name"), (3, 1, "{total_bultos}", "bold")],
+    [(0, 1, "Cantidad por bulto", "name"), (1, 1, None, "peso"), (2, 1, "Total", "name"), (3, 1, "{total} {udm}", "val")],
+    [(0, 1, "Nº de Remito", "name"), (1, 1, "{remito}", "small"), (2, 1, "Nº de recepción", "name"), (3, 1, "{recepcion}", "val")],
+    [(0, 1, "Realizado por", "name"), (1, 1, "{realizado}", "small"), (2, 1, "Controlado por", "name"), (3, 1, "{controlado}", "small")],
+    [(0, 1, "DP-003-SOP Vigente", "small"), (1, 3, "CUARENTENA", "big")],
+]
+_UPPER = {"{producto}", "{presentacion}", "{sku}", "{origen}", "{proveedor}", "{realizado}", "{controlado}"}
+
+
+_LINE = 1.15  # alto de renglón respecto del cuerpo
+
+
+def _fit(text, w, h, size, char_w):
+    """Cuerpo y renglones para que el texto entre completo en la celda (nunca se recortan caracteres):
+    primero se parte en renglones y, si aun así no entra, se achica la letra"""
+    while True:
+        max_chars = max(int(w / (size * char_w)), 1)
+        lines = textwrap.wrap(text, max_chars) or [text]
+        if len(lines) * size * _LINE <= h or size <= 1:
+            return size, lines
+        size = round(size * 0.9, 2)
+
+
+def _values(sheet):
+    v = dict(sheet.fields)
+    v.update(total_bultos=str(sheet.total_bultos), total=f"{float(sheet.total_recepcion):.2f}")
+    return v
+
+
+def _cells(sheet, width, height, margin):
+    """Geometría y texto resuelto de cada celda: (x, y, w, h, texto, estilo); y desde arriba"""
+    values = _values(sheet)
+    inner_w, inner_h = width - 2 * margin, height - 2 * margin
+    row_h = inner_h / len(_ROWS)
+    xs = [margin]
+    for c in _COLS:
+        xs.append(xs[-1] + c * inner_w)
+    out = []
+    for r, row in enumerate(_ROWS):
+        y = margin + r * row_h
+        for col, span, text, style in row:
+            x, w = xs[col], xs[col + span] - xs[col]
+            if text is not None:
+                resolved = text.format(**values)
+                if text in _UPPER: resolved = resolved.upper()
+                text = resolved
+            out.append((x, y, w, row_h, text, style))
+    return out
+
+
+# --- PDF ---
+
+_PDF_SIZES = {"name": 6.5, "val": 8, "bold": 8, "big": 14, "small": 6, "bulto": 10, "peso": 9}
+
+
+def _pdf_text(s):
+    s = s.encode("cp1252", "replace").decode("latin-1")
+    return s.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _pdf_cell_text(x, y, w, h, text, style):
+    font = "F1" if style in ("name", "val", "small") else "F2"
+    # Ancho promedio de Helvetica por carácter (con margen para mayúsculas); la negrita es más ancha
+    char_w = 0.6 if font == "F1" else 0.66
+    size, lines = _fit(text, w - 4, h - 2, _PDF_SIZES[style], char_w)
+    top = PAGE_PT - y - (h - len(lines) * size * _LINE) / 2  # bloque centrado en la celda
+    out = []
+    for i, line in enumerate(lines):
+        tw = len(line) * size * char_w
+        tx = x + 2 if style == "name" else x + max((w - tw) / 2, 2)
+        ty = top - (i + 1) * size * _LINE + size * 0.25
+        out.append(f"BT /{font} {size} Tf {tx:.2f} {ty:.2f} Td ({_pdf_text(line)}) Tj ET\n")
+    return "".join(out)
+
+
+def render_pdf(sheet):
+    """PDF de varias páginas (una por bulto). La parte fija del rótulo es un Form XObject compartido"""
+    cells = _cells(sheet, PAGE_PT, PAGE_PT, 6)
+    fixed, dynamic = [], {}
+    for x, y, w, h, text, style in cells:
+        if style == "name":
+            fixed.append(f"0.94 g {x:.2f} {PAGE_PT - y - h:.2f} {w:.2f} {h:.2f} re f 0 g\n")
+        fixed.append(f"{x:.2f} {PAGE_PT - y - h:.2f} {w:.2f} {h:.2f} re S\n")
+        if text is None:
+            dynamic[style] = (x, y, w, h)
+        elif text:
+            fixed.append(_pdf_cell_text(x, y, w, h, text, style))
+    fixed_stream = ("0.8 w\n" + "".join(fixed)).encode("latin-1")
+
+    udm = sheet.fields["udm"]
+    objects = []  # contenido de cada objeto, numerados desde 1
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    f1 = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    f2 = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+    fonts = f"/Font << /F1 {f1} 0 R /F2 {f2} 0 R >>".encode()
+    packed = zlib.compress(fixed_stream)
+    form = add(b"<< /Type /XObject /Subtype /Form /BBox [0 0 %.2f %.2f] /Resources << " % (PAGE_PT, PAGE_PT)
+               + fonts + b" >> /Filter /FlateDecode /Length %d >>\nstream\n" % len(packed) + packed + b"\nendstream")
+    pages_id = add(None)  # se completa al final
+    page_ids = []
+    for a, b, peso in sheet.runs:
+        # El texto del peso se arma una vez por tramo
+        peso_txt = _pdf_cell_text(*dynamic["peso"], f"{peso:.2f} {udm}", "peso")
+        for n in range(a, b + 1):
+            content = ("q /Lbl Do Q\n" + _pdf_cell_text(*dynamic["bulto"], str(n), "bulto") + peso_txt).encode("latin-1")
+            c_id = add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+            page_ids.append(add(
+                b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] /Contents %d 0 R /Resources << "
+                % (pages_id, PAGE_PT, PAGE_PT, c_id) + fonts + b" /XObject << /Lbl %d 0 R >> >> >>" % form))
+    kids = " ".join(f"{p} 0 R" for p in page_ids).encode()
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
+
+
+# --- ZPL ---
+
+_ZPL_SIZES = {"name": 18, "val": 22, "bold": 22, "big": 40, "small": 16, "bulto": 28, "peso": 24}
+
+
+def _zpl_text(s):
+    # ^ y ~ son comandos en ZPL
+    return s.replace("^", " ").replace("~", " ")
+
+
+def _zpl_cell(x, y, w, h, text, style):
+    # Renglones armados acá (\& corta renglón dentro de ^FB): la impresora no recorta nada
+    size, lines = _fit(_zpl_text(text), w - 8, h - 4, _ZPL_SIZES[style], 0.62)
+    # En ^FB la barra invertida es escape: se duplica
+    size, text = int(size), "\\&".join(l.replace("\\", "\\\\") for l in lines)
+    align = "L" if style == "name" else "C"
+    return (f"^FO{int(x) + 4},{int(y + (h - len(lines) * size) / 2)}^A0N,{size},{size}"
+            f"^FB{int(w) - 8},{len(lines)},0,{align}^FD{text}^FS\n")
+
+
+def render_zpl(sheet, format_name="R:BIOLBL.ZPL"):
+    """ZPL: el diseño fijo se guarda una vez en la impresora (^DF) y cada bulto sólo envía Nº y peso (^XF)"""
+    cells = _cells(sheet, ZPL_DOTS, ZPL_DOTS, 16)
+    parts = [f"^XA^CI28^PW{ZPL_DOTS}^LL{ZPL_DOTS}^DF{format_name}^FS\n"]
+    fields = {"bulto": 1, "peso": 2}
+    for x, y, w, h, text, style in cells:
+        parts.append(f"^FO{int(x)},{int(y)}^GB{int(w) + 2},{int(h) + 2},2^FS\n")
+        if text is None:
+            # Nº de bulto y peso llegan después: hasta dos renglones, que la impresora parte si hace falta
+            size = min(_ZPL_SIZES[style], int((h - 4) / 2))
+            parts.append(f"^FO{int(x) + 4},{int(y + (h - 2 * size) / 2)}^A0N,{size},{size}"
+                         f"^FB{int(w) - 8},2,0,C^FN{fields[style]}^FS\n")
+        elif text:
+            parts.append(_zpl_cell(x, y, w, h, text, style))
+    parts.append("^XZ\n")
+    udm = _zpl_text(sheet.fields["udm"])
+    for a, b, peso in sheet.runs:
+        peso_fd = f"^FN2^FD{peso:.2f} {udm}^FS"
+        for n in range(a, b + 1):
+            parts.append(f"^XA^XF{format_name}^FS^CI28^FN1^FD{n}^FS{peso_fd}^XZ\n")
+    return "".join(parts).encode("utf-8")
+
+
+# --- Trabajos en segundo plano ---
+
+FORMATS = {
+    "pdf": (render_pdf, "application/pdf"),
+    "zpl": (render_zpl, "application/octet-stream"),
+}
+
+# Pool chico compartido: la generación no bloquea la ejecución de la página
+_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rotulos")
+
+
+def _file_name(sheet, fmt):
+    an = re.sub(r"[^0-9A-Za-z_-]+", "-", sheet.fields["analisis"]).strip("-") or "rotulos"
+    return f"rotulos_{an}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+
+
+def build_label_file(sheet, fmt, spool_dir=None):
+    """Genera el archivo de rótulos. Devuelve (nombre, bytes, ruta en la cola de impresión o None)"""
+    render, _ = FORMATS[fmt]
+    with METRICS.timer("label_file", fmt=fmt):
+        data = render(sheet)
+    METRICS.inc("label_file_pages", len(sheet), fmt=fmt)
+    name = _file_name(sheet, fmt)
+    path = None
+    if spool_dir:
+        os.makedirs(spool_dir, exist_ok=True)
+        path = os.path.join(spool_dir, name)
+        # Escritura atómica: quien vigila la carpeta nunca ve un archivo a medias
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    return name, data, path
+
+
+def submit_label_job(sheet, fmt, spool_dir=None):
+    """Encola la generación en el pool; devuelve un Future con el resultado de build_label_file"""
+    return _POOL.submit(build_label_file, sheet, fmt, spool_dir)
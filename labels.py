@@ -0,0 +1,326 @@
+import html
+import json
+from datetime import datetime
+from string import Template
+import pandas as pd
+from metrics import METRICS
+
+# Marcas que quedan en la plantilla compilada: lo único que cambia de un bulto a otro
+BULTO_MARK = "{{BULTO}}"
+PESO_MARK = "{{PESO}}"
+
+# Diseño de Rótulo 10x10 cm aproximado para impresión
+_LABEL_TEMPLATE = Template("""
+<div class="label-container">
+    <table>
+        <tr>
+            <td class="field-name">Nº de Análisis</td>
+            <td class="header-val" colspan="2">$analisis</td>
+            <td class="logo-box"><b style="color:#0056b3; font-size:16px;">Biosintex</b></td>
+        </tr>
+        <tr>
+            <td class="field-name">Insumo / Producto</td>
+            <td colspan="3" class="label-text">$producto</td>
+        </tr>
+        <tr>
+            <td class="field-name">Presentación</td>
+            <td colspan="3" class="label-text">$presentacion</td>
+        </tr>
+        <tr>
+            <td class="field-name">Fecha</td>
+            <td colspan="3">$fecha</td>
+        </tr>
+        <tr>
+            <td class="field-name">Nº de lote</td>
+            <td>$lote</td>
+            <td class="field-name">Vto.:</td>
+            <td>$vto</td>
+        </tr>
+        <tr>
+            <td class="field-name">Código interno</td>
+            <td colspan="3" class="label-text">$sku</td>
+        </tr>
+        <tr>
+            <td class="field-name">Origen</td>
+            <td colspan="3" class="label-text">$origen</td>
+        </tr>
+        <tr>
+            <td class="field-name">Proveedor</td>
+            <td colspan="3" class="label-text">$proveedor</td>
+        </tr>
+        <tr>
+            <td class="field-name">Bulto Nº</td>
+            <td style="background:#ddd; font-weight:bold;">$bulto</td>
+            <td class="field-name">de</td>
+            <td style="background:#ddd; font-weight:bold;">$total_bultos</td>
+        </tr>
+        <tr>
+            <td class="field-name">Cantidad por bulto</td>
+            <td style="font-weight:bold;">$peso $udm</td>
+            <td class="field-name">Total</td>
+            <td>$total $udm</td>
+        </tr>
+        <tr>
+            <td class="field-name">Nº de Remito</td>
+            <td class="small-text">$remito</td>
+            <td class="field-name">Nº de recepción</td>
+            <td>$recepcion</td>
+        </tr>
+        <tr>
+            <td class="field-name">Realizado por</td>
+            <td class="label-text" style="font-size:9px;">$realizado</td>
+            <td class="field-name">Controlado por</td>
+            <td class="label-text" style="font-size:9px;">$controlado</td>
+        </tr>
+        <tr>
+            <td class="small-text">DP-003-SOP Vigente</td>
+            <td colspan="3" class="cuarentena">CUARENTENA</td>
+        </tr>
+    </table>
+</div>
+""")
+
+LABEL_CSS = """
+    <style>
+        @media print {
+            .no-print { display: none !important; }
+            @page { size: 100mm 100mm; margin: 0; }
+            body { margin: 0; }
+            .label-container { page-break-after: always; }
+            #preview-area { display: none; }
+            #print-area { display: block !important; }
+        }
+        #print-area { display: none; }
+        .label-container {
+            width: 370px;
+            height: 370px;
+            border: 2px solid black;
+            font-family: Arial, sans-serif;
+            font-size: 11px;
+            margin: 10px auto;
+            background: white;
+            color: black;
+            display: flex;
+            flex-direction: column;
+            page-break-after: always;
+        }
+        table {
+            width: 100%;
+            border-collapse: collapse;
+            height: 100%;
+        }
+        td {
+            border: 1px solid black;
+            padding: 3px;
+            text-align: center;
+            vertical-align: middle;
+        }
+        .label-text { font-weight: bold; text-transform: uppercase; }
+        .header-val { font-size: 24px; font-weight: bold; }
+        .cuarentena {
+            background: white;
+            font-size: 28px;
+            font-weight: bold;
+            letter-spacing: 2px;
+        }
+        .field-name { width: 30%; text-align: left; background: #f0f0f0; font-weight: bold; font-size: 10px; }
+        .logo-box { width: 30%; }
+        .small-text { font-size: 9px; }
+    </style>
+"""
+
+# Expande los tramos en el navegador sólo al imprimir
+_PRINT_SCRIPT = Template("""
+    <template id="label-tpl">$template</template>
+    <script>
+        const RUNS = $runs;
+        function buildLabels() {
+            const area = document.getElementById('print-area');
+            if (area.dataset.built) return;
+            const tpl = document.getElementById('label-tpl').innerHTML;
+            const out = [];
+            for (const run of RUNS) {
+                const conPeso = tpl.split('$peso_mark').join(run[2]);
+                for (let b = run[0]; b <= run[1]; b++) out.push(conPeso.split('$bulto_mark').join(String(b)));
+            }
+            area.innerHTML = out.join('');
+            area.dataset.built = '1';
+        }
+        function printLabels() { buildLabels(); window.print(); }
+        window.addEventListener('beforeprint', buildLabels);
+    </script>
+""")
+
+
+def clean_val(val):
+    if val is None or str(val) == 'nan' or str(val).lower() == 'seleccione...': return ""
+    # Quitar decimales si es un número (ej: 25688.0 -> 25688)
+    s = str(val)
+    if "." in s and s.split(".")[-1] == "0": return s.split(".")[0]
+    return s
+
+
+def format_dt(val):
+    if val is None or pd.isna(val) or not val or str(val) == 'nan': return ""
+    try:
+        if isinstance(val, (datetime, pd.Timestamp)):
+            return val.strftime("%d/%m/%Y")
+        s = str(val)
+        if " " in s: s = s.split(" ")[0] # Quitar ' 00:00:00'
+        if "-" in s: # YYYY-MM-DD
+            p = s.split("-")
+            if len(p) == 3 and len(p[0]) == 4: return f"{p[2]}/{p[1]}/{p[0]}"
+        return s
+    except: return str(val)
+
+
+def label_fields(d):
+    """Campos de texto del rótulo, formateados una sola vez por recepción"""
+    # Fallback para número de recepción: si está vacío, intentar extraerlo del Nº de Análisis
+    recepcion_f = clean_val(d.get('recepcion_num'))
+    if not recepcion_f:
+        an = str(d.get('Número de Análisis', ''))
+        if "/" in an:
+            try:
+                recepcion_f = str(int(an.split("/")[0]))
+            except: pass
+    return {
+        'analisis': str(d.get('Número de Análisis', '')),
+        'producto': str(d.get('Descripción de Producto', '')),
+        'presentacion': str(d.get('Presentacion', '')),
+        'fecha': format_dt(d.get('Fecha')),
+        'lote': str(d.get('Lote', '')),
+        'vto': format_dt(d.get('Vto')),
+        'sku': str(d.get('SKU', '')),
+        'origen': str(d.get('Origen', '')),
+        'proveedor': str(d.get('Proveedor', '')),
+        'udm': str(d.get('UDM', '')),
+        'remito': str(d.get('Número de Remito', '')),
+        'recepcion': recepcion_f,
+        'realizado': clean_val(d.get('realizado_por')),
+        'controlado': clean_val(d.get('controlado_por')),
+    }
+
+
+class BultoPlan:
+    """Distribución de bultos guardada como intervalos (desde, hasta, peso) sin expandir bulto por bulto.
+
+    Si dos rangos se pisan, gana el último definido (igual que en el editor de rangos).
+    """
+    def __init__(self, total_bultos, ranges=()):
+        self.total = int(total_bultos)
+        self.intervals = []  # disjuntos y ordenados
+        for r in ranges:
+            if not r.get("desde") or not r.get("hasta") or r.get("peso") is None: continue
+            self.add(r["desde"], r["hasta"], r["peso"])
+
+    def add(self, desde, hasta, peso):
+        desde, hasta = max(int(desde), 1), min(int(hasta), self.total)
+        if desde > hasta: return
+        res = []
+        for a, b, p in self.intervals:
+            if b < desde or a > hasta:
+                res.append((a, b, p))
+                continue
+            # Se conserva sólo lo que queda fuera del rango nuevo
+            if a < desde: res.append((a, desde - 1, p))
+            if b > hasta: res.append((hasta + 1, b, p))
+        res.append((desde, hasta, float(peso)))
+        res.sort()
+        self.intervals = res
+
+    @property
+    def covered(self):
+        return sum(b - a + 1 for a, b, _ in self.intervals)
+
+    @property
+    def missing(self):
+        return self.total - self.covered
+
+    @property
+    def total_weight(self):
+        return sum((b - a + 1) * p for a, b, p in self.intervals)
+
+    def gaps(self):
+        """Tramos sin configurar: [(desde, hasta), ...]"""
+        out, nxt = [], 1
+        for a, b, _ in self.intervals:
+            if a > nxt: out.append((nxt, a - 1))
+            nxt = b + 1
+        if nxt <= self.total: out.append((nxt, self.total))
+        return out
+
+    def runs(self):
+        """Tramos para el rótulo (bultos sin configurar con peso 0), uniendo vecinos de igual peso"""
+        pieces = self.intervals + [(a, b, 0.0) for a, b in self.gaps()]
+        out = []
+        for a, b, p in sorted(pieces):
+            if out and out[-1][1] == a - 1 and out[-1][2] == p:
+                out[-1] = (out[-1][0], b, p)
+            else:
+                out.append((a, b, p))
+        return out
+
+
+class LabelSheet:
+    """Rótulos de una recepción: plantilla compilada una vez y tramos de bultos con el mismo peso"""
+    def __init__(self, d, runs, total_bultos, total_recepcion):
+        self.fields = label_fields(d)
+        self.runs = runs
+        self.total_bultos = total_bultos
+        self.total_recepcion = total_recepcion
+        values = {k: html.escape(v) for k, v in self.fields.items()}
+        values.update(total_bultos=total_bultos, total=f"{float(total_recepcion):.2f}",
+                      bulto=BULTO_MARK, peso=PESO_MARK)
+        # Plantilla con todo resuelto salvo Nº de bulto y peso
+        self.template = _LABEL_TEMPLATE.substitute(values)
+
+    def __len__(self):
+        return sum(b - a + 1 for a, b, _ in self.runs)
+
+    def iter_labels(self):
+        """(bulto, peso) de cada rótulo, en orden"""
+        for a, b, peso in self.runs:
+            for n in range(a, b + 1):
+                yield n, peso
+
+    def render_run(self, peso):
+        """Plantilla con el peso del tramo ya puesto (se formatea una vez por tramo)"""
+        return self.template.replace(PESO_MARK, f"{peso:.2f}")
+
+    def render_preview(self, limit=4):
+        """HTML de los primeros `limit` rótulos"""
+        out = []
+        for a, b, peso in self.runs:
+            t = self.render_run(peso)
+            for n in range(a, b + 1):
+                if len(out) >= limit: return "".join(out)
+                out.append(t.replace(BULTO_MARK, str(n)))
+        return "".join(out)
+
+    def render_page(self, allow_print=True, preview=4):
+        """Página para el iframe: vista previa acotada + tramos que el navegador expande al imprimir"""
+        with METRICS.timer("label_render"):
+            return self._page(allow_print, preview)
+
+    def _page(self, allow_print, preview):
+        total = len(self)
+        if allow_print:
+            body = f'<div id="preview-area">{self.render_preview(preview)}'
+            if total > preview:
+                body += f'<p class="no-print" style="text-align:center; color:gray;">Vista previa: {preview} de {total} rótulos.</p>'
+            body += '</div><div id="print-area"></div>'
+            body += _PRINT_SCRIPT.substitute(
+                template=self.template, bulto_mark=BULTO_MARK, peso_mark=PESO_MARK,
+                runs=json.dumps([[a, b, f"{peso:.2f}"] for a, b, peso in self.runs]),
+            )
+        else:
+            body = '<h3 style="color:red; text-align:center;">⚠️ La configuración de bultos es inválida. Revisa el peso total.</h3>'
+        return f"""
+    {LABEL_CSS}
+    {body}
+    <div class="no-print" style="text-align:center; margin-top:20px;">
+        <button {"" if allow_print else "disabled"} onclick="printLabels()" style="padding:15px 30px; background:{'green' if allow_print else 'gray'}; color:white; font-weight:bold; border:none; border-radius:5px; cursor:pointer; font-size:16px;">🖨️ IMPRIMIR ETIQUETAS</button>
+        <p style="color:gray; font-size:12px; margin-top:5px;">Se imprimirán {total if allow_print else 0} rótulo(s).</p>
+    </div>
+    """
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "biosintex_"
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _series(name, lbl):
+    return f"{name}{{{lbl}}}" if lbl else name
+
+
+def _quantile(sorted_values, q):
+    if not sorted_values: return 0.0
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class _Timer:
+    def __init__(self, window):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)  # últimas muestras, para percentiles
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def summary(self):
+        values = sorted(self.recent)
+        return {
+            "count": self.count, "sum": self.total, "max": self.max,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": _quantile(values, 0.50), "p95": _quantile(values, 0.95), "p99": _quantile(values, 0.99),
+        }
+
+
+class Metrics:
+    """Contadores y tiempos del proceso (todas las sesiones), con etiquetas opcionales"""
+    def __init__(self, window=512):
+        self.window = window
+        self.counters = {}
+        self.timers = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def inc(self, name, n=1, **labels):
+        k = _key(name, labels)
+        with self.lock:
+            self.counters[k] = self.counters.get(k, 0) + n
+
+    def observe(self, name, seconds, **labels):
+        k = _key(name, labels)
+        with self.lock:
+            if k not in self.timers: self.timers[k] = _Timer(self.window)
+            self.timers[k].add(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - t0, **labels)
+
+    def snapshot(self):
+        """Lista plana: [{'name', 'labels', 'type', ...valores}]"""
+        with self.lock:
+            out = [{"name": n, "labels": dict(l), "type": "counter", "value": v} for (n, l), v in self.counters.items()]
+            out += [dict({"name": n, "labels": dict(l), "type": "timer"}, **t.summary()) for (n, l), t in self.timers.items()]
+        return sorted(out, key=lambda m: (m["name"], sorted(m["labels"].items())))
+
+    def to_json(self):
+        return json.dumps({"started": self.started, "metrics": self.snapshot()}, indent=1)
+
+    def to_prometheus(self):
+        """Formato de texto de Prometheus: contadores como counter y tiempos como summary (segundos)"""
+        lines, typed = [], set()
+        for m in self.snapshot():
+            name = PREFIX + m["name"]
+            lbl = ",".join(f'{k}="{v}"' for k, v in sorted(m["labels"].items()))
+            if m["type"] == "counter":
+                if name not in typed: lines.append(f"# TYPE {name} counter"); typed.add(name)
+                lines.append(f"{_series(name, lbl)} {m['value']}")
+            else:
+                name += "_seconds"
+                if name not in typed: lines.append(f"# TYPE {name} summary"); typed.add(name)
+                for q in ("p50", "p95", "p99"):
+                    ql = (lbl + "," if lbl else "") + f'quantile="0.{q[1:]}"'
+                    lines.append(f"{_series(name, ql)} {m[q]:.6f}")
+                lines.append(f"{_series(name + '_sum', lbl)} {m['sum']:.6f}")
+                lines.append(f"{_series(name + '_count', lbl)} {m['count']}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timers.clear()
+            self.started = time.time()
+
+
+METRICS = Metrics()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body, ctype = METRICS.to_json().encode("utf-8"), "application/json"
+        elif self.path.startswith("/metrics"):
+            body, ctype = METRICS.to_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_SERVER = None
+_SERVER_LOCK = threading.Lock()
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Expone /metrics (Prometheus) y /metrics.json en un hilo aparte; una sola vez por proceso"""
+    global _SERVER
+    with _SERVER_LOCK:
+        if _SERVER is None:
+            _SERVER = ThreadingHTTPServer((host, port), _Handler)
+            threading.Thread(target=_SERVER.serve_forever, name="metricas", daemon=True).start()
+        return _SERVER
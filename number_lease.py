@@ -0,0 +1,119 @@
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+KINDS = ("analysis", "reception")
+
+
+class NumberLease:
+    """Bloques de Nº de análisis y de recepción reservados en el servidor con una sola llamada atómica.
+
+    lease(kind, count) -> (desde, hasta, año), None si el script no conoce la acción, o excepción si falló
+    (red, cuota, lock): en ese caso se numera en el servidor durante `backoff` segundos y se vuelve a probar.
+    release(kind, desde, hasta) -> True si el servidor los recuperó (si no, quedan registrados como salteados).
+    """
+    def __init__(self, lease, release, block_size=20, backoff=30):
+        self.lease = lease
+        self.release = release
+        self.block_size = block_size
+        self.backoff = backoff
+        self.blocks = {}          # tipo -> [siguiente, hasta, año]
+        self.supported = True
+        self.retry_at = 0.0
+        self.lock = threading.Lock()
+
+    def take(self, kind, count=1):
+        """Toma `count` números del bloque local (pide otro bloque si no alcanza). None si no hay leasing;
+        en ese caso no se consume nada"""
+        year = datetime.now().year % 100
+        with self.lock:
+            if not self.supported or time.monotonic() < self.retry_at: return None
+            block = self.blocks.get(kind)
+            if block and block[2] != year:
+                # Cambió el año: lo que quedaba del bloque anterior se devuelve
+                self._release(kind, self.blocks.pop(kind))
+                block = None
+            have = block[1] - block[0] + 1 if block else 0
+            extra = None
+            if have < count:
+                # Se reserva antes de consumir: si falla, el bloque local queda como estaba
+                try:
+                    extra = self.lease(kind, max(self.block_size, count - have))
+                except Exception as e:
+                    self.retry_at = time.monotonic() + self.backoff
+                    log.warning("No se pudieron reservar números de %s (%s); se reintenta en %s s. "
+                                "Si el servidor llegó a reservarlos, quedan salteados", kind, e, self.backoff)
+                    return None
+                if extra is None:
+                    self.supported = False
+                    return None
+            out = []
+            if block:
+                n = min(count, have)
+                out.extend((x, block[2]) for x in range(block[0], block[0] + n))
+                block[0] += n
+                if block[0] > block[1]: del self.blocks[kind]
+            if extra:
+                start = extra[0] + count - len(out)
+                out.extend((x, extra[2]) for x in range(extra[0], start))
+                if start <= extra[1]: self.blocks[kind] = [start, extra[1], extra[2]]
+            return out
+
+    def put_back(self, kind, taken):
+        """Devuelve números tomados con take() que al final no se usaron: vuelven al frente del bloque
+        local si son los siguientes; si no, se liberan en el servidor (o quedan registrados)"""
+        runs = []
+        for n, y in taken:
+            if runs and runs[-1][1] == n - 1 and runs[-1][2] == y: runs[-1][1] = n
+            else: runs.append([n, n, y])
+        with self.lock:
+            for run in reversed(runs):
+                block = self.blocks.get(kind)
+                if block is None:
+                    self.blocks[kind] = run
+                elif block[2] == run[2] and block[0] == run[1] + 1:
+                    block[0] = run[0]
+                else:
+                    self._release(kind, run)
+
+    def peek(self, kind):
+        """Próximo número que se asignaría sin pedir otro bloque (None si no hay bloque activo)"""
+        with self.lock:
+            block = self.blocks.get(kind)
+            return block[0] if block else None
+
+    def _release(self, kind, block):
+        desde, hasta = block[0], block[1]
+        if desde > hasta: return
+        try:
+            ok = self.release(kind, desde, hasta)
+        except Exception:
+            ok = False
+        if not ok:
+            log.warning("Números de %s sin usar: %s a %s (año %s)", kind, desde, hasta, block[2])
+
+    def release_all(self):
+        """Devuelve al servidor (o registra) los números reservados que no se usaron"""
+        with self.lock:
+            for kind in list(self.blocks):
+                self._release(kind, self.blocks.pop(kind))
+
+
+# Un pool por script y hoja de estado, compartido por todas las sesiones del proceso
+_LEASES = {}
+_LEASES_LOCK = threading.Lock()
+
+def get_number_lease(key, lease, release, block_size=20):
+    with _LEASES_LOCK:
+        if key not in _LEASES:
+            _LEASES[key] = NumberLease(lease, release, block_size)
+        return _LEASES[key]
+
+@atexit.register
+def _release_on_exit():
+    for pool in list(_LEASES.values()):
+        pool.release_all()
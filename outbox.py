@@ -0,0 +1,160 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+PENDING, CONFIRMED, FAILED = "pendiente", "confirmado", "fallido"
+
+
+class Outbox:
+    """Cola local durable (SQLite) de recepciones: se guardan al instante y un hilo las envía con reintentos.
+
+    submit(entry, env) -> (ok, result) es el envío real (AnalysisManager.save_entry_remote).
+    Las confirmadas se borran pasados `keep_confirmed` segundos (las fallidas quedan para reintentar a mano).
+    """
+    def __init__(self, path, submit, max_attempts=20, base_delay=2.0, max_delay=300.0, keep_confirmed=7 * 86400):
+        self.path = path
+        self.submit = submit
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.keep_confirmed = keep_confirmed
+        self._pruned_at = 0.0
+        self._wake = threading.Event()
+        self._changed = threading.Condition()
+        self._thread = None
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                id TEXT PRIMARY KEY, env TEXT, payload TEXT, status TEXT,
+                attempts INTEGER DEFAULT 0, next_try REAL, result TEXT, error TEXT,
+                created REAL, updated REAL)""")
+            # count() corre en cada ejecución de la página y _due() en cada vuelta del hilo
+            db.execute("CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, next_try)")
+
+    @contextmanager
+    def _connect(self):
+        # Una conexión por operación: la usan la página y el hilo de envío a la vez
+        db = sqlite3.connect(self.path, timeout=10)
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+            self._thread.start()
+        return self
+
+    def enqueue(self, entry, env):
+        """Guarda la recepción y despierta al hilo de envío. Devuelve su id (también viaja al servidor)"""
+        entry_id = entry.get('entry_id') or uuid.uuid4().hex
+        entry = dict(entry, entry_id=entry_id)
+        now = time.time()
+        with self._connect() as db:
+            db.execute("INSERT INTO outbox (id, env, payload, status, next_try, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (entry_id, env, json.dumps(entry, default=str), PENDING, now, now, now))
+        self._wake.set()
+        return entry_id
+
+    def get(self, entry_id):
+        with self._connect() as db:
+            db.row_factory = sqlite3.Row
+            row = db.execute("SELECT * FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+        if row is None: return None
+        rec = dict(row)
+        rec["entry"] = json.loads(rec.pop("payload"))
+        rec["result"] = json.loads(rec["result"]) if rec["result"] else None
+        return rec
+
+    def count(self, status=PENDING):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM outbox WHERE status = ?", (status,)).fetchone()[0]
+
+    def wait(self, entry_id, timeout):
+        """Espera hasta `timeout` segundos a que la entrada deje de estar pendiente"""
+        deadline = time.time() + timeout
+        with self._changed:
+            while True:
+                rec = self.get(entry_id)
+                left = deadline - time.time()
+                if rec is None or rec["status"] != PENDING or left <= 0:
+                    return rec
+                self._changed.wait(left)
+
+    def retry(self, entry_id):
+        """Vuelve a poner en cola una entrada fallida"""
+        with self._connect() as db:
+            db.execute("UPDATE outbox SET status = ?, attempts = 0, next_try = ? WHERE id = ?", (PENDING, time.time(), entry_id))
+        self._wake.set()
+
+    def _due(self):
+        with self._connect() as db:
+            rows = db.execute("SELECT id, env, payload, attempts FROM outbox WHERE status = ? AND next_try <= ? ORDER BY created",
+                              (PENDING, time.time())).fetchall()
+            nxt = db.execute("SELECT MIN(next_try) FROM outbox WHERE status = ?", (PENDING,)).fetchone()[0]
+        return rows, nxt
+
+    def _finish(self, entry_id, status, attempts, next_try=None, result=None, error=None):
+        with self._connect() as db:
+            db.execute("UPDATE outbox SET status = ?, attempts = ?, next_try = ?, result = ?, error = ?, updated = ? WHERE id = ?",
+                       (status, attempts, next_try, json.dumps(result, default=str) if result is not None else None,
+                        error, time.time(), entry_id))
+        with self._changed:
+            self._changed.notify_all()
+
+    def process_due(self):
+        """Envía las entradas vencidas una vez. Devuelve cuándo toca el próximo reintento (o None)"""
+        rows, _ = self._due()
+        for entry_id, env, payload, attempts in rows:
+            try:
+                ok, result = self.submit(json.loads(payload), env)
+            except Exception as e:
+                ok, result = False, str(e)
+            attempts += 1
+            if ok:
+                self._finish(entry_id, CONFIRMED, attempts, result=result)
+            elif attempts >= self.max_attempts:
+                self._finish(entry_id, FAILED, attempts, error=str(result))
+            else:
+                # Backoff exponencial con jitter
+                delay = min(self.base_delay * 2 ** (attempts - 1), self.max_delay) * random.uniform(0.8, 1.2)
+                self._finish(entry_id, PENDING, attempts, next_try=time.time() + delay, error=str(result))
+        return self._due()[1]
+
+    def prune(self):
+        """Borra las confirmadas más viejas que keep_confirmed. Devuelve cuántas"""
+        with self._connect() as db:
+            n = db.execute("DELETE FROM outbox WHERE status = ? AND updated < ?",
+                           (CONFIRMED, time.time() - self.keep_confirmed)).rowcount
+        self._pruned_at = time.time()
+        return n
+
+    def _run(self):
+        while True:
+            # Se limpia antes de procesar: un enqueue durante el envío no se pierde
+            self._wake.clear()
+            try:
+                nxt = self.process_due()
+                if time.time() - self._pruned_at > 3600: self.prune()
+            except Exception:
+                nxt = time.time() + self.base_delay
+            wait = 60 if nxt is None else max(nxt - time.time(), 0.05)
+            self._wake.wait(wait)
+
+
+# Una cola por archivo, compartida por todo el proceso
+_OUTBOXES = {}
+_OUTBOXES_LOCK = threading.Lock()
+
+def get_outbox(path, submit):
+    """Cola del proceso para `path`; `submit` sólo se usa la primera vez"""
+    with _OUTBOXES_LOCK:
+        if path not in _OUTBOXES:
+            _OUTBOXES[path] = Outbox(path, submit).start()
+        return _OUTBOXES[path]
@@ -0,0 +1,49 @@
+import base64
+import gzip
+import json
+from datetime import datetime
+import pandas as pd
+
+
+def cell_text(col, date_format="%d/%m/%Y"):
+    """Columna como texto de celda, operando sobre la columna entera: vacío para NaN, fechas con date_format"""
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return col.dt.strftime(date_format).fillna("")
+    txt = col.astype(str)
+    if col.dtype == object:
+        # Columnas mezcladas (texto + fechas sueltas): se formatean sólo las fechas
+        is_dt = col.map(type).isin((datetime, pd.Timestamp))
+        if is_dt.any():
+            txt[is_dt] = pd.to_datetime(col[is_dt]).dt.strftime(date_format)
+    return txt.where(col.notna(), "")
+
+
+def frame_to_rows(df, header=True, date_format="%d/%m/%Y"):
+    """DataFrame -> matriz de texto (encabezado + filas) con el formato que escribe la hoja"""
+    columns = [cell_text(df.iloc[:, i], date_format).tolist() for i in range(len(df.columns))]
+    rows = [list(r) for r in zip(*columns)]
+    if header:
+        rows.insert(0, [str(c) for c in df.columns])
+    return rows
+
+
+def rows_payload(df, compress=False, date_format="%d/%m/%Y"):
+    """Campos de datos para el Apps Script.
+
+    Sin compresión: {"rows": [[encabezado], [fila], ...]} (formato actual).
+    Con compresión: {"encoding": "gzip+base64", "format": "columns", "data": ...}, donde data es
+    el JSON {"header": [...], "columns": [[...], ...]} comprimido. En el script:
+    JSON.parse(Utilities.ungzip(Utilities.newBlob(Utilities.base64Decode(data), "application/x-gzip")).getDataAsString())
+    """
+    if not compress:
+        return {"rows": frame_to_rows(df, header=True, date_format=date_format)}
+    body = {
+        "header": [str(c) for c in df.columns],
+        "columns": [cell_text(df.iloc[:, i], date_format).tolist() for i in range(len(df.columns))],
+    }
+    raw = json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return {
+        "encoding": "gzip+base64",
+        "format": "columns",
+        "data": base64.b64encode(gzip.compress(raw)).decode("ascii"),
+    }
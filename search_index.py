@@ -0,0 +1,153 @@
+import time
+import unicodedata
+from bisect import bisect_left
+from metrics import METRICS
+
+
+def normalize(text):
+    """Minúsculas y sin acentos, para comparar 'Ácido' con 'acido'"""
+    text = unicodedata.normalize("NFKD", str(text).lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SkuIndex:
+    """Índice de búsqueda de SKUs armado una vez por sincronización.
+
+    Resultados ordenados: código exacto, luego prefijo (código o nombre), luego contiene.
+    """
+    def __init__(self, skus, limit=30):
+        self.limit = limit
+        self.codes = []   # código tal cual (valor que devuelve el buscador)
+        self.labels = []  # "código - nombre"
+        self.names = []
+        self.by_code = {}
+        self._keys = []   # (código normalizado, nombre normalizado)
+        self._exact = {}
+        self._postings = {}
+        prefix = []
+        for i, s in enumerate(skus):
+            art = str(s.get('Articulo', s.get('ID', '')))
+            nom = str(s.get('Nombre', ''))
+            art_k, nom_k = normalize(art), normalize(nom)
+            self.codes.append(art)
+            self.names.append(nom)
+            self.labels.append(f"{art} - {nom}")
+            self._keys.append((art_k, nom_k))
+            self.by_code.setdefault(art, nom)
+            self._exact.setdefault(art_k, []).append(i)
+            prefix.append((art_k, i))
+            prefix.append((nom_k, i))
+            for g in _trigrams(art_k) | _trigrams(nom_k):
+                self._postings.setdefault(g, []).append(i)
+        prefix.sort()
+        self._prefix_keys = [k for k, _ in prefix]
+        self._prefix_ids = [i for _, i in prefix]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def describe(self, code):
+        """Nombre del artículo para un código (sin recorrer el catálogo)"""
+        return self.by_code.get(str(code), "")
+
+    def _candidates(self, q):
+        # Con 1-2 letras casi todo coincide: se recorre en orden y el límite corta enseguida
+        if len(q) < 3:
+            return range(len(self.codes))
+        lists = [self._postings.get(q[i:i + 3]) for i in range(len(q) - 2)]
+        if not all(lists):
+            return []
+        lists.sort(key=len)
+        common = set(lists[0])
+        for lst in lists[1:]:
+            common.intersection_update(lst)
+            if not common:
+                return []
+        return sorted(common)
+
+    def search(self, q):
+        """Lista de (etiqueta, código) con a lo sumo `limit` resultados"""
+        t0 = time.perf_counter()
+        q = normalize(q)
+        if not q: return []
+        found = []
+        scanned = 0
+        seen = set()
+
+        def add(i):
+            if i not in seen:
+                seen.add(i)
+                found.append(i)
+            return len(found) >= self.limit
+
+        # 1. Código exacto
+        for i in self._exact.get(q, []):
+            if add(i): break
+
+        # 2. Prefijo del código o del nombre (búsqueda binaria sobre las claves ordenadas)
+        pos = bisect_left(self._prefix_keys, q)
+        while len(found) < self.limit and pos < len(self._prefix_keys) and self._prefix_keys[pos].startswith(q):
+            add(self._prefix_ids[pos])
+            pos += 1
+            scanned += 1
+
+        # 3. Contiene (en orden del catálogo, cortando al llegar al límite)
+        if len(found) < self.limit:
+            for i in self._candidates(q):
+                if i in seen: continue
+                scanned += 1
+                art_k, nom_k = self._keys[i]
+                if q in art_k or q in nom_k:
+                    if add(i): break
+
+        METRICS.observe("search", time.perf_counter() - t0, index="sku")
+        METRICS.inc("search_scanned", scanned, index="sku")
+        return [(self.labels[i], self.codes[i]) for i in found]
+
+
+def provider_name(p):
+    """Nombre canónico de una fila de proveedores ('' si no tiene)"""
+    nombre = p.get('Proveedor', p.get('PROVEEDOR', p.get('Nombre', next(iter(p.values()), ''))))
+    if nombre is None or str(nombre) == 'nan': return ""
+    return str(nombre).strip()
+
+
+class ProviderIndex:
+    """Tabla de proveedores compilada una vez por sincronización.
+
+    Cada nombre único (ordenado) lleva el texto de todas sus filas, así una búsqueda
+    es una sola pasada que ya devuelve nombres únicos y ordenados.
+    """
+    def __init__(self, providers, limit=30):
+        self.limit = limit
+        blobs = {}
+        for p in providers:
+            nombre = provider_name(p)
+            if not nombre: continue
+            fila_texto = normalize(" ".join([str(v) for v in p.values()]))
+            blobs.setdefault(nombre, []).append(fila_texto)
+        self.names = sorted(blobs)
+        # Separador de filas: la búsqueda no puede "cruzar" de una fila a otra
+        self._blobs = ["\n".join(blobs[n]) for n in self.names]
+
+    def __len__(self):
+        return len(self.names)
+
+    def search(self, q):
+        t0 = time.perf_counter()
+        q = normalize(q)
+        if not q: return []
+        res = []
+        scanned = 0
+        for nombre, blob in zip(self.names, self._blobs):
+            scanned += 1
+            if q in blob:
+                res.append(nombre)
+                if len(res) >= self.limit: break
+        METRICS.observe("search", time.perf_counter() - t0, index="proveedores")
+        METRICS.inc("search_scanned", scanned, index="proveedores")
+        return res
@@ -0,0 +1,27 @@
+from labels import BultoPlan
+
+
+def test_last_range_wins_on_overlap():
+    plan = BultoPlan(10, [{"desde": 1, "hasta": 10, "peso": 5}, {"desde": 4, "hasta": 6, "peso": 2}])
+    assert plan.intervals == [(1, 3, 5.0), (4, 6, 2.0), (7, 10, 5.0)]
+    assert plan.total_weight == 3 * 5 + 3 * 2 + 4 * 5
+    assert plan.missing == 0
+
+
+def test_gaps_and_runs():
+    plan = BultoPlan(10, [{"desde": 3, "hasta": 4, "peso": 1}, {"desde": 8, "hasta": 20, "peso": 1}])
+    assert plan.gaps() == [(1, 2), (5, 7)]
+    assert plan.missing == 5
+    # Sin configurar va con peso 0; vecinos de igual peso no se unen a través de un hueco
+    assert plan.runs() == [(1, 2, 0.0), (3, 4, 1.0), (5, 7, 0.0), (8, 10, 1.0)]
+
+
+def test_adjacent_ranges_with_same_weight_merge_in_runs():
+    plan = BultoPlan(6, [{"desde": 1, "hasta": 3, "peso": 2}, {"desde": 4, "hasta": 6, "peso": 2}])
+    assert plan.runs() == [(1, 6, 2.0)]
+
+
+def test_incomplete_rows_are_ignored():
+    plan = BultoPlan(4, [{"desde": None, "hasta": 2, "peso": 1}, {"desde": 1, "hasta": 2, "peso": None}])
+    assert plan.intervals == []
+    assert plan.gaps() == [(1, 4)]
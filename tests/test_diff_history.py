@@ -0,0 +1,40 @@
+import pandas as pd
+
+from app_logic import diff_history
+
+
+def frame():
+    return pd.DataFrame({
+        "Fecha": pd.to_datetime(["01/02/2026", "02/02/2026"], dayfirst=True),
+        "SKU": ["1001", "1002"],
+        "Descripción de Producto": ["A", "B"],
+        "Número de Análisis": ["0001/26", "0002/26"],
+        "OC": ["", ""],
+    })
+
+
+def test_only_changed_cells_are_sent():
+    base = frame()
+    edited = base.copy()
+    edited.loc[1, "OC"] = "OC-9"
+    edited.loc[0, "Fecha"] = pd.Timestamp(2026, 3, 5)
+    changes = diff_history(base, edited)
+    assert sorted(changes, key=lambda c: c["col"]) == [
+        {"key": "0001/26", "col": 0, "column": "Fecha", "value": "05/03/2026"},
+        {"key": "0002/26", "col": 4, "column": "OC", "value": "OC-9"},
+    ]
+
+
+def test_row_order_does_not_matter():
+    base = frame()
+    edited = base.iloc[::-1].reset_index(drop=True)
+    assert diff_history(base, edited) == []
+
+
+def test_rows_that_cannot_be_aligned_return_none():
+    base = frame()
+    dup = base.copy()
+    dup.loc[1, "Número de Análisis"] = "0001/26"
+    assert diff_history(dup, dup) is None
+    assert diff_history(base, base.iloc[:1]) is None
+    assert diff_history(base, base.drop(columns=["OC"])) is None
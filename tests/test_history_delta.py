@@ -0,0 +1,120 @@
+import itertools
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from app_logic import AnalysisManager
+from bench.stub import StubServer
+from bench.synth import make_tables
+
+_ids = itertools.count()
+
+
+@pytest.fixture
+def srv():
+    s = StubServer(make_tables(skus=50, providers=10, history=30)).start()
+    yield s
+    s.stop()
+
+
+def manager(srv):
+    # Un libro distinto por prueba: las cachés del proceso (libro e historial) no se comparten
+    return AnalysisManager(srv.sheet_url(f"delta{next(_ids)}"), srv.script_url, lease_block=0)
+
+
+def entry(lote):
+    return {"Fecha": "01/02/2026", "SKU": "10000", "Descripción de Producto": "X", "Lote": lote, "Origen": "Nacional",
+            "Cantidad": 1, "UDM": "KG", "Cantidad Bultos": 1, "Vto": "01/02/2028", "Proveedor": "P",
+            "Número de Remito": "R-1", "Presentacion": "Cajas", "Planta": "Barracas"}
+
+
+def test_new_rows_arrive_as_delta_without_downloading(srv):
+    m = manager(srv)
+    assert len(m.get_history()) == 30
+    m.get_state()  # endpoint de estado disponible: guardar no vence el libro
+    ok, res = m.save_entry_remote(entry("L-NUEVO"))
+    assert ok
+    exports = srv.backend.calls["export"]
+    df = m.get_history()
+    assert len(df) == 31
+    assert df.iloc[-1]["Lote"] == "L-NUEVO"
+    assert df.iloc[-1]["Número de Análisis"] == res["analysis"]
+    assert srv.backend.calls["export"] == exports
+    assert srv.backend.calls["get_rows_since"] >= 1
+
+
+def test_edited_old_rows_force_full_reload(srv):
+    m = manager(srv)
+    m.get_history()
+    m.get_state()
+    other = manager(srv)
+    ok, _ = other.patch_history_remote([{"key": "0003/20", "col": 14, "column": "OC", "value": "OC-EDIT"}])
+    assert ok
+    m.save_entry_remote(entry("L2"))
+    exports = srv.backend.calls["export"]
+    df = m.get_history()
+    assert srv.backend.calls["export"] > exports
+    assert df.loc[df["Número de Análisis"] == "0003/20", "OC"].iloc[0] == "OC-EDIT"
+    assert len(df) == 31
+
+
+def test_moved_last_row_is_detected(srv):
+    m = manager(srv)
+    m.get_history()
+    m.get_state()
+    # Alguien borró la última fila conocida y agregó otra: el solapamiento ya no coincide
+    rows = srv.backend.tables["Datos a completar"][1]
+    rows[-1] = list(rows[-1])
+    rows[-1][3] = "9999/99"
+    m.save_entry_remote(entry("L3"))
+    exports = srv.backend.calls["export"]
+    df = m.get_history()
+    assert srv.backend.calls["export"] > exports
+    assert "9999/99" in set(df["Número de Análisis"])
+
+
+def test_transient_error_does_not_disable_deltas(srv):
+    m = manager(srv)
+    m.get_history()
+    m.get_state()
+    original = srv.backend.do_get_rows_since
+    srv.backend.do_get_rows_since = lambda p: {"status": "Error: lock timeout"}
+    m.save_entry_remote(entry("L4"))
+    assert len(m.get_history()) == 31  # recarga completa esta vez
+    srv.backend.do_get_rows_since = original
+    m.save_entry_remote(entry("L5"))
+    exports = srv.backend.calls["export"]
+    assert len(m.get_history()) == 32
+    assert srv.backend.calls["export"] == exports
+
+
+def test_non_json_reply_turns_deltas_off(srv, monkeypatch):
+    m = manager(srv)
+    m.get_history()
+    h = m._history_state("Datos a completar")
+    asked = []
+    post = m.http.post
+
+    def html_for_rows(op, url, **kw):
+        if op != "get_rows_since": return post(op, url, **kw)
+        asked.append(op)
+        # Script viejo: responde 200 con una página HTML en lugar de JSON
+        return SimpleNamespace(status_code=200, json=lambda: json.loads("<html>"))
+    monkeypatch.setattr(m.http, "post", html_for_rows)
+    h.dirty = True
+    assert len(m.get_history()) == 30  # recarga completa
+    assert h.delta_supported is False
+    h.dirty = True
+    m.get_history()
+    assert asked == ["get_rows_since"]
+
+
+def test_patch_survives_a_full_reload_without_deltas(srv):
+    m = manager(srv)
+    m.get_history()
+    m._history_state("Datos a completar").delta_supported = False
+    ok, _ = m.patch_history_remote([{"key": "0003/20", "col": 14, "column": "OC", "value": "OC-PATCH"}])
+    assert ok
+    df = m.get_history(refresh=True)
+    assert df.loc[df["Número de Análisis"] == "0003/20", "OC"].iloc[0] == "OC-PATCH"
@@ -0,0 +1,73 @@
+import time
+
+from number_lease import NumberLease
+
+
+class Server:
+    def __init__(self):
+        self.last = 0
+        self.fail = False
+        self.released = []
+
+    def lease(self, kind, count):
+        if self.fail: raise RuntimeError("timeout")
+        start = self.last + 1
+        self.last += count
+        return start, self.last, 26
+
+    def release(self, kind, desde, hasta):
+        self.released.append((desde, hasta))
+        if hasta == self.last:
+            self.last = desde - 1
+            return True
+        return False
+
+
+def test_take_uses_remainder_before_leasing_again():
+    srv = Server()
+    pool = NumberLease(srv.lease, srv.release, block_size=5)
+    assert [n for n, _ in pool.take("analysis", 3)] == [1, 2, 3]
+    assert [n for n, _ in pool.take("analysis", 4)] == [4, 5, 6, 7]
+    assert pool.peek("analysis") == 8
+    assert srv.last == 10
+
+
+def test_unknown_action_disables_leasing():
+    pool = NumberLease(lambda kind, count: None, None, block_size=5)
+    assert pool.take("analysis") is None
+    assert pool.supported is False
+
+
+def test_transient_error_backs_off_without_consuming():
+    srv = Server()
+    pool = NumberLease(srv.lease, srv.release, block_size=3, backoff=0.1)
+    pool.take("analysis", 2)
+    srv.fail = True
+    assert pool.take("analysis", 5) is None
+    assert pool.supported is True
+    assert pool.peek("analysis") == 3  # el bloque local quedó intacto
+    srv.fail = False
+    assert pool.take("analysis") is None  # todavía en espera
+    time.sleep(0.15)
+    assert [n for n, _ in pool.take("analysis")] == [3]
+
+
+def test_put_back_returns_numbers_to_the_block():
+    srv = Server()
+    pool = NumberLease(srv.lease, srv.release, block_size=5)
+    got = pool.take("analysis", 2)
+    pool.put_back("analysis", got)
+    assert pool.peek("analysis") == 1
+    pool.take("analysis", 5)
+    pool.put_back("analysis", [(2, 26)])  # no es contiguo al bloque (vacío): pasa a ser el bloque
+    assert pool.peek("analysis") == 2
+
+
+def test_release_all_gives_back_unused_numbers():
+    srv = Server()
+    pool = NumberLease(srv.lease, srv.release, block_size=10)
+    pool.take("reception", 2)
+    pool.release_all()
+    assert srv.released == [(3, 10)]
+    assert srv.last == 2
+    assert pool.peek("reception") is None
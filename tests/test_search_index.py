@@ -0,0 +1,37 @@
+from search_index import ProviderIndex, SkuIndex
+
+SKUS = [
+    {"Articulo": "2100", "Nombre": "ACIDO CITRICO"},
+    {"Articulo": "1210", "Nombre": "ÁCIDO BENZOICO"},
+    {"Articulo": "210", "Nombre": "LACTOSA"},
+    {"Articulo": "5000", "Nombre": "ALMIDON DE MAIZ 210"},
+]
+
+
+def codes(results):
+    return [c for _, c in results]
+
+
+def test_exact_code_then_prefix_then_contains():
+    idx = SkuIndex(SKUS)
+    assert codes(idx.search("210")) == ["210", "2100", "1210", "5000"]
+
+
+def test_accents_and_case_are_ignored():
+    idx = SkuIndex(SKUS)
+    assert codes(idx.search("acido")) == ["1210", "2100"]  # prefijo del nombre, en orden de clave
+    assert codes(idx.search("BENZ")) == ["1210"]
+    assert codes(idx.search("zzz")) == []
+
+
+def test_limit():
+    idx = SkuIndex([{"Articulo": str(i), "Nombre": f"ITEM {i}"} for i in range(100)], limit=5)
+    assert len(idx.search("item")) == 5
+    assert idx.describe("7") == "ITEM 7"
+
+
+def test_provider_index_unique_sorted_names():
+    idx = ProviderIndex([{"Proveedor": "Química Sur", "CUIT": "30-1"}, {"Proveedor": "Química Sur", "CUIT": "30-2"},
+                         {"Proveedor": "Envases SA", "CUIT": "30-3"}])
+    assert idx.names == ["Envases SA", "Química Sur"]
+    assert idx.search("30-2") == ["Química Sur"]
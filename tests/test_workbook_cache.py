@@ -0,0 +1,89 @@
+import io
+import threading
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+from bench.synth import csv_bytes, workbook_bytes
+from workbook_cache import CsvWorkbook, WorkbookCache, WorkbookSnapshot
+
+
+def _load(payload):
+    return SimpleNamespace(sheet_names=["SKU"], payload=payload)
+
+
+def test_single_flight_downloads_once():
+    cache = WorkbookCache(ttl=60)
+    calls = []
+
+    def fetch(validators):
+        calls.append(1)
+        time.sleep(0.2)
+        return b"libro", {"etag": "1"}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(fetch, _load))) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert len(calls) == 1
+    assert {id(snap) for snap, _ in results} == {id(cache.snapshot)}
+    assert all(err is None for _, err in results)
+
+
+def test_fresh_snapshot_is_not_revalidated():
+    cache = WorkbookCache(ttl=60)
+    calls = []
+    fetch = lambda v: (calls.append(1), (b"x", {}))[1]
+    cache.get(fetch, _load)
+    cache.get(fetch, _load)
+    assert len(calls) == 1
+
+
+def test_not_modified_and_same_content_keep_generation():
+    cache = WorkbookCache(ttl=60)
+    cache.get(lambda v: (b"x", {"etag": "1"}), _load)
+    gen = cache.snapshot.generation
+    loads = []
+
+    def load(payload):
+        loads.append(payload)
+        return _load(payload)
+    seen = []
+    cache.get(lambda v: (seen.append(v), (None, v))[1], load, force=True)   # 304
+    cache.get(lambda v: (b"x", {"etag": "2"}), load, force=True)            # mismo contenido
+    assert seen == [{"etag": "1"}]
+    assert loads == []
+    assert cache.snapshot.generation == gen
+    assert cache.stats["not_modified"] == 1 and cache.stats["unchanged"] == 1
+
+
+def test_changed_content_reloads_and_invalidate_forces_check():
+    cache = WorkbookCache(ttl=60)
+    cache.get(lambda v: (b"x", {}), _load)
+    cache.invalidate()
+    assert not cache.is_fresh()
+    snap, err = cache.get(lambda v: (b"y", {}), _load)
+    assert err is None and snap.xl.payload == b"y" and snap.generation == 2
+
+
+def test_error_keeps_previous_snapshot():
+    cache = WorkbookCache(ttl=60)
+    cache.get(lambda v: (b"x", {}), _load)
+
+    def boom(v):
+        raise RuntimeError("sin red")
+    snap, err = cache.get(boom, _load, force=True)
+    assert err == "sin red"
+    assert snap.xl.payload == b"x"
+
+
+
+def test_csv_and_xlsx_tabs_parse_the_same_text():
+    header, rows = ["Articulo", "Nombre", "Lote"], [["00123", "NA", "0045"], [2100, "B", None]]
+    xlsx = WorkbookSnapshot(pd.ExcelFile(io.BytesIO(workbook_bytes({"SKU": (header, rows)}))), 1).parse("SKU")
+    csv = WorkbookSnapshot(CsvWorkbook({"SKU": csv_bytes(header, rows)}), 1).parse("SKU")
+    for df in (xlsx, csv):
+        assert df.loc[0, "Articulo"] == "00123" and df.loc[0, "Nombre"] == "NA" and df.loc[0, "Lote"] == "0045"
+        assert str(df.loc[1, "Articulo"]) == "2100"
+        assert pd.isna(df.loc[1, "Lote"])
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import pandas as pd
+
+
+class WarmStart:
+    """Última foto buena de SKUs, proveedores e historial en disco (SQLite).
+
+    Una sesión nueva arranca desde acá mientras la sincronización real corre en segundo plano.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.saved_key = None
+        self._loaded = None  # (mtime, datos)
+
+    def save(self, skus, providers, histories, synced_at, key=None):
+        """Escribe la foto completa en un archivo nuevo y lo reemplaza de una vez. `key` evita reescribir lo mismo"""
+        with self.lock:
+            if key is not None and key == self.saved_key: return False
+            tmp = self.path + ".tmp"
+            if os.path.exists(tmp): os.remove(tmp)
+            db = sqlite3.connect(tmp)
+            try:
+                pd.DataFrame(skus).to_sql("skus", db, index=False)
+                pd.DataFrame(providers).to_sql("providers", db, index=False)
+                for ws, df in histories.items():
+                    if df is None: continue
+                    # Las categorías se guardan como texto; se vuelven a armar al leer
+                    out = df.astype({c: object for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)})
+                    out.to_sql(f"history:{ws}", db, index=False)
+                pd.DataFrame([{"synced_at": synced_at.isoformat(), "tables": "\n".join(histories)}]).to_sql("meta", db, index=False)
+                db.commit()
+            finally:
+                db.close()
+            os.replace(tmp, self.path)
+            self.saved_key = key
+            return True
+
+    def load(self, date_columns=()):
+        """{'skus', 'providers', 'history': {hoja: df}, 'synced_at'} o None si no hay foto. Se lee una vez por versión del archivo"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        with self.lock:
+            if self._loaded and self._loaded[0] == mtime:
+                return self._loaded[1]
+            db = sqlite3.connect(self.path)
+            try:
+                meta = pd.read_sql('SELECT * FROM meta', db).iloc[0]
+                data = {
+                    "skus": _records(pd.read_sql('SELECT * FROM skus', db)),
+                    "providers": _records(pd.read_sql('SELECT * FROM providers', db)),
+                    "history": {},
+                    "synced_at": datetime.fromisoformat(meta["synced_at"]),
+                }
+                for ws in filter(None, str(meta["tables"]).split("\n")):
+                    df = pd.read_sql(f'SELECT * FROM "history:{ws}"', db)
+                    for c in date_columns:
+                        if c in df.columns: df[c] = pd.to_datetime(df[c], errors='coerce')
+                    data["history"][ws] = df
+            except Exception:
+                # Foto incompleta o de otra versión: se ignora y se sincroniza normalmente
+                return None
+            finally:
+                db.close()
+            self._loaded = (mtime, data)
+            return data
+
+
+def _records(df):
+    # SQLite devuelve None donde el libro tenía celdas vacías (NaN): se restaura para que todo se vea igual
+    return df.astype(object).where(df.notna(), float("nan")).to_dict('records')
+
+
+_WARM = {}
+_WARM_LOCK = threading.Lock()
+
+def get_warm_start(path):
+    """Foto en disco compartida por el proceso"""
+    with _WARM_LOCK:
+        if path not in _WARM:
+            _WARM[path] = WarmStart(path)
+        return _WARM[path]
@@ -0,0 +1,170 @@
+import hashlib
+import io
+import threading
+import time
+from datetime import datetime
+import pandas as pd
+from metrics import METRICS
+
+
+class WorkbookSnapshot:
+    """Foto del libro descargado, compartida (sólo lectura) por todas las sesiones"""
+    def __init__(self, xl, generation, digest=None):
+        self.xl = xl
+        self.generation = generation
+        self.digest = digest
+        self.sheet_names = list(xl.sheet_names)
+        self.synced_at = datetime.now()
+        self.fetched_at = time.time()
+        # Resultados derivados de esta generación (hojas parseadas, índices, ...)
+        self._memo = {}
+        # openpyxl no es seguro entre hilos: un parse a la vez sobre el mismo archivo
+        self._lock = threading.RLock()
+
+    def memo(self, key, build):
+        """Calcula build() una sola vez por generación y lo comparte entre sesiones"""
+        with self._lock:
+            if key not in self._memo:
+                self._memo[key] = build()
+            return self._memo[key]
+
+    def parse(self, sheet):
+        """DataFrame de la hoja, parseado una vez por generación. No modificar: es compartido.
+
+        Sin inferencia de tipos: cada celda queda como vino (texto como texto, "00123" no pierde los ceros),
+        igual en XLSX y en CSV. Sólo la celda vacía es faltante ("NA" queda como texto). Las columnas
+        numéricas se convierten donde se usan.
+        """
+        def build():
+            with METRICS.timer("sheet_parse", sheet=sheet):
+                return self.xl.parse(sheet, dtype=object, keep_default_na=False, na_values=[""])
+        return self.memo(("sheet", sheet), build)
+
+    def clear_memo(self):
+        with self._lock:
+            self._memo.clear()
+
+
+class CsvWorkbook:
+    """Libro armado con una descarga CSV por pestaña; expone la misma interfaz que pd.ExcelFile"""
+    def __init__(self, tabs):
+        self.tabs = tabs  # nombre de pestaña -> bytes CSV
+        self.sheet_names = list(tabs)
+
+    def parse(self, sheet, **kwargs):
+        return pd.read_csv(io.BytesIO(self.tabs[sheet]), **kwargs)
+
+
+class _Flight:
+    """Descarga en curso: el resto de las sesiones espera su resultado"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+def content_digest(payload):
+    """Hash del contenido descargado (bytes o dict pestaña -> bytes)"""
+    h = hashlib.sha1()
+    if isinstance(payload, dict):
+        for name in sorted(payload):
+            h.update(name.encode("utf-8"))
+            h.update(payload[name])
+    else:
+        h.update(payload)
+    return h.hexdigest()
+
+
+class WorkbookCache:
+    """Caché del libro a nivel de proceso con TTL y una sola descarga simultánea (single-flight)"""
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.snapshot = None
+        self.generation = 0
+        # Validadores HTTP (ETag / Last-Modified) de la última descarga
+        self.validators = {}
+        # Contadores de sincronización: sólo 'reloads' implica volver a abrir el libro
+        self.stats = {"checks": 0, "reloads": 0, "not_modified": 0, "unchanged": 0}
+        self._expired = False
+        self._flight = None
+        self._lock = threading.Lock()
+
+    def is_fresh(self):
+        s = self.snapshot
+        return s is not None and not self._expired and (time.time() - s.fetched_at) < self.ttl
+
+    def invalidate(self):
+        """Marca la foto como vencida (tras una escritura); la próxima lectura revalida contra el servidor"""
+        with self._lock:
+            self._expired = True
+            if self.snapshot is not None:
+                self.snapshot.clear_memo()
+
+    @property
+    def skipped(self):
+        """Sincronizaciones que no necesitaron volver a abrir el libro"""
+        return self.stats["not_modified"] + self.stats["unchanged"]
+
+    def _touch(self):
+        # La foto actual sigue vigente: sólo se renueva su TTL
+        self.snapshot.fetched_at = time.time()
+        self.snapshot.synced_at = datetime.now()
+        self._expired = False
+
+    def get(self, fetch, load, force=False):
+        """Devuelve (foto, error). Si venció o se fuerza, sólo una sesión revalida y las demás reutilizan.
+
+        fetch(validators) -> (payload, validators); payload None significa "sin cambios" (HTTP 304).
+        load(payload) abre el libro; sólo se llama si el contenido realmente cambió.
+        """
+        with self._lock:
+            if not force and self.is_fresh():
+                return self.snapshot, None
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            return self.snapshot, flight.error
+
+        try:
+            self.stats["checks"] += 1
+            has_snapshot = self.snapshot is not None
+            payload, validators = fetch(self.validators if has_snapshot else {})
+            if payload is None and has_snapshot:
+                self.stats["not_modified"] += 1
+                with self._lock:
+                    self._touch()
+            else:
+                digest = content_digest(payload)
+                if has_snapshot and digest == self.snapshot.digest:
+                    self.stats["unchanged"] += 1
+                    with self._lock:
+                        self._touch()
+                else:
+                    xl = load(payload)
+                    self.stats["reloads"] += 1
+                    with self._lock:
+                        self.generation += 1
+                        self.snapshot = WorkbookSnapshot(xl, self.generation, digest)
+                        self._expired = False
+            self.validators = validators or {}
+        except Exception as e:
+            flight.error = str(e)
+        finally:
+            with self._lock:
+                self._flight = None
+            flight.done.set()
+        return self.snapshot, flight.error
+
+
+# Una caché por documento, compartida por todo el proceso de Streamlit
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+def get_workbook_cache(doc_id, ttl=300):
+    with _CACHES_LOCK:
+        if doc_id not in _CACHES:
+            _CACHES[doc_id] = WorkbookCache(ttl)
+        return _CACHES[doc_id]